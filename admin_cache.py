@@ -0,0 +1,51 @@
+# admin_cache.py
+"""Cache por chat de los administradores del grupo."""
+
+from asyncio import ensure_future, shield
+from time import monotonic
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+ADMIN_STATUSES = ("administrator", "creator")
+
+
+class AdminCache:
+    """Administradores por chat, cargados en bloque con get_chat_administrators.
+
+    Cada chat expira después de ``ttl`` segundos o cuando llega un update de
+    ChatMember; las consultas simultáneas de un mismo chat comparten una sola
+    petición en curso.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._admins = {}  # chat_id -> (expira, {user_id})
+        self._inflight = {}  # chat_id -> Future de la carga en curso
+
+    async def is_admin(self, bot, chat_id, user_id):
+        entry = self._admins.get(chat_id)
+        if entry is None or entry[0] <= monotonic():
+            admins = await self._load(bot, chat_id)
+        else:
+            admins = entry[1]
+        return user_id in admins
+
+    def invalidate(self, chat_id):
+        self._admins.pop(chat_id, None)
+
+    def _load(self, bot, chat_id):
+        future = self._inflight.get(chat_id)
+        if future is None:
+            future = ensure_future(self._fetch(bot, chat_id))
+            self._inflight[chat_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(chat_id, None))
+        # shield: si quien espera se cancela, los demás siguen esperando la carga
+        return shield(future)
+
+    async def _fetch(self, bot, chat_id):
+        members = await bot.get_chat_administrators(chat_id)
+        admins = {m.user.id for m in members if m.status in ADMIN_STATUSES}
+        self._admins[chat_id] = (monotonic() + self.ttl, admins)
+        logger.info(f"👮 Admins cargados para chat {chat_id}: {len(admins)}")
+        return admins
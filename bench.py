@@ -0,0 +1,339 @@
+# bench.py
+"""Benchmark de los handlers con un Bot falso (sin red).
+
+Ejecuta una mezcla realista de comandos sobre varios chats con listas de espera
+del tamaño indicado y reporta throughput, latencias p50/p99 por comando,
+asignaciones de memoria y mensajes salientes por método. Los resultados se
+guardan en JSON para comparar versiones.
+
+    python bench.py --chats 10 --waiting 1000 --ops 20000 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import subprocess
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from time import perf_counter, perf_counter_ns
+
+from telegram import Chat, Message, MessageEntity, Update, User
+from telegram.ext import ApplicationHandlerStop
+
+import chat_state
+import main
+
+ADMIN_ID = 1
+ADMIN_USERNAME = main.CREATOR_USERNAME[1:]
+
+# Peso de cada comando en la mezcla
+DEFAULT_MIX = {
+    "z": 8,
+    "exitz": 4,
+    "espera": 25,
+    "cambiar": 8,
+    "exit": 15,
+    "tomarlibre": 10,
+    "lista": 30,
+    "rotacion": 0.05,  # job_turno con ZONE_LEASES, si no job_rotacion
+}
+
+
+class FakeBot:
+    """Bot que registra los envíos en lugar de llamar a la API"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._message_ids = count(1)
+
+    def _message(self, chat_id, text):
+        message = Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(timezone.utc),
+            chat=Chat(chat_id, Chat.GROUP),
+            text=text,
+        )
+        message.set_bot(self)
+        return message
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls["send_message"] += 1
+        return self._message(chat_id, text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.calls["edit_message_text"] += 1
+        return True
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs):
+        self.calls["pin_chat_message"] += 1
+        return True
+
+    async def get_chat_administrators(self, chat_id, **kwargs):
+        self.calls["get_chat_administrators"] += 1
+        admin = type(
+            "Member", (), {"status": "creator", "user": User(ADMIN_ID, "a", False)}
+        )
+        return [admin()]
+
+
+class FakeApplication:
+    def __init__(self, bot):
+        self.bot = bot
+
+    def create_task(self, coroutine, **kwargs):
+        return asyncio.create_task(coroutine)
+
+
+class FakeContext:
+    """Lo mínimo de CallbackContext que usan los handlers"""
+
+    __slots__ = ("bot", "application", "args")
+
+    def __init__(self, application, args=()):
+        self.bot = application.bot
+        self.application = application
+        self.args = list(args)
+
+
+def make_update(bot, update_id, chat_id, user_id, username, text):
+    user = User(user_id, username, False, username=username)
+    message = Message(
+        message_id=update_id,
+        date=datetime.now(timezone.utc),
+        chat=Chat(chat_id, Chat.SUPERGROUP),
+        from_user=user,
+        text=text,
+        entities=[MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0]))],
+    )
+    message.set_bot(bot)
+    return Update(update_id, message=message)
+
+
+class Workload:
+    """Genera comandos aleatorios (semilla fija) sobre los chats del benchmark"""
+
+    def __init__(self, bot, application, chats, zones, waiting, users, mix, seed):
+        self.bot = bot
+        self.application = application
+        self.chat_ids = [-1000 - i for i in range(chats)]
+        self.zones = zones
+        self.waiting = waiting
+        self.users = users
+        self.random = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.update_ids = count(1)
+
+    def user(self):
+        user_id = 10_000 + self.random.randrange(self.users)
+        return user_id, f"u{user_id}"
+
+    async def setup(self):
+        for i in range(self.users):
+            user_id = 10_000 + i
+            chat_state.remember_user(
+                User(user_id, f"u{user_id}", False, username=f"u{user_id}")
+            )
+        for chat_id in self.chat_ids:
+            await self.run("/autorizar", chat_id, ADMIN_ID, ADMIN_USERNAME)
+            await self.run("/abrir", chat_id, ADMIN_ID, ADMIN_USERNAME)
+            state = chat_state.find_chat(chat_id)
+            state.set_zones(self.zones)
+            for i in range(self.waiting):
+                state.enqueue(10_000 + i)
+            main.fill_free_zones(state)
+
+    async def run(self, text, chat_id, user_id, username):
+        update = make_update(
+            self.bot, next(self.update_ids), chat_id, user_id, username, text
+        )
+        command, *args = text[1:].split()
+        context = FakeContext(self.application, args)
+        try:
+            await main.guard(update, context)
+        except ApplicationHandlerStop:
+            return
+        handler = HANDLERS.get(command, main.cmd_zona)  # /z<N> y /exitz<N>
+        await handler(update, context)
+
+    def next_command(self):
+        """(tipo, texto, chat_id, user_id, username)"""
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        chat_id = self.random.choice(self.chat_ids)
+        user_id, username = self.user()
+        zone = self.random.randint(1, self.zones)
+        if kind == "z":
+            text = f"/z{zone}"
+        elif kind == "exitz":
+            text = f"/exitz{zone}"
+        elif kind == "cambiar":
+            other = 10_000 + self.random.randrange(self.users)
+            text = f"/cambiar @u{other}"
+        else:
+            text = f"/{kind}"
+        return kind, text, chat_id, user_id, username
+
+    async def rotate(self, chat_id):
+        """Rotar como en producción; devuelve el tipo medido. Con ZONE_LEASES
+        vence el turno más viejo del chat (job_turno); si no, job_rotacion"""
+        if not main.ZONE_LEASES:
+            await main.job_rotacion(self.application, chat_id)
+            return "rotacion"
+        state = chat_state.find_chat(chat_id)
+        occupied = [zone for zone, user in state.queue.zones.items() if user]
+        zone = min(
+            occupied, key=lambda z: state.leases.get(z) or datetime.min, default=None
+        )
+        if zone is None:
+            zone = next(iter(state.queue.zones))  # Nada que vencer
+        else:
+            state.leases[zone] = datetime.now() - timedelta(
+                minutes=main.ROTATION_DURATION_MINUTES
+            )
+        await main.job_turno(self.application, (chat_id, zone))
+        return "turno"
+
+
+HANDLERS = {
+    "autorizar": main.cmd_autorizar,
+    "abrir": main.cmd_abrir,
+    "lista": main.cmd_lista,
+    "espera": main.cmd_espera,
+    "cambiar": main.cmd_cambiar,
+    "exit": main.cmd_exit,
+    "tomarlibre": main.cmd_tomarlibre,
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(chats, zones, waiting, users, ops, mix, seed, trace_alloc):
+    chat_state.chats.clear()
+    bot = FakeBot()
+    application = FakeApplication(bot)
+    workload = Workload(bot, application, chats, zones, waiting, users, mix, seed)
+    await workload.setup()
+    bot.calls.clear()
+
+    latencies = defaultdict(list)
+    if trace_alloc:
+        tracemalloc.start()
+        alloc_before = tracemalloc.get_traced_memory()[0]
+    started = perf_counter()
+    for _ in range(ops):
+        kind, text, chat_id, user_id, username = workload.next_command()
+        t0 = perf_counter_ns()
+        if kind == "rotacion":
+            kind = await workload.rotate(chat_id)
+        else:
+            await workload.run(text, chat_id, user_id, username)
+        latencies[kind].append(perf_counter_ns() - t0)
+    elapsed = perf_counter() - started
+    await main.read_replies.drain()  # Respuestas compartidas aún programadas
+    allocations = None
+    if trace_alloc:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocations = {"net_bytes": current - alloc_before, "peak_bytes": peak}
+
+    commands = {}
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        commands[kind] = {
+            "count": len(values),
+            "p50_us": percentile(values, 0.50) / 1000,
+            "p99_us": percentile(values, 0.99) / 1000,
+            "mean_us": sum(values) / len(values) / 1000,
+        }
+    return {
+        "params": {
+            "chats": chats,
+            "zones": zones,
+            "waiting": waiting,
+            "users": users,
+            "ops": ops,
+            "seed": seed,
+            "mix": mix,
+        },
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "elapsed_s": elapsed,
+        "throughput_ops_s": ops / elapsed,
+        "commands": commands,
+        "outbound": dict(bot.calls),
+        "allocations": allocations,
+    }
+
+
+def print_report(result):
+    params = result["params"]
+    print(
+        f"chats={params['chats']} zonas={params['zones']} espera={params['waiting']} ops={params['ops']} "
+        f"-> {result['throughput_ops_s']:.0f} ops/s"
+    )
+    print(f"{'comando':<12}{'n':>8}{'p50 µs':>12}{'p99 µs':>12}")
+    for kind, stats in result["commands"].items():
+        print(
+            f"{kind:<12}{stats['count']:>8}{stats['p50_us']:>12.1f}{stats['p99_us']:>12.1f}"
+        )
+    print("salientes:", result["outbound"])
+    if result["allocations"]:
+        print("memoria:", result["allocations"])
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--zones", type=int, default=chat_state.DEFAULT_ZONE_COUNT)
+    parser.add_argument("--waiting", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX)
+    parser.add_argument("--alloc", action="store_true", help="medir memoria")
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    result = asyncio.run(
+        run_benchmark(
+            args.chats,
+            args.zones,
+            args.waiting,
+            args.users,
+            args.ops,
+            args.mix,
+            args.seed,
+            args.alloc,
+        )
+    )
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,67 @@
+# chat_order.py
+"""Procesador de updates: chats distintos en paralelo, cada chat en orden."""
+
+from asyncio import Semaphore, get_running_loop
+from collections import deque
+from sys import maxsize
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderProcessor(BaseUpdateProcessor):
+    """Procesa hasta ``max_concurrent_updates`` updates en paralelo (como
+    ``concurrent_updates``), de a uno por chat y en orden de llegada.
+
+    Los updates de un chat esperan su turno en el buzón del chat sin ocupar
+    lugar: solo el que está en turno toma uno de los lugares, así una ráfaga
+    en un chat no deja sin lugares a los demás.
+    """
+
+    __slots__ = ("_slots", "_chats")
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates debe ser positivo")
+        # PTB toma su semáforo antes de do_process_update, también para los
+        # updates que esperan turno en un buzón: el límite lo pone _slots
+        super().__init__(maxsize)
+        self._slots = Semaphore(max_concurrent_updates)
+        self._chats = {}  # chat_id -> buzón: futures en orden, el primero en turno
+
+    async def do_process_update(self, update, coroutine):
+        await self._in_chat_order(update, coroutine)
+
+    async def _in_chat_order(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self._slots:
+                await coroutine
+            return
+        mailbox = self._chats.get(chat.id)
+        if mailbox is None:
+            mailbox = self._chats[chat.id] = deque()
+        turn = get_running_loop().create_future()
+        mailbox.append(turn)
+        if len(mailbox) == 1:
+            turn.set_result(None)
+        try:
+            await turn
+            async with self._slots:
+                await coroutine
+        finally:
+            first = mailbox[0] is turn
+            mailbox.remove(turn)
+            if not mailbox:
+                del self._chats[chat.id]
+            elif first and not mailbox[0].done():
+                mailbox[0].set_result(None)  # Turno del siguiente
+
+    def busy(self, chat_id):
+        """Si hay updates del chat en proceso o esperando su turno"""
+        return chat_id in self._chats
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,363 @@
+# chat_state.py
+"""Estado por chat: zonas, lista de espera y rotación de cada grupo.
+
+Toda mutación pasa por los métodos de ChatState (o por authorize_chat /
+deauthorize_chat / remember_user) y se notifica a los listeners registrados
+con add_listener(), p. ej. el journal de persistencia.
+
+Las zonas y la lista de espera guardan ids numéricos de usuario; los datos
+para mostrarlos viven en la tabla ``users``.
+"""
+
+from asyncio import Lock
+from datetime import datetime
+from weakref import WeakValueDictionary
+
+from zone_queue import LIBRE, ZoneQueue, zone_names
+from users import UserTable
+
+DEFAULT_ZONE_COUNT = 3
+USERS_CHAT_ID = 0  # chat_id con el que se notifican los cambios de la tabla de usuarios
+
+# Funciones listener(chat_id, op, args) llamadas después de cada mutación
+_listeners = []
+_replaying = False
+
+
+def add_listener(listener):
+    _listeners.append(listener)
+
+
+def _emit(chat_id, op, args=()):
+    if _replaying:
+        return
+    for listener in _listeners:
+        listener(chat_id, op, args)
+
+
+class ChatState:
+    """Estado de la lista de un solo chat"""
+
+    __slots__ = (
+        "chat_id",
+        "authorized",
+        "list_open",
+        "queue",
+        "last_rotation_time",
+        "leases",
+        "render_cache",
+    )
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.authorized = False
+        self.list_open = False
+        self.queue = ZoneQueue(zone_names(DEFAULT_ZONE_COUNT))
+        self.last_rotation_time = None
+        self.leases = {}  # zona -> inicio del turno de quien la ocupa
+        self.render_cache = {}  # Secciones ya renderizadas de format_list
+
+    def reset(self):
+        """Vaciar zonas y lista de espera"""
+        self.queue.clear()
+        self.leases.clear()
+
+    # Mutaciones (cada una se notifica a los listeners)
+    def open(self, now):
+        self.list_open = True
+        self.last_rotation_time = now
+        _emit(self.chat_id, "open", (now.timestamp(),))
+
+    def close(self):
+        self.list_open = False
+        self.queue.clear()
+        self.leases.clear()
+        _emit(self.chat_id, "close")
+
+    def assign(self, zone, user, now=None):
+        """Asignar la zona; con ``now`` el turno empieza en ese momento"""
+        self.queue.assign(zone, user)
+        if now is None:
+            _emit(self.chat_id, "assign", (zone, user))
+            return
+        self.leases[zone] = now
+        _emit(self.chat_id, "assign", (zone, user, now.timestamp()))
+
+    def vacate(self, zone):
+        user = self.queue.vacate(zone)
+        self.leases.pop(zone, None)
+        _emit(self.chat_id, "vacate", (zone,))
+        return user
+
+    def promote(self, zone, now):
+        """Pasar el primero de la espera a la zona vacía con un turno nuevo;
+        devuelve el usuario o None si no hay nadie esperando"""
+        user = self.queue.promote(zone)
+        if user is not None:
+            self.leases[zone] = now
+        _emit(self.chat_id, "promote", (zone, now.timestamp()))
+        return user
+
+    def enqueue(self, user):
+        self.queue.enqueue(user)
+        _emit(self.chat_id, "enqueue", (user,))
+
+    def leave(self, user):
+        removed = self.queue.leave(user)
+        if removed:
+            if removed[0] != "wait":
+                self.leases.pop(removed[0], None)
+            _emit(self.chat_id, "leave", (user,))
+        return removed
+
+    def take_free(self, user):
+        taken = self.queue.take_free(user)
+        if taken:
+            _emit(self.chat_id, "take_free", (user,))
+        return taken
+
+    def swap(self, user1, user2):
+        swapped = self.queue.swap(user1, user2)
+        if swapped:
+            _emit(self.chat_id, "swap", (user1, user2))
+        return swapped
+
+    def reorder(self, users):
+        """Pasar usuarios de la espera al frente; devuelve los que se movieron"""
+        moved = self.queue.reorder(users)
+        if moved:
+            _emit(self.chat_id, "reorder", (moved,))
+        return moved
+
+    def rename(self, old, new):
+        renamed = self.queue.rename(old, new)
+        if renamed:
+            for zone in [z for z in self.leases if self.queue.zones[z] is None]:
+                del self.leases[zone]  # ``new`` ya tenía lugar: ``old`` dejó la zona
+            _emit(self.chat_id, "rename", (old, new))
+        return renamed
+
+    def set_zones(self, count):
+        """Cambiar la cantidad de zonas; devuelve [(zona, usuario)] desalojados"""
+        evicted = self.queue.resize(zone_names(count))
+        for zone, _ in evicted:
+            self.leases.pop(zone, None)
+        _emit(self.chat_id, "set_zones", (count,))
+        return evicted
+
+    def rotate(self, now):
+        promoted = self.queue.rotate()
+        self.last_rotation_time = now
+        self.leases = {zone: now for zone, _ in promoted}
+        _emit(self.chat_id, "rotate", (now.timestamp(),))
+        return promoted
+
+    # Snapshots
+    def to_dict(self):
+        return {
+            "authorized": self.authorized,
+            "list_open": self.list_open,
+            "last_rotation_time": (
+                self.last_rotation_time.timestamp() if self.last_rotation_time else None
+            ),
+            "queue": self.queue.to_dict(),
+            "leases": {zone: start.timestamp() for zone, start in self.leases.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, chat_id, data):
+        state = cls(chat_id)
+        state.authorized = data["authorized"]
+        state.list_open = data["list_open"]
+        if data["last_rotation_time"] is not None:
+            state.last_rotation_time = datetime.fromtimestamp(
+                data["last_rotation_time"]
+            )
+        state.queue = ZoneQueue.from_dict(_migrate_queue(data["queue"]))
+        state.leases = {
+            zone: datetime.fromtimestamp(start)
+            for zone, start in data.get("leases", {}).items()
+        }
+        return state
+
+
+# Registro de chats: chat_id -> ChatState
+chats = {}
+
+# Tabla de usuarios compartida por todos los chats
+users = UserTable()
+
+# Un lock por chat mientras alguien lo use (se libera solo al no tener referencias)
+_locks = WeakValueDictionary()
+
+
+def chat_lock(chat_id):
+    """Lock que serializa los handlers y la rotación de un mismo chat"""
+    lock = _locks.get(chat_id)
+    if lock is None:
+        lock = _locks[chat_id] = Lock()
+    return lock
+
+
+def get_chat(chat_id):
+    """Obtener (o crear) el estado del chat"""
+    state = chats.get(chat_id)
+    if state is None:
+        state = chats[chat_id] = ChatState(chat_id)
+    return state
+
+
+def find_chat(chat_id):
+    """Obtener el estado del chat sin crearlo (None si no existe)"""
+    return chats.get(chat_id)
+
+
+def drop_chat(chat_id):
+    """Eliminar el estado del chat del registro"""
+    return chats.pop(chat_id, None)
+
+
+def authorize_chat(chat_id):
+    """Autorizar el chat con zonas y lista de espera vacías"""
+    state = get_chat(chat_id)
+    state.authorized = True
+    state.reset()
+    _emit(chat_id, "authorize")
+    return state
+
+
+def deauthorize_chat(chat_id):
+    """Quitar la autorización y eliminar el estado del chat"""
+    state = drop_chat(chat_id)
+    _emit(chat_id, "deauthorize")
+    return state
+
+
+def remember_user(user):
+    """Registrar (o actualizar) al usuario de Telegram y devolver su id"""
+    changed, replaced = users.update(user.id, user.username, user.first_name)
+    if changed:
+        _emit(USERS_CHAT_ID, "user", (user.id, user.username, user.first_name))
+        if replaced is not None:
+            # Alguien lo había mencionado antes de que escribiera: migrar sus lugares
+            for state in chats.values():
+                state.rename(replaced, user.id)
+    return user.id
+
+
+def set_notifications(user_id, enabled):
+    """Activar o desactivar los avisos privados del usuario"""
+    if users.set_notify(user_id, enabled):
+        _emit(USERS_CHAT_ID, "notify", (user_id, enabled))
+
+
+def mention_user(mention):
+    """Id del @usuario mencionado; si el bot aún no lo vio, un id provisorio"""
+    user_id = users.find(mention)
+    if user_id is None:
+        user_id = users.new_placeholder()
+        username = mention.lstrip("@")
+        users.update(user_id, username, None)
+        _emit(USERS_CHAT_ID, "user", (user_id, username, None))
+    return user_id
+
+
+def _legacy_user(user):
+    """Convertir un "@usuario" guardado antes de los ids numéricos"""
+    if isinstance(user, str) and user != LIBRE:
+        return mention_user(user)
+    return user
+
+
+def _migrate_queue(data):
+    """Cola de un snapshot con los "@usuario" de antes convertidos a ids"""
+    return {
+        "zones": {zone: _legacy_user(u) for zone, u in data["zones"].items()},
+        "waiting": [_legacy_user(u) for u in data["waiting"]],
+    }
+
+
+def dump_chats():
+    """Snapshot serializable de todos los chats y de la tabla de usuarios"""
+    return {
+        "users": users.to_dict(),
+        "chats": {str(chat_id): state.to_dict() for chat_id, state in chats.items()},
+    }
+
+
+def load_chats(data):
+    """Reemplazar el registro con un snapshot de dump_chats()"""
+    if "chats" not in data:
+        data = {"users": [], "chats": data}  # Snapshot anterior a la tabla de usuarios
+    users.clear()
+    for user_id, username, first_name, *notify in data["users"]:
+        users.update(user_id, username, first_name)
+        if notify and notify[0]:
+            users.set_notify(user_id, True)
+    chats.clear()
+    for chat_id, state_data in data["chats"].items():
+        chats[int(chat_id)] = ChatState.from_dict(int(chat_id), state_data)
+
+
+def load_chat(chat_id, data):
+    """Reemplazar el estado de un chat con uno guardado por otro proceso
+    (None: el chat no tiene estado). Devuelve el ChatState o None"""
+    if data is None:
+        chats.pop(chat_id, None)
+        state = None
+    else:
+        state = chats[chat_id] = ChatState.from_dict(chat_id, data)
+    _emit(chat_id, "load", (data,))
+    return state
+
+
+def unload_chat(chat_id):
+    """Soltar el estado de un chat que pasó a otro proceso"""
+    state = chats.pop(chat_id, None)
+    _emit(chat_id, "unload")
+    return state
+
+
+def merge_users(rows):
+    """Aplicar registros [user_id, username, first_name, notify] que llegaron
+    de otro proceso; si reemplazan un id provisorio se migran sus lugares"""
+    for user_id, username, first_name, notify in rows:
+        changed, replaced = users.update(user_id, username, first_name)
+        users.set_notify(user_id, notify)
+        if replaced is not None:
+            for state in chats.values():
+                state.rename(replaced, user_id)
+
+
+def apply_record(chat_id, op, args):
+    """Volver a aplicar una mutación registrada (sin notificar a los listeners)"""
+    global _replaying
+    _replaying = True
+    try:
+        if op == "user":
+            users.update(*args)
+        elif op == "notify":
+            users.set_notify(*args)
+        elif op == "authorize":
+            authorize_chat(chat_id)
+        elif op == "deauthorize":
+            deauthorize_chat(chat_id)
+        elif op == "load":
+            load_chat(chat_id, args[0])
+        elif op == "unload":
+            unload_chat(chat_id)
+        else:
+            state = get_chat(chat_id)
+            if op in ("open", "rotate"):
+                args = (datetime.fromtimestamp(args[0]),)
+            elif op == "assign":
+                # El inicio del turno se registra desde las leases por zona
+                now = [datetime.fromtimestamp(t) for t in args[2:]]
+                args = (args[0], _legacy_user(args[1]), *now)
+            elif op == "promote":
+                args = (args[0], datetime.fromtimestamp(args[1]))
+            elif op in ("enqueue", "leave", "take_free", "swap"):
+                args = [_legacy_user(u) for u in args]
+            getattr(state, op)(*args)
+    finally:
+        _replaying = False
@@ -0,0 +1,117 @@
+# checkpoint.py
+"""Marca del último update procesado para reanudar sin perder ni repetir updates."""
+
+from asyncio import Queue
+from contextvars import ContextVar
+from heapq import heappush, heappop
+from logging import getLogger
+
+from telegram import Update
+
+from chat_order import ChatOrderProcessor
+
+logger = getLogger(__name__)
+
+# Update que se está procesando (el journal lo guarda con cada mutación)
+current_update_id = ContextVar("current_update_id", default=None)
+
+
+class CheckpointProcessor(ChatOrderProcessor):
+    """ChatOrderProcessor que además lleva la marca del último update_id
+    procesado sin huecos: todos los anteriores ya terminaron.
+
+    El orden por chat incluye el filtro previo, así cada comando ve el estado
+    que dejaron los anteriores.
+
+    Cada vez que la marca avanza se llama a ``on_checkpoint(update_id)`` (el
+    journal la guarda junto con las mutaciones que la produjeron). Los updates
+    que ya pasaron la marca, los de ``applied`` (cambiaron el estado antes del
+    reinicio sin llegar a la marca) y los que ya están en proceso (reintentos
+    del webhook) se descartan. ``on_done(update_id)`` se llama al terminar
+    cada update, antes de que la marca llegue a él.
+    """
+
+    __slots__ = (
+        "on_checkpoint",
+        "on_done",
+        "last_update_id",
+        "_inflight",
+        "_seen",
+        "_done",
+        "_applied",
+    )
+
+    def __init__(
+        self,
+        max_concurrent_updates,
+        on_checkpoint,
+        resume_from=0,
+        applied=(),
+        on_done=None,
+    ):
+        super().__init__(max_concurrent_updates)
+        self.on_checkpoint = on_checkpoint
+        self.on_done = on_done
+        self.last_update_id = resume_from
+        self._inflight = []  # heap de update_id sin confirmar
+        self._seen = set()  # los mismos ids, para descartar duplicados
+        self._done = set()  # terminados que esperan a uno anterior
+        self._applied = set(applied)
+
+    async def do_process_update(self, update, coroutine):
+        update_id = getattr(update, "update_id", None)
+        if update_id is None:
+            await self._in_chat_order(update, coroutine)
+            return
+        if (
+            update_id <= self.last_update_id
+            or update_id in self._seen
+            or update_id in self._applied
+        ):
+            coroutine.close()
+            logger.info(f"⏭️ Update {update_id} ya procesado")
+            return
+
+        heappush(self._inflight, update_id)
+        self._seen.add(update_id)
+        current_update_id.set(update_id)
+        try:
+            await self._in_chat_order(update, coroutine)
+        finally:
+            if self.on_done:
+                self.on_done(update_id)
+            self._done.add(update_id)
+            advanced = False
+            while self._inflight and self._inflight[0] in self._done:
+                self.last_update_id = heappop(self._inflight)
+                self._done.discard(self.last_update_id)
+                self._seen.discard(self.last_update_id)
+                advanced = True
+            if advanced:
+                if self._applied:
+                    # Un update aplicado puede llegar dos veces (del journal y
+                    # de Telegram): se olvida recién cuando la marca lo pasa
+                    self._applied = {
+                        u for u in self._applied if u > self.last_update_id
+                    }
+                self.on_checkpoint(self.last_update_id)
+
+
+class JournaledUpdateQueue(Queue):
+    """update_queue de la Application que guarda cada update recibido antes
+    de encolarlo: ``accept(update_id, datos)`` vuelve cuando está escrito.
+
+    El Updater de PTB pide el próximo getUpdates (que confirma el lote a
+    Telegram) recién después de encolar el lote, y el webhook responde 200
+    después de encolar el update: lo confirmado ya está guardado, y si el
+    proceso muere los que no terminaron se vuelven a procesar al arrancar.
+    """
+
+    def __init__(self, accept):
+        super().__init__()
+        self.accept = accept
+
+    async def put(self, item):
+        if isinstance(item, Update):
+            await self.accept(item.update_id, item.to_dict())
+        await super().put(item)
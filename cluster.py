@@ -0,0 +1,507 @@
+# cluster.py
+"""Modo cluster: varios procesos del bot se reparten los chats.
+
+Telegram entrega los updates a un solo consumidor de getUpdates, así que uno
+de los workers (el líder, elegido con un lease en el store) los pide a
+Telegram y deja cada uno en el buzón del worker dueño de su chat según un
+hash consistente del chat id. Cada worker corre la Application de siempre,
+con un request de getUpdates que lee su buzón en lugar de Telegram.
+
+Para cambiar un chat (o rotarlo) un worker tiene que tener su lease en el
+store; al tomarlo carga el estado guardado por el dueño anterior. Los cambios
+se guardan en el store antes de confirmar los updates del buzón, y el guardado
+se rechaza si el lease pasó a otro worker: así cada rotación se aplica una
+sola vez aunque dos workers crean ser dueños del chat durante un cambio.
+"""
+
+import json
+from asyncio import Event, Lock, create_task, gather, sleep, to_thread
+from bisect import bisect
+from time import monotonic
+from zlib import crc32
+from logging import getLogger
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import BaseRequest
+
+import chat_state
+from chat_state import chats, users, chat_lock, USERS_CHAT_ID
+from checkpoint import current_update_id
+from shared_store import chat_lease
+
+logger = getLogger(__name__)
+
+LEADER_LEASE = "leader"
+ACQUIRE_RETRY_SECONDS = 0.2  # Espera entre intentos de tomar el lease de un chat
+PLACEHOLDER_BLOCK = 1 << 16  # Ids provisorios que un worker reserva de una vez
+
+
+class HashRing:
+    """Hash consistente: cada worker ocupa ``replicas`` puntos del anillo y un
+    chat es del primer punto después de su hash. Al sumar o quitar un worker
+    solo cambian de dueño los chats de los tramos que ganó o perdió."""
+
+    def __init__(self, workers, replicas=64):
+        points = sorted(
+            (crc32(f"{worker}#{i}".encode()), worker)
+            for worker in workers
+            for i in range(replicas)
+        )
+        self.workers = tuple(sorted(workers))
+        self._hashes = [h for h, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    def owner(self, key):
+        if not self._owners:
+            return None
+        i = bisect(self._hashes, crc32(str(key).encode())) % len(self._hashes)
+        return self._owners[i]
+
+
+def update_key(update):
+    """Clave de reparto del update: su chat (o el usuario si no tiene chat)"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return 0
+
+
+class InboxRequest(BaseRequest):
+    """Request de getUpdates que lee el buzón del worker en el store: la
+    Application hace polling como siempre, pero sin hablar con Telegram.
+    Los updates quedan en el buzón hasta que Cluster confirma que se
+    procesaron (aunque el offset de getUpdates avance antes).
+
+    El update_id que recibe la Application es la secuencia del buzón (crece
+    también para los updates que llegan de un worker caído); el de Telegram
+    queda en ``telegram_ids`` hasta que el update se confirma.
+    """
+
+    def __init__(self, store, worker, poll_interval=0.05):
+        self.store = store
+        self.worker = worker
+        self.poll_interval = poll_interval
+        self.telegram_ids = {}  # secuencia -> update_id de Telegram
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if not url.endswith("/getUpdates"):
+            raise TelegramError(f"InboxRequest solo atiende getUpdates: {url}")
+        params = request_data.parameters if request_data else {}
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = monotonic() + float(params.get("timeout") or 0)
+        while True:
+            rows = await to_thread(self.store.fetch_updates, self.worker, offset, limit)
+            if rows or monotonic() >= deadline:
+                break
+            await sleep(self.poll_interval)
+        result = []
+        for seq, data in rows:
+            update = json.loads(data)
+            self.telegram_ids[seq] = update["update_id"]
+            update["update_id"] = seq
+            result.append(update)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def acked(self, seq):
+        """Olvidar los ids de Telegram de los updates confirmados"""
+        for key in [key for key in self.telegram_ids if key <= seq]:
+            del self.telegram_ids[key]
+
+
+class PlaceholderIds:
+    """Ids provisorios (users.placeholder_source) sin I/O en el event loop:
+    el worker reserva bloques en el store y reparte los suyos localmente. El
+    bloque siguiente se pide en un hilo cuando el actual va por la mitad."""
+
+    def __init__(self, store, block=PLACEHOLDER_BLOCK):
+        self.store = store
+        self.block = block
+        self._low = 0  # Bloque actual: [_low, _next] (se reparte de arriba abajo)
+        self._next = -1
+        self._spare = None  # Task que reserva el bloque siguiente
+
+    def reserve(self):
+        """Reservar el primer bloque (bloqueante: al arrancar)"""
+        self._use(self.store.reserve_placeholders(self.block))
+
+    def __call__(self):
+        if self._next < self._low:
+            self._use(self._take_spare())
+        user_id = self._next
+        self._next -= 1
+        if self._spare is None and self._next - self._low < self.block // 2:
+            self._spare = create_task(
+                to_thread(self.store.reserve_placeholders, self.block)
+            )
+        return user_id
+
+    def _use(self, low):
+        self._low = low
+        self._next = low + self.block - 1
+
+    def _take_spare(self):
+        spare, self._spare = self._spare, None
+        if spare is not None and spare.done() and spare.exception() is None:
+            return spare.result()
+        # Medio bloque de menciones nuevas antes de que responda el store (o
+        # el pedido falló): se reserva aquí mismo
+        logger.warning("🧩 Reservando ids provisorios sin el bloque siguiente")
+        return self.store.reserve_placeholders(self.block)
+
+
+class Cluster:
+    """Lo que un worker hace para coordinarse con los demás a través del store.
+
+    - ``record``: listener de chat_state; anota qué chats y usuarios guardar.
+    - ``checkpoint``: marca de CheckpointProcessor; los updates hasta ahí se
+      sacan del buzón después de guardar sus cambios.
+    - ``ensure_chat``: handler previo (antes del filtro) que toma el lease
+      del chat y carga su estado, o descarta el update si ya se aplicó.
+    - ``confirm``: antes de rotar, renovar el lease del chat.
+
+    ``on_acquire(state)`` y ``on_release(state)`` programan y cancelan las
+    rotaciones del chat que se toma o se deja. ``busy(chat_id)`` dice si hay
+    updates del chat en proceso (un chat así no se suelta todavía).
+    """
+
+    def __init__(
+        self,
+        store,
+        worker,
+        lease_seconds,
+        poll_bot=None,
+        on_acquire=None,
+        on_release=None,
+    ):
+        self.store = store
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        # Bot con el request normal: el líder lo usa para hablar con Telegram
+        self.poll_bot = poll_bot
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.busy = lambda chat_id: False
+        self.ring = HashRing([worker])
+        self._held = {}  # chat_id -> último update aplicado al chat
+        self._dirty_chats = set()
+        self._dirty_users = set()
+        self._checkpoint = 0  # Último update procesado sin huecos
+        self._acked = 0
+        self._users_seq = 0
+        self._flush_needed = Event()
+        self._flush_lock = Lock()
+        self._tasks = []
+        self._poller = None
+        self._releasing = set()  # Chats que se están por soltar
+        self._inbox = InboxRequest(store, worker)
+        # El poller del líder y el reparto de buzones huérfanos, de a uno
+        self._route_lock = Lock()
+        self._routed = None  # Anillo con el que ya se repartieron los huérfanos
+
+    def inbox_request(self):
+        return self._inbox
+
+    def telegram_id(self, update_id):
+        """update_id de Telegram de un update recibido del buzón"""
+        return self._inbox.telegram_ids.get(update_id, update_id)
+
+    def load(self):
+        """Cargar la tabla de usuarios compartida y registrarse como listener"""
+        rows, self._users_seq = self.store.users_since(0)
+        chat_state.merge_users(rows)
+        placeholders = PlaceholderIds(self.store)
+        placeholders.reserve()
+        users.placeholder_source = placeholders
+        chat_state.add_listener(self.record)
+        logger.info(f"🧩 Worker {self.worker}: {len(users)} usuarios cargados")
+
+    def start(self):
+        self._tasks = [
+            create_task(self._heartbeat()),
+            create_task(self._flusher()),
+        ]
+
+    async def stop(self):
+        """Guardar lo pendiente y soltar los leases para que otro tome los chats"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self._stop_polling()
+        await self.flush()
+        names = [chat_lease(chat_id) for chat_id in self._held] + [LEADER_LEASE]
+        await to_thread(self.store.release, names, self.worker)
+        await to_thread(self.store.remove_worker, self.worker)
+        logger.info(f"🧩 Worker {self.worker} detenido ({len(self._held)} chats)")
+
+    # Llamados desde el bot
+    def record(self, chat_id, op, args):
+        if chat_id == USERS_CHAT_ID:
+            if op in ("user", "notify"):
+                self._dirty_users.add(args[0])
+        elif op in ("load", "unload"):
+            return  # El chat cambió de dueño, no de estado
+        else:
+            self._dirty_chats.add(chat_id)
+            update_id = current_update_id.get()
+            if update_id is not None and chat_id in self._held:
+                update_id = self.telegram_id(update_id)
+                self._held[chat_id] = max(self._held[chat_id], update_id)
+        self._flush_needed.set()
+
+    def checkpoint(self, update_id):
+        self._checkpoint = update_id
+        self._flush_needed.set()
+
+    async def ensure_chat(self, update, context):
+        chat = update.effective_chat
+        if chat is None or chat.type == "private":
+            return  # Sin estado de chat (p. ej. /avisos por privado)
+        if chat.id not in self._held:
+            await self._acquire(chat.id)
+        update_id = self.telegram_id(update.update_id)
+        if update_id <= self._held[chat.id]:
+            logger.info(f"⏭️ Update {update_id} ya aplicado al chat {chat.id}")
+            raise ApplicationHandlerStop
+
+    async def confirm(self, chat_id):
+        """Renovar el lease del chat antes de rotarlo; False si ya no es nuestro"""
+        if chat_id not in self._held:
+            return False
+        if await to_thread(
+            self.store.acquire, chat_lease(chat_id), self.worker, self.lease_seconds
+        ):
+            return True
+        logger.warning(f"🧩 El chat {chat_id} pasó a otro worker")
+        self._drop(chat_id)
+        return False
+
+    # Estado compartido
+    async def flush(self):
+        """Guardar los chats y usuarios cambiados y confirmar los updates"""
+        async with self._flush_lock:
+            checkpoint = self._checkpoint
+            items = []
+            for chat_id in self._dirty_chats:
+                if chat_id in self._held:
+                    state = chats.get(chat_id)
+                    data = state.to_dict() if state is not None else None
+                    items.append((chat_id, data, self._held[chat_id]))
+            rows = []
+            for user_id in self._dirty_users:
+                record = users.get(user_id)
+                if record is not None:
+                    rows.append(
+                        [user_id, record.username, record.first_name, record.notify]
+                    )
+            self._dirty_chats = set()
+            self._dirty_users = set()
+            if items:
+                rejected = await to_thread(self.store.save_chats, self.worker, items)
+                for chat_id in rejected:
+                    logger.error(
+                        f"🧩 Cambios del chat {chat_id} rechazados: otro worker lo tomó"
+                    )
+                    self._drop(chat_id)
+            if rows:
+                await to_thread(self.store.save_users, rows)
+            if checkpoint > self._acked:
+                await to_thread(self.store.ack_updates, self.worker, checkpoint)
+                self._acked = checkpoint
+                self._inbox.acked(checkpoint)
+
+    async def _flusher(self):
+        while True:
+            await self._flush_needed.wait()
+            self._flush_needed.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error al guardar en el store compartido: {e!r}")
+                self._flush_needed.set()
+                await sleep(1)
+
+    async def _acquire(self, chat_id, wait=True):
+        """Tomar el lease del chat y cargar su estado. Con ``wait`` espera a
+        que el dueño anterior lo suelte o venza; si no, devuelve False"""
+        async with chat_lock(chat_id):
+            if chat_id in self._held:
+                return True
+            name = chat_lease(chat_id)
+            waited = False
+            while not await to_thread(
+                self.store.acquire, name, self.worker, self.lease_seconds
+            ):
+                if not wait:
+                    return False
+                if not waited:
+                    logger.info(f"🧩 Esperando el lease del chat {chat_id}")
+                    waited = True
+                await sleep(ACQUIRE_RETRY_SECONDS)
+            saved = await to_thread(self.store.load_chat, chat_id)
+            data, update_id = saved if saved else (None, 0)
+            state = chat_state.load_chat(chat_id, data)
+            self._held[chat_id] = update_id
+            if state is not None and self.on_acquire:
+                self.on_acquire(state)
+            return True
+
+    def _drop(self, chat_id):
+        """Olvidar un chat que ya no es de este worker (sin guardarlo)"""
+        self._held.pop(chat_id, None)
+        self._dirty_chats.discard(chat_id)
+        state = chat_state.unload_chat(chat_id)
+        if state is not None and self.on_release:
+            self.on_release(state)
+
+    async def _release(self, chat_ids):
+        """Guardar y soltar los chats que el anillo ahora asigna a otro worker
+        (cada uno cuando termina su comando en curso)"""
+        released = 0
+        try:
+            for chat_id in chat_ids:
+                async with chat_lock(chat_id):
+                    if self.ring.owner(chat_id) == self.worker or self.busy(chat_id):
+                        # El anillo volvió a cambiar, o el chat tiene updates
+                        # en proceso: se reintenta en el próximo heartbeat
+                        continue
+                    await self.flush()
+                    self._drop(chat_id)
+                    await to_thread(
+                        self.store.release, [chat_lease(chat_id)], self.worker
+                    )
+                    released += 1
+        finally:
+            self._releasing.difference_update(chat_ids)
+            if released:
+                logger.info(f"🧩 {released} chats pasaron a otros workers")
+
+    # Membresía, leases y liderazgo
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self._tick()
+            except Exception as e:
+                logger.error(f"Error en el heartbeat del cluster: {e!r}")
+            await sleep(self.lease_seconds / 3)
+
+    async def _tick(self):
+        store = self.store
+        await to_thread(store.heartbeat, self.worker, self.lease_seconds)
+        workers = await to_thread(store.workers)
+        if tuple(workers) != self.ring.workers:
+            self.ring = HashRing(workers)
+            logger.info(f"🧩 Workers activos: {', '.join(workers)}")
+        moved = [
+            chat_id
+            for chat_id in self._held
+            if self.ring.owner(chat_id) != self.worker
+            and chat_id not in self._releasing
+        ]
+        if moved:
+            # En otra tarea: el heartbeat no espera a los comandos en curso
+            self._releasing.update(moved)
+            self._tasks = [task for task in self._tasks if not task.done()]
+            self._tasks.append(create_task(self._release(moved)))
+        if self._held:
+            lost = await to_thread(
+                store.renew,
+                [chat_lease(c) for c in self._held],
+                self.worker,
+                self.lease_seconds,
+            )
+            for name in lost:
+                self._drop(int(name.partition(":")[2]))
+        rows, self._users_seq = await to_thread(store.users_since, self._users_seq)
+        chat_state.merge_users(rows)
+        # Tomar los chats guardados que ahora son nuestros aunque no lleguen
+        # updates (para que sigan rotando); los que aún tiene otro, más tarde
+        for chat_id in await to_thread(store.chat_ids):
+            if chat_id not in self._held and self.ring.owner(chat_id) == self.worker:
+                await self._acquire(chat_id, wait=False)
+
+        leader = await to_thread(
+            store.acquire, LEADER_LEASE, self.worker, self.lease_seconds
+        )
+        if leader and self._poller is None:
+            logger.info(f"👑 {self.worker} es el líder: recibe los updates de Telegram")
+            self._poller = create_task(self._poll())
+        elif not leader and self._poller is not None:
+            logger.info(f"🧩 {self.worker} dejó de ser el líder")
+            await self._stop_polling()
+        if leader:
+            async with self._route_lock:
+                await self._reroute_orphans()
+
+    async def _poll(self):
+        """Líder: pedir los updates a Telegram y repartirlos en los buzones"""
+        bot = self.poll_bot
+        await bot.initialize()
+        offset = await to_thread(self.store.get_offset)
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=10, allowed_updates=Update.ALL_TYPES
+                )
+            except TelegramError as e:
+                logger.error(f"Error en getUpdates: {e}")
+                await sleep(1)
+                continue
+            if not updates:
+                continue
+            async with self._route_lock:
+                # Los updates de un worker caído van antes que los nuevos de
+                # sus chats, para que el nuevo dueño los procese en orden
+                await self._reroute_orphans()
+                ring = self.ring
+                items = [
+                    (ring.owner(update_key(u)), u.update_id, json.dumps(u.to_dict()))
+                    for u in updates
+                ]
+                await to_thread(self.store.push_updates, items)
+                offset = updates[-1].update_id + 1
+                await to_thread(self.store.set_offset, offset)
+
+    async def _stop_polling(self):
+        if self._poller is None:
+            return
+        poller, self._poller = self._poller, None
+        poller.cancel()
+        await gather(poller, return_exceptions=True)
+        await self.poll_bot.shutdown()
+
+    async def _reroute_orphans(self):
+        """Repartir los updates que quedaron en el buzón de un worker caído
+        (una vez por cada cambio del anillo)"""
+        ring = self.ring
+        if ring is self._routed:
+            return
+        for worker in await to_thread(self.store.inbox_workers):
+            if worker in ring.workers:
+                continue
+            rows = await to_thread(self.store.take_inbox, worker)
+            items = [
+                (
+                    ring.owner(update_key(Update.de_json(json.loads(data), None))),
+                    update_id,
+                    data,
+                )
+                for update_id, data in rows
+            ]
+            if items:
+                await to_thread(self.store.push_updates, items)
+                logger.warning(f"🧩 {len(items)} updates de {worker} repartidos")
+        self._routed = ring
@@ -0,0 +1,62 @@
+# coalescer.py
+"""Una sola respuesta para pedidos iguales de solo lectura (p. ej. /lista)."""
+
+from asyncio import gather, sleep
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class ReplyCoalescer:
+    """Respuestas compartidas para pedidos con la misma clave.
+
+    El primer pedido se responde enseguida y abre una ventana de ``window()``
+    segundos. Los que llegan dentro de la ventana solo se agregan a un grupo;
+    al vencer se llama una vez a send(pedidos), que renderiza con el estado de
+    ese momento, y se abre otra ventana. Así un pedido aislado no espera y una
+    ráfaga larga recibe una respuesta por ventana.
+
+    ``window`` se lee en cada pedido, así sigue a la constante de main aunque
+    se cambie después de importar el módulo (p. ej. en load_test.py).
+
+    Con una ventana de 0 cada pedido se responde enseguida.
+    """
+
+    def __init__(self, window):
+        self.window = window  # función() -> segundos
+        self._pending = {}  # clave -> [pedidos] de la ventana abierta
+        self._tasks = set()
+
+    async def request(self, key, item, send, create_task):
+        """Responder o agregar el pedido; devuelve False si se sumó a la
+        ventana abierta por otro (create_task: p. ej. application.create_task)"""
+        if self.window() <= 0:
+            await send([item])
+            return True
+        items = self._pending.get(key)
+        if items is not None:
+            items.append(item)
+            return False
+        self._pending[key] = []
+        task = create_task(self._close_windows(key, send))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        await send([item])
+        return True
+
+    async def _close_windows(self, key, send):
+        try:
+            while True:
+                await sleep(self.window())
+                items = self._pending[key]
+                if not items:
+                    break
+                self._pending[key] = []
+                await send(items)
+        finally:
+            del self._pending[key]
+
+    async def drain(self):
+        """Esperar los envíos programados"""
+        if self._tasks:
+            await gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,159 @@
+# event_log.py
+"""Historial de eventos: cada mutación de chat_state como una línea NDJSON.
+
+Desde el event loop cada evento es solo un put() en una cola; un hilo
+escritor los serializa en lotes y los agrega a archivos gzip que se rotan al
+superar ``max_bytes``. A diferencia del journal, los archivos no se recortan:
+sirven para reconstruir el estado en cualquier momento y para estadísticas
+(ver replay_events.py).
+
+Cada línea es {"t": epoch, "c": chat_id, "op": op, "a": args} (más "u" con el
+update_id que la produjo, si hay uno). Al arrancar se escribe un evento
+"state" con el estado completo, así la reconstrucción puede empezar en el
+último arranque anterior al momento pedido sin leer todo el historial.
+
+En modo cluster cada worker escribe su propio stream en un subdirectorio con
+su nombre: el evento "state" de un worker solo describe sus chats, y cada
+vez que toma o suelta un chat queda un evento "load" (con el estado cargado
+del store) o "unload". replay_events.py mezcla los streams por tiempo.
+"""
+
+import gzip
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from queue import Queue, Empty
+from threading import Thread
+from time import time
+from logging import getLogger
+
+import chat_state
+from checkpoint import current_update_id
+
+logger = getLogger(__name__)
+
+FILE_PREFIX = "events-"
+FILE_SUFFIX = ".ndjson.gz"
+
+
+def event_files(directory):
+    """Archivos de eventos del directorio en orden cronológico"""
+    names = sorted(
+        name
+        for name in os.listdir(directory)
+        if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX)
+    )
+    return [os.path.join(directory, name) for name in names]
+
+
+def event_streams(directory):
+    """Archivos de cada stream: los del directorio (un solo proceso) y los de
+    cada subdirectorio (un worker del cluster), sin streams vacíos"""
+    streams = [event_files(directory)]
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            streams.append(event_files(path))
+    return [files for files in streams if files]
+
+
+def read_events(path):
+    """Eventos de un archivo; un final truncado (caída del bot) se ignora"""
+    try:
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logger.warning(f"Línea incompleta en {path}")
+                    return
+    except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+        logger.warning(f"Archivo de eventos truncado {path}: {e}")
+
+
+class EventLog:
+    """Escritor en segundo plano de archivos NDJSON comprimidos y rotados"""
+
+    def __init__(
+        self, directory, max_bytes=64 * 1024 * 1024, max_batch=1000, stream=None
+    ):
+        # Con ``stream`` (el nombre del worker) los archivos van a su subdirectorio
+        self.directory = os.path.join(directory, stream) if stream else directory
+        self.max_bytes = max_bytes
+        self.max_batch = max_batch
+        self._queue = Queue()
+        self._writer = None
+
+    def start(self):
+        """Escribir el estado actual y registrar el historial como listener"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue.put((time(), None, "state", chat_state.dump_chats(), None))
+        self._writer = Thread(target=self._run, name="event-writer", daemon=True)
+        self._writer.start()
+        chat_state.add_listener(self.record)
+
+    def record(self, chat_id, op, args):
+        self._queue.put((time(), chat_id, op, args, current_update_id.get()))
+
+    def close(self):
+        """Escribir los eventos pendientes y cerrar el archivo actual"""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def _open(self):
+        now = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{FILE_PREFIX}{now}{FILE_SUFFIX}")
+        n = 1
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(
+                self.directory, f"{FILE_PREFIX}{now}-{n:03d}{FILE_SUFFIX}"
+            )
+        raw = open(path, "wb")
+        return raw, gzip.GzipFile(fileobj=raw, mode="wb")
+
+    def _run(self):
+        raw, out = self._open()
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                while item is not None and len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get_nowait()
+                    except Empty:
+                        break
+                    batch.append(item)
+                try:
+                    out.write(self._encode(batch))
+                    # Punto de sincronización: lo escrito se puede leer aunque el bot caiga
+                    out.flush()
+                    if raw.tell() >= self.max_bytes:
+                        out.close()
+                        raw.close()
+                        raw, out = self._open()
+                except OSError as e:
+                    logger.error(f"Error al escribir el historial de eventos: {e}")
+                if batch[-1] is None:
+                    return
+        finally:
+            out.close()
+            raw.close()
+
+    @staticmethod
+    def _encode(batch):
+        lines = []
+        for item in batch:
+            if item is None:
+                break
+            t, chat_id, op, args, update_id = item
+            event = {"t": round(t, 3), "c": chat_id, "op": op, "a": args}
+            if update_id is not None:
+                event["u"] = update_id
+            lines.append(json.dumps(event, separators=(",", ":")))
+            lines.append("\n")
+        return "".join(lines).encode()
@@ -0,0 +1,518 @@
+# fake_bot_api.py
+"""Servidor HTTP local que imita la Bot API de Telegram para pruebas de carga.
+
+Entrega por getUpdates un guion de comandos (de un archivo JSONL o generado
+al azar), cada uno a su hora, y responde sendMessage, getChatMember,
+getChatAdministrators y el resto de los métodos con resultados plausibles.
+Puede agregar latencia a cada llamada y devolver RetryAfter o "Message to be
+replied not found" con la probabilidad indicada. Para el modo webhook,
+post_webhook() le entrega al bot un update como lo hace Telegram.
+
+Para cada comando mide cuánto tardó la primera respuesta del bot desde que el
+comando se liberó (incluye la espera del polling, la cola de envíos y los
+reintentos). load_test.py lo usa con el bot real; también se puede levantar
+solo y apuntar un bot a él con BOT_API_URL:
+
+    python fake_bot_api.py --port 8081 --chats 20 --rate 50 --duration 60
+
+Cada línea de un guion es {"at": segundos, "chat": id, "user": id,
+"username": "nombre", "text": "/comando ..."}.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from asyncio import IncompleteReadError, start_server
+from collections import Counter, defaultdict, deque
+from itertools import count
+from time import monotonic, time
+from urllib.parse import parse_qsl
+from logging import getLogger
+
+import httpx
+
+logger = getLogger(__name__)
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Zonas", "username": "zonas_bot"}
+ADMIN_ID = 1
+ADMIN_USERNAME = "loadadmin"
+
+# Peso de cada comando en el guion generado (como en bench.py, sin rotaciones)
+DEFAULT_MIX = {
+    "z": 8,
+    "exitz": 4,
+    "espera": 25,
+    "cambiar": 8,
+    "exit": 15,
+    "tomarlibre": 10,
+    "lista": 30,
+}
+
+
+def load_script(path):
+    """[(at, chat_id, user_id, username, texto)] de un archivo JSONL"""
+    script = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                script.append(
+                    (
+                        float(item["at"]),
+                        int(item["chat"]),
+                        int(item["user"]),
+                        item.get("username"),
+                        item["text"],
+                    )
+                )
+    return script
+
+
+def generate_script(chats, users, zones, rate, duration, mix=None, seed=1):
+    """Guion al azar (semilla fija): el admin autoriza y abre cada chat al
+    comienzo y después llegan ``rate`` comandos por segundo (en promedio,
+    llegadas de Poisson) de ``users`` usuarios durante ``duration`` segundos"""
+    mix = mix or DEFAULT_MIX
+    rnd = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    chat_ids = [-1000 - i for i in range(chats)]
+    script = []
+    for chat_id in chat_ids:
+        for text in ("/autorizar", "/abrir", f"/zonas {zones}"):
+            script.append((0.0, chat_id, ADMIN_ID, ADMIN_USERNAME, text))
+    at = 0.5  # Después de la preparación
+    while True:
+        at += rnd.expovariate(rate)
+        if at > duration:
+            break
+        kind = rnd.choices(kinds, weights)[0]
+        user_id = 10_000 + rnd.randrange(users)
+        zone = rnd.randint(1, zones)
+        if kind == "z":
+            text = f"/z{zone}"
+        elif kind == "exitz":
+            text = f"/exitz{zone}"
+        elif kind == "cambiar":
+            text = f"/cambiar @u{10_000 + rnd.randrange(users)}"
+        else:
+            text = f"/{kind}"
+        script.append((at, rnd.choice(chat_ids), user_id, f"u{user_id}", text))
+    return script
+
+
+class Faults:
+    """Latencia y errores que el servidor agrega a las llamadas del bot"""
+
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.0,
+        retry_after=0.0,
+        retry_after_seconds=1,
+        reply_not_found=0.0,
+        seed=1,
+    ):
+        self.latency = latency  # Segundos por llamada (además del jitter)
+        self.jitter = jitter  # Segundos extra al azar, uniforme en [0, jitter]
+        self.retry_after = retry_after  # Probabilidad de un 429 en cada envío
+        self.retry_after_seconds = retry_after_seconds
+        self.reply_not_found = reply_not_found  # Probabilidad en cada respuesta
+        self.random = random.Random(seed)
+
+    def delay(self):
+        return self.latency + self.random.uniform(0, self.jitter)
+
+    def hit(self, probability):
+        return probability > 0 and self.random.random() < probability
+
+
+def make_update(update_id, chat_id, user_id, username, text):
+    """Update de Telegram con el mensaje ``text`` de un usuario en un grupo"""
+    user = {"id": user_id, "is_bot": False, "first_name": username or str(user_id)}
+    if username:
+        user["username"] = username
+    command_length = len(text.split()[0]) if text.startswith("/") else 0
+    message = {
+        "message_id": update_id,
+        "date": int(time()),
+        "chat": {"id": chat_id, "type": "supergroup", "title": f"Grupo {chat_id}"},
+        "from": user,
+        "text": text,
+    }
+    if command_length:
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": command_length}
+        ]
+    return {"update_id": update_id, "message": message}
+
+
+async def post_webhook(url, update, secret_token=None):
+    """Enviar ``update`` al webhook del bot como lo hace Telegram; devuelve el
+    estado HTTP (el bot responde 403 si el secreto no coincide)"""
+    headers = {}
+    if secret_token is not None:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret_token
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url, json=update, headers=headers)
+    return response.status_code
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class FakeBotApi:
+    """Bot API falsa sobre un guion [(at, chat_id, user_id, username, texto)].
+
+    El reloj del guion empieza con el primer getUpdates (así el arranque del
+    bot no cuenta como latencia). Los update_id (y message_id) siguen el
+    orden de liberación. Una respuesta se asocia a su comando por el
+    reply_parameters del envío; si se inyectó "Message to be replied not
+    found", el siguiente envío sin respuesta al mismo chat cuenta como la
+    respuesta de ese comando (el fallback de safe_reply).
+    """
+
+    def __init__(self, script, faults=None, admin_ids=(ADMIN_ID,)):
+        script = sorted(script, key=lambda item: item[0])
+        self.updates = [
+            (at, make_update(update_id, chat_id, user_id, username, text))
+            for update_id, (at, chat_id, user_id, username, text) in enumerate(
+                script, 1
+            )
+        ]
+        self.faults = faults or Faults()
+        self.admin_ids = set(admin_ids)
+        self.calls = Counter()  # método -> llamadas atendidas
+        self.injected = Counter()  # tipo de error -> veces
+        self.started = None  # monotonic() del primer getUpdates
+        self.delivered = 0  # Updates entregados al bot
+        self.first_reply = {}  # update_id -> segundos hasta la primera respuesta
+        self.last_reply = None
+        self._confirmed = 0  # Último update_id confirmado por el bot (offset - 1)
+        self._fallbacks = defaultdict(deque)  # chat_id -> update_id sin respuesta
+        self._message_ids = count(len(self.updates) + 1)
+        self._server = None
+        self._clients = {}  # Conexiones abiertas: tarea -> writer
+        self._closing = False
+
+    # Estado del guion
+    def released(self):
+        """Cantidad de updates del guion que ya se liberaron"""
+        if self.started is None:
+            return 0
+        elapsed = monotonic() - self.started
+        low, high = 0, len(self.updates)
+        while low < high:
+            middle = (low + high) // 2
+            if self.updates[middle][0] <= elapsed:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def finished(self):
+        """Si se liberaron todos los comandos y el bot los confirmó"""
+        return self.started is not None and self._confirmed >= len(self.updates)
+
+    # Servidor
+    async def start(self, host="127.0.0.1", port=8081):
+        self._server = await start_server(self._serve, host, port)
+        logger.info(f"🧪 Bot API falsa en http://{host}:{port}/bot")
+        return self._server
+
+    async def stop(self):
+        """Cerrar el servidor y las conexiones (un getUpdates en curso vuelve vacío)"""
+        if self._server is None:
+            return
+        self._closing = True
+        self._server.close()
+        for writer in self._clients.values():
+            writer.close()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader, writer):
+        """HTTP/1.1 con keep-alive (httpx reutiliza las conexiones)"""
+        task = asyncio.current_task()
+        self._clients[task] = writer
+        try:
+            while not self._closing:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path = request_line.split(b" ")[1].decode().split("?")[0]
+                params = self._parse(headers.get("content-type", ""), body)
+                status, payload = await self.call(path.rsplit("/", 1)[-1], params)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, IncompleteReadError):
+            pass
+        finally:
+            del self._clients[task]
+            writer.close()
+
+    @staticmethod
+    def _parse(content_type, body):
+        """Parámetros del pedido; los valores que no son texto vienen en JSON"""
+        if not body:
+            return {}
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        params = {}
+        for key, value in parse_qsl(body.decode()):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    # Métodos de la API
+    async def call(self, method, params):
+        """(estado HTTP, respuesta JSON) de una llamada a ``method``"""
+        if method == "getUpdates":
+            return "200 OK", {"ok": True, "result": await self._get_updates(params)}
+        delay = self.faults.delay()
+        if delay:
+            await asyncio.sleep(delay)
+        self.calls[method] += 1
+        if method == "sendMessage":
+            return self._send_message(params)
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getChatMember":
+            result = self._member(int(params["user_id"]))
+        elif method == "getChatAdministrators":
+            result = [self._member(user_id) for user_id in sorted(self.admin_ids)]
+        elif method == "editMessageText":
+            result = self._message(params["chat_id"], params.get("text", ""))
+            result["message_id"] = int(params["message_id"])
+        else:
+            result = True  # deleteWebhook, pinChatMessage, ...
+        return "200 OK", {"ok": True, "result": result}
+
+    async def _get_updates(self, params):
+        if self.started is None:
+            self.started = monotonic()
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = monotonic() + float(params.get("timeout") or 0)
+        if offset:
+            self._confirmed = max(self._confirmed, offset - 1)
+        while True:
+            start = max(offset, 1) - 1
+            batch = [u for _, u in self.updates[start : self.released()][:limit]]
+            if batch or self._closing or monotonic() >= deadline:
+                break
+            await asyncio.sleep(0.01)
+        self.calls["getUpdates"] += 1
+        self.delivered = max(self.delivered, start + len(batch))
+        return batch
+
+    def _send_message(self, params):
+        chat_id = int(params["chat_id"])
+        faults = self.faults
+        if faults.hit(faults.retry_after):
+            self.injected["RetryAfter"] += 1
+            seconds = faults.retry_after_seconds
+            return "429 Too Many Requests", {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {seconds}",
+                "parameters": {"retry_after": seconds},
+            }
+        reply_to = (params.get("reply_parameters") or {}).get("message_id")
+        if reply_to is None:
+            reply_to = params.get("reply_to_message_id")
+        if reply_to is not None and faults.hit(faults.reply_not_found):
+            self.injected["reply_not_found"] += 1
+            self._fallbacks[chat_id].append(int(reply_to))
+            return "400 Bad Request", {
+                "ok": False,
+                "error_code": 400,
+                "description": "Bad Request: message to be replied not found",
+            }
+        if reply_to is None and self._fallbacks[chat_id]:
+            reply_to = self._fallbacks[chat_id].popleft()
+        if reply_to is not None:
+            self._replied(int(reply_to))
+        return "200 OK", {
+            "ok": True,
+            "result": self._message(chat_id, params.get("text", "")),
+        }
+
+    def _replied(self, update_id):
+        if update_id in self.first_reply or not 0 < update_id <= len(self.updates):
+            return
+        now = monotonic()
+        released_at = self.started + self.updates[update_id - 1][0]
+        self.first_reply[update_id] = now - released_at
+        self.last_reply = now
+
+    def _message(self, chat_id, text):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time()),
+            "chat": {"id": int(chat_id), "type": "supergroup"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    def _member(self, user_id):
+        user = {"id": user_id, "is_bot": False, "first_name": str(user_id)}
+        if user_id in self.admin_ids:
+            return {"status": "creator", "user": user, "is_anonymous": False}
+        return {"status": "member", "user": user}
+
+    # Resultados
+    def report(self):
+        """Throughput y latencias de punta a punta (por comando y en total)"""
+        by_command = defaultdict(list)
+        for update_id, seconds in self.first_reply.items():
+            text = self.updates[update_id - 1][1]["message"]["text"]
+            command = text.split()[0][1:].rstrip("0123456789")
+            by_command[command].append(seconds)
+        latencies = sorted(self.first_reply.values())
+        elapsed = (self.last_reply - self.started) if self.last_reply else 0
+
+        def stats(values):
+            values = sorted(values)
+            return {
+                "count": len(values),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p90_ms": percentile(values, 0.90) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": (values[-1] if values else 0) * 1000,
+            }
+
+        return {
+            "commands": len(self.updates),
+            "delivered": self.delivered,
+            "confirmed": self._confirmed,
+            "answered": len(latencies),
+            "unanswered": len(self.updates) - len(latencies),
+            "elapsed_s": elapsed,
+            "throughput_replies_s": len(latencies) / elapsed if elapsed else 0,
+            "latency": stats(latencies),
+            "by_command": {
+                command: stats(values) for command, values in sorted(by_command.items())
+            },
+            "calls": dict(self.calls),
+            "injected": dict(self.injected),
+        }
+
+
+def print_report(result):
+    print(
+        f"comandos={result['commands']} entregados={result['delivered']} "
+        f"respondidos={result['answered']} sin respuesta={result['unanswered']} "
+        f"-> {result['throughput_replies_s']:.1f} respuestas/s en {result['elapsed_s']:.1f}s"
+    )
+    print(
+        f"{'comando':<12}{'n':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    rows = list(result["by_command"].items()) + [("total", result["latency"])]
+    for command, stats in rows:
+        print(
+            f"{command:<12}{stats['count']:>8}{stats['p50_ms']:>10.1f}"
+            f"{stats['p90_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}"
+        )
+    print("llamadas:", result["calls"])
+    if result["injected"]:
+        print("errores inyectados:", result["injected"])
+
+
+def add_arguments(parser):
+    """Opciones del guion y de los errores (compartidas con load_test.py)"""
+    parser.add_argument("--script", help="guion JSONL (si no, se genera uno)")
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--zones", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=20, help="comandos por segundo")
+    parser.add_argument("--duration", type=float, default=30, help="segundos")
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos")
+    parser.add_argument("--jitter", type=float, default=0.0, help="segundos")
+    parser.add_argument(
+        "--retry-after", type=float, default=0.0, help="probabilidad de 429"
+    )
+    parser.add_argument("--retry-after-seconds", type=int, default=1)
+    parser.add_argument(
+        "--reply-not-found",
+        type=float,
+        default=0.0,
+        help='probabilidad de "Message to be replied not found"',
+    )
+
+
+def from_arguments(args):
+    """FakeBotApi según las opciones de add_arguments()"""
+    if args.script:
+        script = load_script(args.script)
+    else:
+        script = generate_script(
+            args.chats,
+            args.users,
+            args.zones,
+            args.rate,
+            args.duration,
+            args.mix,
+            args.seed,
+        )
+    faults = Faults(
+        args.latency,
+        args.jitter,
+        args.retry_after,
+        args.retry_after_seconds,
+        args.reply_not_found,
+        args.seed,
+    )
+    return FakeBotApi(script, faults)
+
+
+async def serve_until_interrupted(api, host, port):
+    await api.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+def main_server():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    api = from_arguments(args)
+    print(f'BOT_API_URL = "http://{args.host}:{args.port}/bot"')
+    print(f'CREATOR_USERNAME = "@{ADMIN_USERNAME}"')
+    try:
+        asyncio.run(serve_until_interrupted(api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    print_report(api.report())
+
+
+if __name__ == "__main__":
+    main_server()
@@ -0,0 +1,252 @@
+# journal.py
+"""Persistencia en SQLite (modo WAL) de las mutaciones de la lista.
+
+Cada mutación de chat_state se agrega al journal desde el event loop solo
+como un put() en una cola; un hilo escritor vacía la cola en lotes, una
+transacción por lote. Cada cierto tiempo se guarda un snapshot compacto y se
+borra el journal anterior, así el arranque carga el último snapshot y solo
+re-aplica la cola del journal.
+
+Junto con las mutaciones se guarda el último update_id procesado (op
+"offset") y cada mutación lleva el update que la produjo: al reiniciar, los
+updates que ya cambiaron el estado no se vuelven a aplicar aunque el bot se
+haya caído antes de terminar de responderlos.
+
+Cada update recibido se guarda (tabla inbox) antes de procesarlo y se borra
+al terminar: al arrancar, los que quedaron sin terminar se vuelven a
+procesar aunque Telegram ya los haya dado por entregados.
+"""
+
+import json
+import sqlite3
+from asyncio import get_running_loop
+from queue import Queue, Empty
+from threading import Thread
+from time import sleep
+from logging import getLogger
+
+import chat_state
+from checkpoint import current_update_id
+
+logger = getLogger(__name__)
+
+RETRY_SECONDS = 0.5  # Primera espera para reintentar un lote que no se pudo escribir
+MAX_RETRY_SECONDS = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    args TEXT NOT NULL,
+    update_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS snapshot (
+    seq INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inbox (
+    update_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(journal)")]
+    if "update_id" not in columns:  # Journal de una versión anterior
+        conn.execute("ALTER TABLE journal ADD COLUMN update_id INTEGER")
+    return conn
+
+
+class Journal:
+    """Journal de mutaciones con snapshots periódicos"""
+
+    def __init__(self, path, max_batch=500):
+        self.path = path
+        self.max_batch = max_batch
+        self.seq = 0  # Última secuencia asignada
+        self.last_update_id = 0  # Último update de Telegram procesado sin huecos
+        self.applied_updates = set()  # Updates posteriores que ya cambiaron el estado
+        self.pending_updates = []  # Updates recibidos sin terminar (datos de Telegram)
+        self.pending_since_snapshot = 0
+        self._queue = Queue()
+        self._writer = None
+
+    def load(self):
+        """Cargar el último snapshot y re-aplicar el journal posterior"""
+        conn = _connect(self.path)
+        try:
+            row = conn.execute(
+                "SELECT seq, data FROM snapshot ORDER BY seq DESC LIMIT 1"
+            ).fetchone()
+            snapshot_seq = 0
+            if row:
+                snapshot_seq = row[0]
+                data = json.loads(row[1])
+                chat_state.load_chats(data)
+                self.last_update_id = data.get("last_update_id", 0)
+            self.seq = snapshot_seq
+            replayed = 0
+            for seq, chat_id, op, args, update_id in conn.execute(
+                "SELECT seq, chat_id, op, args, update_id FROM journal WHERE seq > ? ORDER BY seq",
+                (snapshot_seq,),
+            ):
+                if op == "offset":
+                    self.last_update_id = json.loads(args)[0]
+                else:
+                    chat_state.apply_record(chat_id, op, json.loads(args))
+                    if update_id is not None:
+                        self.applied_updates.add(update_id)
+                self.seq = seq
+                replayed += 1
+            self.applied_updates = {
+                u for u in self.applied_updates if u > self.last_update_id
+            }
+            self.pending_updates = [
+                json.loads(data)
+                for (data,) in conn.execute(
+                    "SELECT data FROM inbox WHERE update_id > ? ORDER BY update_id",
+                    (self.last_update_id,),
+                )
+            ]
+        finally:
+            conn.close()
+        self.pending_since_snapshot = replayed
+        logger.info(
+            f"💾 Estado restaurado: {len(chat_state.chats)} chats, {replayed} mutaciones re-aplicadas, último update {self.last_update_id}, {len(self.pending_updates)} updates sin terminar"
+        )
+        return replayed
+
+    def start(self):
+        """Iniciar el hilo escritor y registrar el journal como listener"""
+        self._writer = Thread(target=self._run, name="journal-writer", daemon=True)
+        self._writer.start()
+        chat_state.add_listener(self.record)
+
+    def record(self, chat_id, op, args):
+        self.seq += 1
+        self.pending_since_snapshot += 1
+        self._queue.put(
+            ("op", self.seq, chat_id, op, json.dumps(args), current_update_id.get())
+        )
+
+    async def accept(self, update_id, data):
+        """Guardar un update recibido antes de procesarlo; vuelve cuando está
+        escrito (ver checkpoint.JournaledUpdateQueue)"""
+        loop = get_running_loop()
+        written = loop.create_future()
+        self._queue.put(("update", update_id, json.dumps(data), loop, written))
+        await written
+
+    def checkpoint(self, update_id):
+        """Registrar el último update procesado (después de sus mutaciones)"""
+        self.last_update_id = update_id
+        self.record(chat_state.USERS_CHAT_ID, "offset", (update_id,))
+        self._queue.put(("watermark", update_id))
+
+    def finish(self, update_id):
+        """Olvidar un update recibido que ya terminó (después de sus mutaciones)"""
+        self._queue.put(("finished", update_id))
+
+    def snapshot(self):
+        """Encolar un snapshot del registro completo (se llama desde el event loop)"""
+        if not self.pending_since_snapshot:
+            return
+        self.pending_since_snapshot = 0
+        data = chat_state.dump_chats()
+        data["last_update_id"] = self.last_update_id
+        self._queue.put(("snapshot", self.seq, json.dumps(data)))
+
+    def close(self):
+        """Guardar un snapshot final y esperar a que el escritor termine"""
+        if self._writer is None:
+            return
+        self.snapshot()
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def _run(self):
+        conn = _connect(self.path)
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                while item is not None and len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get_nowait()
+                    except Empty:
+                        break
+                    batch.append(item)
+                conn = self._write_retrying(conn, batch)
+                if batch[-1] is None:
+                    return
+        finally:
+            conn.close()
+
+    def _write_retrying(self, conn, batch):
+        """Escribir el lote, reintentando (con otra conexión) hasta lograrlo.
+        Descartarlo dejaría el journal distinto del estado en memoria, con
+        updates que Telegram ya dio por entregados; mientras tanto no se
+        acepta ningún update nuevo (accept espera). Devuelve la conexión"""
+        delay = RETRY_SECONDS
+        while True:
+            try:
+                self._write(conn, batch)
+                return conn
+            except sqlite3.Error as e:
+                logger.critical(
+                    f"Error al escribir el journal, reintento en {delay:g}s: {e}"
+                )
+            sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_SECONDS)
+            conn.close()
+            try:
+                conn = _connect(self.path)
+            except sqlite3.Error as e:
+                logger.critical(f"No se pudo reabrir el journal: {e}")
+
+    def _write(self, conn, batch):
+        written = []
+        with conn:
+            for item in batch:
+                if item is None:
+                    break
+                if item[0] == "op":
+                    conn.execute(
+                        "INSERT INTO journal (seq, chat_id, op, args, update_id) VALUES (?, ?, ?, ?, ?)",
+                        item[1:],
+                    )
+                elif item[0] == "update":
+                    _, update_id, data, loop, future = item
+                    conn.execute(
+                        "INSERT OR IGNORE INTO inbox (update_id, data) VALUES (?, ?)",
+                        (update_id, data),
+                    )
+                    written.append((loop, future))
+                elif item[0] == "finished":
+                    conn.execute("DELETE FROM inbox WHERE update_id = ?", (item[1],))
+                elif item[0] == "watermark":
+                    conn.execute("DELETE FROM inbox WHERE update_id <= ?", (item[1],))
+                else:
+                    _, seq, data = item
+                    conn.execute(
+                        "INSERT OR REPLACE INTO snapshot (seq, data) VALUES (?, ?)",
+                        (seq, data),
+                    )
+                    conn.execute("DELETE FROM snapshot WHERE seq < ?", (seq,))
+                    conn.execute("DELETE FROM journal WHERE seq <= ?", (seq,))
+
+        # Recién confirmada la transacción: el update ya se puede procesar
+        for loop, future in written:
+            loop.call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
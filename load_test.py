@@ -0,0 +1,119 @@
+# load_test.py
+"""Prueba de carga de punta a punta: el bot sin cambios contra fake_bot_api.
+
+Levanta la Bot API falsa, arranca main.py en otro proceso apuntando a ella
+(BOT_API_URL, con un journal temporal y sin métricas ni historial), espera a
+que el bot confirme todos los comandos del guion y a que dejen de llegar
+respuestas, lo detiene con SIGTERM y reporta throughput y latencias de punta
+a punta (red, httpx, cola de envíos, reintentos y fallbacks de safe_reply).
+
+    python load_test.py --chats 20 --rate 50 --duration 60 --retry-after 0.01
+
+Los límites de envío del bot (SEND_GROUP_PER_MINUTE, SEND_GLOBAL_PER_SECOND)
+se usan tal cual salvo que se indiquen --group-per-minute / --global-per-second.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+from time import monotonic
+
+import fake_bot_api
+from fake_bot_api import print_report
+
+
+def run_bot(api_url, journal_path, overrides, verbose):
+    """Proceso del bot: main.py con la configuración de la prueba"""
+    import main
+
+    main.TOKEN = "1:load-test"
+    main.BOT_API_URL = api_url
+    main.CREATOR_USERNAME = f"@{fake_bot_api.ADMIN_USERNAME}"
+    main.JOURNAL_PATH = journal_path
+    main.EVENT_LOG_DIR = None
+    main.METRICS_PORT = None
+    main.WEBHOOK_URL = None
+    main.CLUSTER_STORE = None
+    for name, value in overrides.items():
+        setattr(main, name, value)
+    if not verbose:
+        logging.disable(logging.WARNING)
+    main.main()
+
+
+async def run_load_test(api, port, overrides, settle, timeout, verbose):
+    await api.start("127.0.0.1", port)
+    journal = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    journal.close()
+    bot = multiprocessing.get_context("spawn").Process(
+        target=run_bot,
+        args=(f"http://127.0.0.1:{port}/bot", journal.name, overrides, verbose),
+    )
+    bot.start()
+    try:
+        deadline = monotonic() + timeout
+        while monotonic() < deadline and bot.is_alive():
+            quiet = monotonic() - (api.last_reply or api.started or monotonic())
+            if api.finished() and quiet >= settle:
+                break
+            await asyncio.sleep(0.2)
+        else:
+            logging.warning("⚠️ La prueba terminó sin que el bot confirmara todo")
+    finally:
+        bot.terminate()  # SIGTERM: el bot se detiene como en producción
+        await asyncio.to_thread(bot.join, 30)
+        if bot.is_alive():
+            bot.kill()
+        await api.stop()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.unlink(journal.name + suffix)
+            except FileNotFoundError:
+                pass
+    return api.report()
+
+
+def main_load_test():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    fake_bot_api.add_arguments(parser)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--group-per-minute", type=float)
+    parser.add_argument("--global-per-second", type=float)
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=3,
+        help="segundos sin respuestas nuevas para dar la prueba por terminada",
+    )
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--verbose", action="store_true", help="logs del bot")
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.group_per_minute is not None:
+        overrides["SEND_GROUP_PER_MINUTE"] = args.group_per_minute
+    if args.global_per_second is not None:
+        overrides["SEND_GLOBAL_PER_SECOND"] = args.global_per_second
+
+    api = fake_bot_api.from_arguments(args)
+    result = asyncio.run(
+        run_load_test(
+            api, args.port, overrides, args.settle, args.timeout, args.verbose
+        )
+    )
+    result["params"] = {
+        key: value for key, value in vars(args).items() if key not in ("output",)
+    }
+    print_report(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_load_test()
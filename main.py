@@ -1,21 +1,109 @@
 # bot_zonas.py
-from telegram import Update
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
+    MessageHandler,
+    filters,
+    ChatMemberHandler,
+    CallbackQueryHandler,
+    TypeHandler,
     ContextTypes,
     CallbackContext,
+    ApplicationHandlerStop,
 )
 from telegram.error import BadRequest
 from pytz import timezone
 from datetime import datetime, timedelta
+from re import compile as compile_regex
+from functools import wraps
+from asyncio import create_task
+from os import environ, getpid
+from socket import gethostname
 from logging import basicConfig, getLogger, INFO, WARNING
+from chat_state import (
+    find_chat,
+    chats,
+    authorize_chat,
+    deauthorize_chat,
+    chat_lock,
+    users,
+    remember_user,
+    mention_user,
+    set_notifications,
+)
+from zone_queue import LIBRE
+from journal import Journal
+from event_log import EventLog
+from admin_cache import AdminCache
+from status_message import StatusBoard
+from sender import OutboundScheduler, PRIORITY_ANNOUNCE, PRIORITY_NOTIFY
+import metrics
+from rotation_scheduler import RotationScheduler
+from checkpoint import CheckpointProcessor, JournaledUpdateQueue
+from notice_limiter import NoticeLimiter, Cooldowns
+from coalescer import ReplyCoalescer
+from notifier import Notifier
+from profiler import Profiler
+from cluster import Cluster
+from shared_store import open_store
 
 # Constants
 TOKEN = "TU_TOKEN_AQUI"
 CREATOR_USERNAME = "@Soy_Acos"
 ROTATION_DURATION_MINUTES = 120
+ROTATION_SPREAD_SECONDS = 30  # Ventana para repartir rotaciones que coinciden
+ZONE_LEASES = True  # Cada zona rota a los ROTATION_DURATION_MINUTES de ocuparse (False: todas juntas)
 DICE_NAME = "NOMBRE_DEL_DADO"
+JOURNAL_PATH = "zonas.db"  # Base SQLite donde se guarda el estado
+SNAPSHOT_INTERVAL_SECONDS = 300
+EVENT_LOG_DIR = "eventos"  # Historial para replay_events.py (None: desactivado)
+EVENT_LOG_MAX_BYTES = 64 * 1024 * 1024  # Tamaño de cada archivo comprimido
+ADMIN_CACHE_TTL_SECONDS = 600  # Tiempo que se confía en la lista de admins
+LIVE_STATUS_MESSAGE = False  # True: un solo mensaje fijado por chat que se edita
+STATUS_DEBOUNCE_SECONDS = 2  # Ventana para juntar cambios en una sola edición
+SEND_GLOBAL_PER_SECOND = (
+    25  # Límites de envío (Telegram: ~30/s global, 20/min por grupo)
+)
+SEND_GROUP_PER_MINUTE = 20
+BOT_API_URL = "https://api.telegram.org/bot"  # O un servidor Bot API local
+METRICS_HOST = (
+    "127.0.0.1"  # Endpoint Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+)
+# ZONAS_METRICS_PORT: un puerto por worker en la misma máquina (0: desactivado)
+METRICS_PORT = int(environ.get("ZONAS_METRICS_PORT") or 9108)  # None para desactivarlo
+WAITING_PAGE_SIZE = 30  # Personas por página de /lista (Telegram: 4096 caracteres)
+MAX_ZONES = 50  # Límite de /zonas (por defecto: DEFAULT_ZONE_COUNT)
+MAX_BULK_USERS = 50  # Usuarios por /espera, /exit u /ordenar de un admin
+CONCURRENT_UPDATES = 64  # Updates procesados en paralelo (cada chat sigue en orden)
+REJECTION_NOTICE_INTERVAL_SECONDS = 60  # Un aviso de rechazo por chat/usuario
+READ_COALESCE_SECONDS = 1.5  # /lista, /reglas o /comandos repetidos: una respuesta más
+READ_COOLDOWN_SECONDS = {"lista": 10, "reglas": 60, "comandos": 60}  # Por usuario
+MAX_COALESCED_MENTIONS = 20  # Menciones en una respuesta compartida
+NOTIFY_CONCURRENCY = 8  # Avisos privados (/avisos) en curso a la vez
+
+# Webhook: si WEBHOOK_URL tiene valor se usa webhook en lugar de polling
+WEBHOOK_URL = None  # URL pública completa, p. ej. "https://mi.dominio/telegram"
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"  # Debe coincidir con la ruta de WEBHOOK_URL
+WEBHOOK_SECRET = None  # Se compara con X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = 40
+
+# Modo cluster: varios procesos con el mismo CLUSTER_STORE se reparten los chats
+CLUSTER_STORE = None  # p. ej. "sqlite:///cluster.db" o "redis://localhost:6379/0"
+CLUSTER_LEASE_SECONDS = 15  # Un worker caído deja sus chats después de este tiempo
+WORKER_ID = environ.get("ZONAS_WORKER") or f"{gethostname()}-{getpid()}"
+
+# Perfilado a pedido: /perfil [segundos] del creador, o ZONAS_PROFILE=segundos al arrancar
+PROFILE_DIR = "perfiles"  # Perfil (.collapsed o .pstats) y resumen por handler (.txt)
+PROFILE_MODE = (
+    "sample"  # "sample": muestras de la pila; "trace": cProfile (más costoso)
+)
+PROFILE_INTERVAL_SECONDS = 0.005  # Entre muestras (modo "sample")
+PROFILE_DEFAULT_SECONDS = 60
+PROFILE_MAX_SECONDS = 600
+PROFILE_ON_START = float(environ.get("ZONAS_PROFILE") or 0)
 
 # Setup logging
 basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=INFO)
@@ -25,14 +113,64 @@ logger = getLogger(__name__)
 getLogger("httpx").setLevel(WARNING)
 getLogger("httpcore").setLevel(WARNING)
 
-# In-memory data
-zones = {"z1": None, "z2": None, "z3": None}
-waiting_list = []
-authorized = False
-list_open = False
-last_rotation_time = None
-rotation_job = None
-authorized_chat_id = None  # Solo este chat podrá usar el bot
+# In-memory data: el estado de cada chat vive en chat_state.chats
+journal = None  # Journal de persistencia (se crea en main)
+event_log = None  # Historial de eventos (se crea en main)
+cluster = None  # Coordinación con los otros workers (se crea en main con CLUSTER_STORE)
+admin_cache = AdminCache(ADMIN_CACHE_TTL_SECONDS)
+metrics_server = None  # Servidor HTTP de /metrics (se crea en on_startup)
+rotation_scheduler = RotationScheduler(
+    ROTATION_DURATION_MINUTES * 60, ROTATION_SPREAD_SECONDS
+)
+rotation_task = None  # Tarea que atiende el planificador (se crea en on_startup)
+zone_leases = RotationScheduler(ROTATION_DURATION_MINUTES * 60)  # (chat_id, zona)
+lease_task = None  # Tarea que atiende los turnos por zona (se crea en on_startup)
+rejection_notices = NoticeLimiter(REJECTION_NOTICE_INTERVAL_SECONDS)
+read_cooldowns = Cooldowns(READ_COOLDOWN_SECONDS)
+read_replies = ReplyCoalescer(lambda: READ_COALESCE_SECONDS)
+notifier = Notifier(
+    NOTIFY_CONCURRENCY,
+    send_options={"rate_limit_args": PRIORITY_NOTIFY},
+    on_blocked=lambda user_id: set_notifications(user_id, False),
+)
+chat_titles = {}  # chat_id -> nombre del grupo (para los avisos privados)
+profiler = Profiler(PROFILE_DIR, PROFILE_MODE, PROFILE_INTERVAL_SECONDS)
+
+# Comandos que el filtro previo conoce (los demás los deja pasar sin avisos)
+UNAUTHORIZED_COMMANDS = frozenset({"autorizar", "desautorizar"})
+LIST_COMMANDS = frozenset(
+    {
+        "lista",
+        "espera",
+        "cambiar",
+        "exit",
+        "exitlista",
+        "tomarlibre",
+        "ordenar",
+    }
+)
+GUARDED_COMMANDS = (
+    UNAUTHORIZED_COMMANDS
+    | LIST_COMMANDS
+    | {
+        "abrir",
+        "abrirlista",
+        "cerrar",
+        "cerrarlista",
+        "zonas",
+        "reglas",
+        "comandos",
+        "chatid",
+    }
+)
+# /z<N> [@usuario] y /exitz<N>: un solo handler que busca la zona en la tabla del chat
+ZONE_COMMAND = compile_regex(r"(?is)^/(exit)?z(\d+)(?:@(\w+))?(?:\s+(.*))?$")
+ZONE_COMMAND_NAME = compile_regex(r"(?:exit)?z\d+")
+REJECTION_NOTICES = {
+    "private": "🚫 Este bot no funciona por mensajes privados.",
+    "unauthorized": "🚫 Este bot no está autorizado en este grupo.",
+    "closed": "🚫 La lista está cerrada actualmente. Usa /abrir o /abrirlista para habilitarla.",
+}
 
 # Time zones for display
 timezones = {
@@ -42,66 +180,222 @@ timezones = {
     "🇦🇷 Hora Argentina / Chile 🇨🇱": "America/Argentina/Buenos_Aires",
     "🇪🇸 Hora España 🇪🇸": "Europe/Madrid",
 }
+# Objetos de zona horaria creados una sola vez
+timezone_objects = [(country, timezone(tz)) for country, tz in timezones.items()]
 
 
 # Helper functions
-def get_time_display():
-    now = datetime.now()
-    if last_rotation_time:
-        start = last_rotation_time
-    else:
-        start = now
+def get_time_display(start):
     end = start + timedelta(minutes=ROTATION_DURATION_MINUTES)
 
     lines = []
-    for country, tz in timezones.items():
-        t_start = start.astimezone(timezone(tz)).strftime("%H:%M")
-        t_end = end.astimezone(timezone(tz)).strftime("%H:%M")
+    for country, tz in timezone_objects:
+        t_start = start.astimezone(tz).strftime("%H:%M")
+        t_end = end.astimezone(tz).strftime("%H:%M")
         lines.append(f"{country} \n⏰ {t_start} ➖ {t_end}")
     return "\n".join(lines)
 
 
+def minutes_left(start, now):
+    return max(ROTATION_DURATION_MINUTES - int((now - start).total_seconds() / 60), 0)
+
+
+def lease_start(state, zone):
+    """Inicio del turno de la zona (las asignadas antes de los turnos por zona
+    cuentan desde la última rotación)"""
+    return state.leases.get(zone) or state.last_rotation_time
+
+
+def cached_section(state, name, key, render):
+    """Devolver la sección renderizada si su clave no cambió; si no, renderizarla"""
+    cached = state.render_cache.get(name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    text = render()
+    state.render_cache[name] = (key, text)
+    return text
+
+
 def is_creator(user):
     return user.username == CREATOR_USERNAME[1:]
 
 
 async def is_admin(context, chat_id, user_id):
-    member = await context.bot.get_chat_member(chat_id, user_id)
-    return member.status in ["administrator", "creator"]
+    return await admin_cache.is_admin(context.bot, chat_id, user_id)
+
+
+def zone_label(zone):
+    """Número de la zona para mostrar (con emoji de tecla si es de un dígito)"""
+    number = zone[1:]
+    return f"{number}⃣" if len(number) == 1 else number
+
+
+def mentioned_user(arg):
+    """Id del usuario de un argumento @usuario (None si no tiene ese formato)"""
+    if len(arg) < 2 or not arg.startswith("@"):
+        return None
+    return mention_user(arg)
 
 
-def format_list():
+def format_zones(queue, remaining=None):
+    """Zonas con su ocupante (y los minutos que le quedan, con turnos por zona)"""
     zona_display = "\n\n🏷️ Zonas Actuales:\n"
-    for z, u in zones.items():
+    for z, u in queue.zones.items():
         display = (
-            u if u else "⚪ Vacío"
+            users.handle(u) if u else "⚪ Vacío"
         )  # Siempre mostrar "Vacío" para zonas sin usuarios
-        zona_display += f"🔹 Zona {z[1]}⃣: {display}\n"
+        if u and remaining:
+            display += f" (⏳ {remaining[z]} min)"
+        zona_display += f"🔹 Zona {zone_label(z)}: {display}\n"
+    return zona_display
+
 
+def format_waiting(queue, start=0, count=None):
     # Para la lista de espera, usar "Libre" para huecos vacíos
+    waiting_count = len(queue)
+    end = waiting_count if count is None else min(waiting_count, start + count)
     formatted_waiting_list = []
-    for i, item in enumerate(waiting_list, 1):
-        formatted_waiting_list.append(f"🔸 {item}")
-        if i % 3 == 0 and i < len(waiting_list):  # Si es el tercero y no es el último
+    handle = users.handle
+    for i, item in enumerate(queue.waiting(start, end), start + 1):
+        formatted_waiting_list.append(f"🔸 {item if item == LIBRE else handle(item)}")
+        if i % 3 == 0 and i < end:  # Si es el tercero y no es el último
             formatted_waiting_list.append("")  # Añade línea vacía
 
-    espera = "\n".join(formatted_waiting_list) if waiting_list else "🔘 Ninguno"
+    return "\n".join(formatted_waiting_list) if waiting_count else "🔘 Ninguno"
+
+
+def page_count(queue):
+    return max(1, -(-len(queue) // WAITING_PAGE_SIZE))
+
+
+def format_list(state, page=0):
+    """Texto de la lista con una página de la espera; cada sección se
+    re-renderiza solo si cambió, así el costo depende del tamaño de página"""
+    queue = state.queue
+    pages = page_count(queue)
+    page = min(page, pages - 1)
+    now = datetime.now()
+    remaining = None
+    if ZONE_LEASES:
+        # El horario y la próxima rotación son los del turno que vence primero
+        starts = {
+            zone: lease_start(state, zone) or now
+            for zone, user in queue.zones.items()
+            if user is not None
+        }
+        remaining = {zone: minutes_left(start, now) for zone, start in starts.items()}
+        last_rotation_time = min(starts.values()) if starts else None
+    else:
+        last_rotation_time = state.last_rotation_time
     mins_left = (
-        ROTATION_DURATION_MINUTES
-        - int((datetime.now() - last_rotation_time).seconds / 60)
+        ROTATION_DURATION_MINUTES - int((now - last_rotation_time).seconds / 60)
         if last_rotation_time
         else 0
     )
     if mins_left < 0:
         mins_left = 0  # Prevenir números negativos
 
-    return (
+    # Sin rotación, el horario parte de "ahora": cambia con cada minuto
+    window_key = last_rotation_time or now.replace(second=0, microsecond=0)
+    zones_key = (
+        queue.zones_version,
+        users.version,
+        remaining and tuple(remaining.values()),
+    )
+    key = (
+        window_key,
+        zones_key,
+        queue.waiting_version,
+        mins_left,
+        pages,
+    )
+    cached = state.render_cache.get(("list", page))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    horarios = cached_section(
+        state, "header", window_key, lambda: get_time_display(window_key)
+    )
+    # Los nombres salen de la tabla de usuarios: un cambio de @usuario también cuenta
+    zona_display = cached_section(
+        state, "zones", zones_key, lambda: format_zones(queue, remaining)
+    )
+    espera = cached_section(
+        state,
+        ("waiting", page),
+        (queue.waiting_version, users.version),
+        lambda: format_waiting(queue, page * WAITING_PAGE_SIZE, WAITING_PAGE_SIZE),
+    )
+    if pages > 1:
+        espera += f"\n\n📄 Página {page + 1} de {pages} ({len(queue)} en espera)"
+    text = (
         f"⚜️ Estado de la Lista de Zonas {DICE_NAME} ⚜️\n\n"
-        f"⏰ Horarios de Rotación:\n{get_time_display()}"
+        f"⏰ Horarios de Rotación:\n{horarios}"
         f"{zona_display}"
         f"\n⏳ Próxima rotación en: {mins_left} minutos\n"
         f"\n📋 Lista de Espera:\n{espera}"
     )
+    state.render_cache[("list", page)] = (key, text)
+    return text
+
+
+def list_keyboard(state, page=0):
+    """Botones para moverse entre las páginas de la espera (None si hay una sola)"""
+    pages = page_count(state.queue)
+    if pages == 1:
+        return None
+    page = min(page, pages - 1)
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️", callback_data=f"lista:{page - 1}"))
+    buttons.append(
+        InlineKeyboardButton(f"🔄 {page + 1}/{pages}", callback_data=f"lista:{page}")
+    )
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("➡️", callback_data=f"lista:{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+
+def render_status(chat_id):
+    """Texto del mensaje de estado del chat (None si la lista no está abierta)"""
+    state = find_chat(chat_id)
+    if state is None or not state.list_open:
+        return None
+    return format_list(state)
+
+
+status_board = StatusBoard(
+    render_status,
+    STATUS_DEBOUNCE_SECONDS,
+    send_options={"rate_limit_args": PRIORITY_ANNOUNCE},
+)
+
+
+async def show_list(update, context, state):
+    """Mostrar la lista después de un cambio: editar el mensaje de estado o responder con la lista"""
+    if LIVE_STATUS_MESSAGE:
+        status_board.request(
+            context.bot, state.chat_id, context.application.create_task
+        )
+    else:
+        await safe_reply(
+            update, context, format_list(state), reply_markup=list_keyboard(state)
+        )
+
+
+def serialized(callback):
+    """Ejecutar el handler con el lock de su chat: chats distintos corren en
+    paralelo, pero los cambios de un chat se aplican completos y en orden"""
+
+    @wraps(callback)
+    async def wrapper(update, context):
+        chat = update.effective_chat
+        if chat is None:
+            return await callback(update, context)
+        async with chat_lock(chat.id):
+            return await callback(update, context)
+
+    return wrapper
 
 
 async def validate_message(update: Update):
@@ -114,16 +408,18 @@ async def validate_message(update: Update):
     return True
 
 
-async def safe_reply(update, context, message):
-    """Función auxiliar para enviar mensajes de forma segura"""
+async def safe_reply(update, context, message, **kwargs):
+    """Función auxiliar para enviar mensajes de forma segura (kwargs: p. ej. reply_markup)"""
     try:
         # Intentar responder al mensaje original
-        await update.message.reply_text(message)
+        await update.message.reply_text(message, **kwargs)
+        metrics.SAFE_REPLY.inc("reply")
     except BadRequest as e:
         if "Message to be replied not found" in str(e):
             # Si el mensaje original no se encuentra, enviar mensaje normal
+            metrics.SAFE_REPLY.inc("fallback_not_found")
             await context.bot.send_message(
-                chat_id=update.effective_chat.id, text=message
+                chat_id=update.effective_chat.id, text=message, **kwargs
             )
             logger.warning(
                 f"Mensaje original no encontrado, enviando mensaje directo: {e}"
@@ -133,15 +429,52 @@ async def safe_reply(update, context, message):
             raise e
     except Exception as e:
         logger.error(f"Error inesperado al enviar mensaje: {e}")
+        metrics.SAFE_REPLY.inc("fallback_error")
         # Como fallback, intentar envío directo
         try:
             await context.bot.send_message(
-                chat_id=update.effective_chat.id, text=message
+                chat_id=update.effective_chat.id, text=message, **kwargs
             )
         except Exception as fallback_error:
+            metrics.SAFE_REPLY.inc("failed")
             logger.error(f"Error en fallback: {fallback_error}")
 
 
+async def reply_read_only(update, context, key, render):
+    """Responder un comando de solo lectura. render() -> (texto, reply_markup).
+
+    El primer pedido con una clave en el chat se responde enseguida; los que
+    llegan en los READ_COALESCE_SECONDS siguientes reciben una sola respuesta
+    (renderizada una vez) que menciona a quienes también la pidieron."""
+    joined = not await read_replies.request(
+        (update.effective_chat.id, *key),
+        (update, context),
+        lambda requests: send_read_only(requests, render),
+        context.application.create_task,
+    )
+    if joined:
+        metrics.READ_COALESCED.inc(key[0])
+
+
+async def send_read_only(requests, render):
+    update, context = requests[0]
+    text, reply_markup = render()
+    first = update.effective_user.id
+    askers = [
+        user_id
+        for user_id in dict.fromkeys(
+            remember_user(u.effective_user) for u, _ in requests[1:]
+        )
+        if user_id != first
+    ]
+    if askers:
+        mentions = ", ".join(users.handle(u) for u in askers[:MAX_COALESCED_MENTIONS])
+        if len(askers) > MAX_COALESCED_MENTIONS:
+            mentions += f" y {len(askers) - MAX_COALESCED_MENTIONS} más"
+        text += f"\n\n👥 También lo pidieron: {mentions}"
+    await safe_reply(update, context, text, reply_markup=reply_markup)
+
+
 async def reject_private_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await validate_message(update):
         return False
@@ -157,30 +490,66 @@ async def reject_private_messages(update: Update, context: ContextTypes.DEFAULT_
 
 
 async def check_authorized_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Verificar que el comando viene del chat autorizado"""
-    if not await validate_message(update):
-        return False
-
+    """Verificar que el chat está autorizado y devolver su estado (None si no lo está)"""
     current_chat_id = update.effective_chat.id
+    state = find_chat(current_chat_id)
 
-    if not authorized or authorized_chat_id is None:
-        await safe_reply(update, context, "🚫 Este bot no está autorizado actualmente.")
-        return False
-
-    if current_chat_id != authorized_chat_id:
+    if state is None or not state.authorized:
         await safe_reply(
-            update, context, "🚫 Este bot solo funciona en el grupo autorizado."
-        )
-        logger.warning(
-            f"⛔ Intento de uso desde chat no autorizado: {current_chat_id} (autorizado: {authorized_chat_id})"
+            update, context, "🚫 Este bot no está autorizado en este grupo."
         )
-        return False
-    return True
+        logger.warning(f"⛔ Intento de uso desde chat no autorizado: {current_chat_id}")
+        return None
+    return state
+
+
+async def guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Filtro previo (grupo -1) a todos los comandos: descarta con datos en
+    memoria lo que ningún handler va a atender, con avisos limitados por
+    chat y usuario, y corta el resto del despacho con ApplicationHandlerStop"""
+    message = update.effective_message
+    if message is None or not message.text or not message.text.startswith("/"):
+        return  # No es un comando (p. ej. cambios de miembros)
+    command, _, target = message.text.split(maxsplit=1)[0][1:].partition("@")
+    command = command.lower()
+    zone_command = ZONE_COMMAND_NAME.fullmatch(command) is not None
+    if command not in GUARDED_COMMANDS and not zone_command:
+        return
+    if target and target.lower() != (context.bot.username or "").lower():
+        return  # Comando para otro bot
+
+    if not await validate_message(update):
+        raise ApplicationHandlerStop  # Mensaje editado
+    chat = update.effective_chat
+    user = update.effective_user
+    if chat.title:
+        chat_titles[chat.id] = chat.title
+    if chat.type == "private":
+        reason = "private"
+    else:
+        state = find_chat(chat.id)
+        if state is None or not state.authorized:
+            if command in UNAUTHORIZED_COMMANDS:
+                return
+            reason = "unauthorized"
+        elif (command in LIST_COMMANDS or zone_command) and not state.list_open:
+            reason = "closed"
+        elif not read_cooldowns.allow(command, chat.id, user.id if user else None):
+            # Sin aviso: acaba de recibir (o va a recibir) la misma respuesta
+            metrics.GUARD_REJECTED.inc("cooldown")
+            raise ApplicationHandlerStop
+        else:
+            return
+
+    metrics.GUARD_REJECTED.inc(reason)
+    if rejection_notices.allow(chat.id, user.id if user else None):
+        logger.warning(f"⛔ Comando /{command} rechazado ({reason}) en chat {chat.id}")
+        await safe_reply(update, context, REJECTION_NOTICES[reason])
+    raise ApplicationHandlerStop
 
 
 # Comandos
 async def cmd_autorizar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global authorized, authorized_chat_id
     if not await reject_private_messages(update, context):
         return
     user = update.effective_user
@@ -189,18 +558,11 @@ async def cmd_autorizar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     current_chat_id = update.effective_chat.id
 
     if is_creator(user):
-        authorized = True
-        authorized_chat_id = current_chat_id  # Guardar el ID del chat autorizado
-
-        # Reset the zones
-        for zone in zones:
-            zones[zone] = None
+        # Autorizar el chat con zonas y lista de espera vacías
+        state = authorize_chat(current_chat_id)
 
-        # Clear waiting list
-        waiting_list.clear()
-
-        # Set up the rotation job with the current chat ID
-        setup_rotation_job(context, current_chat_id)
+        # Set up the rotation job for this chat
+        setup_rotation_job(state)
 
         await safe_reply(
             update,
@@ -219,50 +581,71 @@ async def cmd_autorizar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-def setup_rotation_job(context, chat_id):
-    global rotation_job
+def setup_rotation_job(state, first=None):
+    if ZONE_LEASES:
+        return  # Cada zona vence por su cuenta (start_lease)
+    # (Re)schedule the chat in the shared rotation scheduler
+    rotation_scheduler.schedule(state.chat_id, first)
+    logger.info(f"🔄 Rotation job scheduled for chat ID: {state.chat_id}")
 
-    # Remove any existing job
-    if rotation_job:
-        rotation_job.schedule_removal()
 
-    # Create a new job with the current chat ID
-    rotation_job = context.job_queue.run_repeating(
-        job_rotacion,
-        interval=ROTATION_DURATION_MINUTES * 60,
-        first=ROTATION_DURATION_MINUTES * 60,
-        data=chat_id,  # Pass the chat_id as data to the job
+def start_lease(state, zone):
+    """Programar el vencimiento del turno de la zona desde su inicio"""
+    if not ZONE_LEASES:
+        return
+    start = lease_start(state, zone)
+    elapsed = (datetime.now() - start).total_seconds() if start else 0
+    zone_leases.schedule(
+        (state.chat_id, zone), max(ROTATION_DURATION_MINUTES * 60 - elapsed, 0)
+    )
+
+
+def fill_free_zones(state):
+    """Con turnos por zona, las zonas vacías no esperan a la rotación: pasan
+    enseguida los primeros de la espera. Devuelve [(zona, usuario)]"""
+    if not ZONE_LEASES or not state.list_open:
+        return []
+    queue = state.queue
+    now = datetime.now()
+    promoted = []
+    for zone, user in list(queue.zones.items()):
+        if user is None and len(queue):
+            user = state.promote(zone, now)
+            if user is not None:
+                start_lease(state, zone)
+                promoted.append((zone, user))
+    if promoted:
+        notify_rotation(state, promoted)
+    return promoted
+
+
+def promoted_text(promoted):
+    return "".join(
+        f"\n➡️ {users.handle(user)} entra a Zona {zone_label(zone)}"
+        for zone, user in promoted
     )
-    logger.info(f"🔄 Rotation job scheduled for chat ID: {chat_id}")
 
 
 async def cmd_desautorizar(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global authorized, authorized_chat_id, rotation_job, list_open
     if not await reject_private_messages(update, context):
         return
     user = update.effective_user
 
     if is_creator(user):
-        # Verificar que el comando viene del chat autorizado (si existe)
-        if authorized_chat_id and update.effective_chat.id != authorized_chat_id:
+        # Verificar que este chat esté autorizado
+        state = find_chat(update.effective_chat.id)
+        if state is None or not state.authorized:
             await safe_reply(
-                update, context, "🚫 Solo puedes desautorizar desde el chat autorizado."
+                update, context, "🚫 Este bot no está autorizado en este grupo."
             )
             return
 
-        authorized = False
-        authorized_chat_id = None  # Limpiar el ID del chat autorizado
-        list_open = False  # Cerrar la lista también
-
-        # Reset zones and waiting list
-        for zone in zones:
-            zones[zone] = None
-        waiting_list.clear()
+        # Eliminar el estado del chat (zonas, lista de espera y lista abierta)
+        deauthorize_chat(state.chat_id)
+        status_board.forget(state.chat_id)
 
         # Remove the rotation job
-        if rotation_job:
-            rotation_job.schedule_removal()
-            rotation_job = None
+        rotation_scheduler.cancel(state.chat_id)
 
         await safe_reply(
             update,
@@ -283,10 +666,8 @@ async def check_authorized(update, context):
     return await check_authorized_chat(update, context)
 
 
-async def check_list_open(update, context):
-    if not await validate_message(update):
-        return False
-    if not list_open:
+async def check_list_open(update, context, state):
+    if not state.list_open:
         await safe_reply(
             update,
             context,
@@ -296,38 +677,89 @@ async def check_list_open(update, context):
     return True
 
 
+async def check_bulk_size(update, context):
+    if len(context.args) > MAX_BULK_USERS:
+        await safe_reply(
+            update, context, f"⚠️ Máximo {MAX_BULK_USERS} usuarios por comando."
+        )
+        return False
+    return True
+
+
 async def cmd_lista(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    if not await check_list_open(update, context):
+    if not await check_list_open(update, context, state):
         return
-    await safe_reply(update, context, format_list())
+    # /lista N muestra directamente la página N
+    page = 0
+    if context.args and context.args[0].isdigit():
+        page = max(int(context.args[0]) - 1, 0)
+    page = min(page, page_count(state.queue) - 1)
+    await reply_read_only(
+        update,
+        context,
+        ("lista", page),
+        lambda: (format_list(state, page), list_keyboard(state, page)),
+    )
+
+
+async def on_lista_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Botones de página de /lista: editar el mismo mensaje con la página pedida"""
+    query = update.callback_query
+    state = find_chat(update.effective_chat.id)
+    if state is None or not state.authorized or not state.list_open:
+        await query.answer("🚫 La lista está cerrada actualmente.")
+        return
+    page = min(int(query.data.split(":")[1]), page_count(state.queue) - 1)
+    await query.answer()
+    try:
+        await query.edit_message_text(
+            format_list(state, page), reply_markup=list_keyboard(state, page)
+        )
+    except BadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
 
 
 async def assign_zone(update, zone, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    if not await check_list_open(update, context):
+    if not await check_list_open(update, context, state):
         return
 
-    username = context.args[0] if context.args else f"@{update.effective_user.username}"
+    if context.args:
+        user_id = mentioned_user(context.args[0])
+        if user_id is None:
+            await safe_reply(update, context, f"⚠️ Usa el formato /{zone} @usuario")
+            return
+    else:
+        user_id = remember_user(update.effective_user)
+    username = users.handle(user_id)
+
+    queue = state.queue
+    if zone not in queue.zones:
+        await safe_reply(update, context, f"⚠️ La zona {zone_label(zone)} no existe.")
+        return
 
     # Verificar si el usuario ya está en otra zona
-    for current_zone, occupant in zones.items():
-        if occupant == username:
-            await safe_reply(
-                update,
-                context,
-                f"⚠️ Ya estás en la zona {current_zone[1]}⃣. Primero usa /exit para salir.",
-            )
-            return
+    current_zone = queue.zone_of(user_id)
+    if current_zone is not None:
+        await safe_reply(
+            update,
+            context,
+            f"⚠️ Ya estás en la zona {zone_label(current_zone)}. Primero usa /exit para salir.",
+        )
+        return
 
     # Verificar si el usuario está en la lista de espera
-    if username in waiting_list:
+    if queue.is_waiting(user_id):
         await safe_reply(
             update,
             context,
@@ -336,48 +768,83 @@ async def assign_zone(update, zone, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Asignar a la zona solicitada si está disponible
-    if zones[zone] is None:
-        zones[zone] = username
-        await safe_reply(update, context, f"✅ {username} asignado a Zona {zone[1]}⃣")
+    if queue.zones[zone] is None:
+        state.assign(zone, user_id, datetime.now())
+        start_lease(state, zone)
+        await safe_reply(
+            update, context, f"✅ {username} asignado a Zona {zone_label(zone)}"
+        )
         logger.info(f"{username} asignado a {zone}")
     else:
-        await safe_reply(update, context, f"⚠️ La zona {zone[1]}⃣ ya está ocupada.")
-    await safe_reply(update, context, format_list())
+        await safe_reply(
+            update, context, f"⚠️ La zona {zone_label(zone)} ya está ocupada."
+        )
+    await show_list(update, context, state)
 
 
 async def remove_zone(update, zone, context):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
+        return
+    if not await check_list_open(update, context, state):
         return
-    if not await check_list_open(update, context):
+    user_id = remember_user(update.effective_user)
+    username = users.handle(user_id)
+    if zone not in state.queue.zones:
+        await safe_reply(update, context, f"⚠️ La zona {zone_label(zone)} no existe.")
         return
-    username = f"@{update.effective_user.username}"
 
     # Verificar que el usuario esté en la zona específica
-    if zones[zone] == username:
-        zones[zone] = None  # Dejar como vacío, no como "Libre"
-        await safe_reply(update, context, f"🚫 {username} ha salido de Zona {zone[1]}⃣")
+    if state.queue.zones[zone] == user_id:
+        state.vacate(zone)  # Dejar como vacío, no como "Libre"
+        promoted = fill_free_zones(state)
+        await safe_reply(
+            update,
+            context,
+            f"🚫 {username} ha salido de Zona {zone_label(zone)}"
+            + promoted_text(promoted),
+        )
         logger.info(f"{username} eliminado de {zone}")
     else:
         await safe_reply(
-            update, context, f"⚠️ No estás en la zona {zone[1]}⃣ o no tienes permiso."
+            update,
+            context,
+            f"⚠️ No estás en la zona {zone_label(zone)} o no tienes permiso.",
         )
-    await safe_reply(update, context, format_list())
+    await show_list(update, context, state)
+
+
+async def cmd_zona(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/z<N> [@usuario] y /exitz<N>: un solo handler para todas las zonas"""
+    match = ZONE_COMMAND.match(update.effective_message.text)
+    if match is None:
+        return
+    exit_zone, number, target, rest = match.groups()
+    if target and target.lower() != (context.bot.username or "").lower():
+        return  # Comando para otro bot
+    zone = f"z{int(number)}"
+    context.args = rest.split() if rest else []
+    if exit_zone:
+        await remove_zone(update, zone, context)
+    else:
+        await assign_zone(update, zone, context)
 
 
 async def cmd_espera(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    if not await check_list_open(update, context):
+    if not await check_list_open(update, context, state):
         return
 
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
 
-    # Si hay argumentos, validamos si el usuario es admin
+    # Si hay argumentos, validamos si el usuario es admin (una vez para todos)
     if context.args:
         if not await is_admin(context, chat_id, user_id):
             await safe_reply(
@@ -386,44 +853,55 @@ async def cmd_espera(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "🚫 Solo los administradores pueden añadir a otros usuarios a la lista de espera.",
             )
             return
-        username = context.args[0]
-    else:
-        username = f"@{update.effective_user.username}"
-
-    # Verificar si el usuario ya está en alguna zona
-    for zone, occupant in zones.items():
-        if occupant == username:
+        if not await check_bulk_size(update, context):
+            return
+        if not all(arg.startswith("@") and len(arg) > 1 for arg in context.args):
             await safe_reply(
-                update,
-                context,
-                f"⚠️ {username} ya está en la zona {zone[1]}⃣. Usa /exit para salir primero.",
+                update, context, "⚠️ Usa el formato /espera @usuario [@usuario2 ...]"
             )
             return
-
-    # Verificar si ya está en la lista de espera
-    if username in waiting_list:
-        await safe_reply(
-            update, context, f"⚠️ {username} ya está en la lista de espera."
-        )
+        targets = list(dict.fromkeys(mentioned_user(arg) for arg in context.args))
     else:
-        waiting_list.append(username)
-        await safe_reply(update, context, f"📥 {username} añadido a la lista de espera")
-        logger.info(f"{username} añadido a espera")
+        targets = [remember_user(update.effective_user)]
 
-    await safe_reply(update, context, format_list())
+    queue = state.queue
+    # Todos los cambios se aplican juntos (sin esperas en el medio) y se
+    # responden con un solo mensaje y una sola lista
+    lines = []
+    added = in_zone = 0
+    for target in targets:
+        username = users.handle(target)
+        zone = queue.zone_of(target)
+        if zone is not None:
+            in_zone += 1
+            lines.append(
+                f"⚠️ {username} ya está en la zona {zone_label(zone)}. Usa /exit para salir primero."
+            )
+        elif queue.is_waiting(target):
+            lines.append(f"⚠️ {username} ya está en la lista de espera.")
+        else:
+            state.enqueue(target)
+            added += 1
+            lines.append(f"📥 {username} añadido a la lista de espera")
+            logger.info(f"{username} añadido a espera")
+    promoted = fill_free_zones(state) if added else []
+    await safe_reply(update, context, "\n".join(lines) + promoted_text(promoted))
+    if in_zone < len(targets):
+        await show_list(update, context, state)
 
 
 async def cmd_cambiar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    if not await check_list_open(update, context):
+    if not await check_list_open(update, context, state):
         return
 
     args = context.args
     user = update.effective_user
-    username1 = f"@{user.username}"
+    user1 = remember_user(user)
 
     if len(args) == 0:
         await safe_reply(
@@ -433,7 +911,7 @@ async def cmd_cambiar(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Cambio a nombre propio
     if len(args) == 1:
-        username2 = args[0]
+        user2 = mentioned_user(args[0])
     elif len(args) == 2:
         if not is_creator(user) and not await is_admin(
             context, update.effective_chat.id, user.id
@@ -442,7 +920,7 @@ async def cmd_cambiar(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 update, context, "🚫 Solo administradores pueden intercambiar a otros."
             )
             return
-        username1, username2 = args
+        user1, user2 = mentioned_user(args[0]), mentioned_user(args[1])
     else:
         await safe_reply(
             update,
@@ -451,23 +929,17 @@ async def cmd_cambiar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    if username1 == username2:
+    if user1 is None or user2 is None:
+        await safe_reply(
+            update, context, "❌ Usa /cambiar @Usuario o /cambiar @Usuario1 @Usuario2"
+        )
+        return
+    if user1 == user2:
         await safe_reply(update, context, "❌ No puedes intercambiarte contigo mismo.")
         return
 
-    # Buscar posiciones
-    def find_user_position(username):
-        for zone, occupant in zones.items():
-            if occupant == username:
-                return ("zone", zone)
-        if username in waiting_list:
-            return ("wait", waiting_list.index(username))
-        return None
-
-    pos1 = find_user_position(username1)
-    pos2 = find_user_position(username2)
-
-    if not pos1 and not pos2:
+    # Intercambiar posiciones (si solo uno está, el otro toma su lugar)
+    if not state.swap(user1, user2):
         await safe_reply(
             update,
             context,
@@ -475,118 +947,155 @@ async def cmd_cambiar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    if pos1 and pos2:
-        if pos1[0] == "zone" and pos2[0] == "zone":
-            zones[pos1[1]], zones[pos2[1]] = zones[pos2[1]], zones[pos1[1]]
-        elif pos1[0] == "zone" and pos2[0] == "wait":
-            zones[pos1[1]] = username2
-            waiting_list[pos2[1]] = username1
-        elif pos1[0] == "wait" and pos2[0] == "zone":
-            zones[pos2[1]] = username1
-            waiting_list[pos1[1]] = username2
-        elif pos1[0] == "wait" and pos2[0] == "wait":
-            waiting_list[pos1[1]], waiting_list[pos2[1]] = (
-                waiting_list[pos2[1]],
-                waiting_list[pos1[1]],
-            )
-    elif pos1 and not pos2:
-        if pos1[0] == "zone":
-            zones[pos1[1]] = username2
-        elif pos1[0] == "wait":
-            waiting_list[pos1[1]] = username2
-    elif pos2 and not pos1:
-        if pos2[0] == "zone":
-            zones[pos2[1]] = username1
-        elif pos2[0] == "wait":
-            waiting_list[pos2[1]] = username1
-
     await safe_reply(
-        update, context, f"🔁 {username1} ha sido intercambiado con {username2}"
+        update,
+        context,
+        f"🔁 {users.handle(user1)} ha sido intercambiado con {users.handle(user2)}",
     )
-    await safe_reply(update, context, format_list())
+    await show_list(update, context, state)
 
 
 async def cmd_exit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    if not await check_list_open(update, context):
+    if not await check_list_open(update, context, state):
         return
 
-    user_requesting = update.effective_user
+    user = update.effective_user
+    requester = remember_user(user)
     args = context.args
-    target_username = f"@{user_requesting.username}"  # Por defecto, él mismo
 
     # Si se pasa un @usuario como argumento
     if args:
         # if not await is_admin(context, update.effective_chat.id, user_requesting.id) and not is_creator(user_requesting):
         #     await safe_reply(update, context, "🚫 Solo administradores pueden expulsar a otros usuarios.")
         #     return
-        if args[0].startswith("@"):
-            target_username = args[0]
-        else:
+        if len(args) > 1:
+            if not is_creator(user) and not await is_admin(
+                context, update.effective_chat.id, user.id
+            ):
+                await safe_reply(
+                    update,
+                    context,
+                    "🚫 Solo administradores pueden sacar a varios usuarios a la vez.",
+                )
+                return
+            if not await check_bulk_size(update, context):
+                return
+        if not all(arg.startswith("@") for arg in args):
             await safe_reply(update, context, "⚠️ Usa el formato /exit @usuario")
             return
+        targets = [(arg, users.find(arg)) for arg in dict.fromkeys(args)]
+    else:
+        targets = [(users.handle(requester), requester)]  # Por defecto, él mismo
 
-    removed = False
-
-    # Eliminar de zonas
-    for zone in zones:
-        if zones[zone] == target_username:
-            zones[zone] = None
-            removed = True
-            logger.info(f"{target_username} fue eliminado de {zone}")
-
-    # Eliminar de lista de espera
-    for i, user in enumerate(waiting_list):
-        if user == target_username:
-            waiting_list[i] = "Libre"
-            removed = True
-            logger.info(f"{target_username} fue eliminado de la lista de espera")
-            break
-
-    if removed:
-        if target_username == f"@{user_requesting.username}":
-            await safe_reply(update, context, "✅ Saliste correctamente.")
-        else:
-            await safe_reply(
-                update, context, f"✅ {target_username} fue removido correctamente."
+    # Eliminar de zonas y dejar "Libre" su lugar en la lista de espera (todos
+    # juntos, con una sola respuesta)
+    lines = []
+    removed_any = False
+    for target_username, target in targets:
+        removed = state.leave(target) if target is not None else []
+        for where in removed:
+            if where == "wait":
+                logger.info(f"{target_username} fue eliminado de la lista de espera")
+            else:
+                logger.info(f"{target_username} fue eliminado de {where}")
+        if not removed:
+            lines.append(
+                f"⚠️ {target_username} no se encontraba en ninguna zona ni en la lista."
             )
-    else:
+        elif target == requester:
+            lines.append("✅ Saliste correctamente.")
+        else:
+            lines.append(f"✅ {target_username} fue removido correctamente.")
+        removed_any = removed_any or bool(removed)
+
+    promoted = promoted_text(fill_free_zones(state)) if removed_any else ""
+    await safe_reply(update, context, "\n".join(lines) + promoted)
+    await show_list(update, context, state)
+
+
+async def cmd_ordenar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/ordenar @a @b ...: pasar esos usuarios al frente de la espera, en ese orden"""
+    if not await reject_private_messages(update, context):
+        return
+    state = await check_authorized(update, context)
+    if not state:
+        return
+    if not await check_list_open(update, context, state):
+        return
+
+    user = update.effective_user
+    if not is_creator(user) and not await is_admin(
+        context, update.effective_chat.id, user.id
+    ):
         await safe_reply(
             update,
             context,
-            f"⚠️ {target_username} no se encontraba en ninguna zona ni en la lista.",
+            "🚫 Solo administradores pueden ordenar la lista de espera.",
         )
+        return
+    args = context.args
+    if not args or not all(arg.startswith("@") for arg in args):
+        await safe_reply(
+            update, context, "⚠️ Usa el formato /ordenar @usuario1 @usuario2 ..."
+        )
+        return
+    if not await check_bulk_size(update, context):
+        return
 
-    await safe_reply(update, context, format_list())
+    targets = [(arg, users.find(arg)) for arg in dict.fromkeys(args)]
+    queue = state.queue
+    lines = [
+        f"⚠️ {mention} no está en la lista de espera."
+        for mention, target in targets
+        if target is None or not queue.is_waiting(target)
+    ]
+    moved = state.reorder([target for _, target in targets if target is not None])
+    if moved:
+        lines.insert(
+            0,
+            "🔀 Al frente de la lista de espera: "
+            + ", ".join(users.handle(target) for target in moved),
+        )
+        logger.info(
+            f"Lista de espera reordenada en {state.chat_id}: {len(moved)} al frente"
+        )
+    await safe_reply(update, context, "\n".join(lines))
+    if moved:
+        await show_list(update, context, state)
 
 
 async def cmd_tomarlibre(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    if not await check_list_open(update, context):
+    if not await check_list_open(update, context, state):
         return
-    if not waiting_list:
+    queue = state.queue
+    if not len(queue):
         await safe_reply(update, context, f"⚠️ No hay ningun espacio libre.")
         return
-    username = f"@{update.effective_user.username}"
+    user_id = remember_user(update.effective_user)
+    username = users.handle(user_id)
 
     # Verificar que el usuario no esté ya en ninguna zona
-    for zone, occupant in zones.items():
-        if occupant == username:
-            await safe_reply(
-                update,
-                context,
-                f"⚠️ Ya estás en la zona {zone[1]}⃣. Primero usa /exit para salir.",
-            )
-            return
+    zone = queue.zone_of(user_id)
+    if zone is not None:
+        await safe_reply(
+            update,
+            context,
+            f"⚠️ Ya estás en la zona {zone_label(zone)}. Primero usa /exit para salir.",
+        )
+        return
 
     # Verificar que el usuario no esté en la lista de espera
-    if username in waiting_list:
+    if queue.is_waiting(user_id):
         await safe_reply(
             update,
             context,
@@ -594,21 +1103,13 @@ async def cmd_tomarlibre(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Buscar si hay posiciones "Libre" en la lista de espera
-    libre_index = None
-    for i, user in enumerate(waiting_list):
-        if user == "Libre":
-            libre_index = i
-            break
-
     # Si hay un "Libre" en la lista de espera, asignar al usuario allí
-    if libre_index is not None:
-        waiting_list[libre_index] = username
+    if state.take_free(user_id):
         await safe_reply(
             update, context, f"✅ {username} tomó un lugar libre en la lista de espera"
         )
         logger.info(f"{username} tomó lugar libre en la lista de espera")
-        await safe_reply(update, context, format_list())
+        await show_list(update, context, state)
         return
 
     await safe_reply(update, context, "⚠️ No hay lugares libres disponibles.")
@@ -617,28 +1118,25 @@ async def cmd_tomarlibre(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cmd_abrir(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    global list_open
-    if list_open is True:
+    if state.list_open is True:
         await safe_reply(update, context, "🔓 La lista ya esta abierta.")
         return
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
 
     if await is_admin(context, chat_id, user_id):
-        global last_rotation_time
-        list_open = True
-        last_rotation_time = datetime.now()
+        state.open(datetime.now())
 
         # Actualizar el trabajo de rotación con el tiempo correcto
-        if rotation_job:
-            setup_rotation_job(context, authorized_chat_id)
+        setup_rotation_job(state)
 
         await safe_reply(
             update, context, "🔓 Lista abierta. ¡Ya puedes usar los comandos!"
         )
-        await safe_reply(update, context, format_list())
+        await show_list(update, context, state)
         logger.info("Lista abierta")
     else:
         await safe_reply(
@@ -649,10 +1147,10 @@ async def cmd_abrir(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cmd_cerrar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    global list_open
-    if list_open is False:
+    if state.list_open is False:
         await safe_reply(update, context, "🔓 La lista ya esta cerrada.")
         return
 
@@ -660,10 +1158,7 @@ async def cmd_cerrar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     if await is_admin(context, chat_id, user_id):
-        list_open = False
-        for zone in zones:
-            zones[zone] = None
-        waiting_list.clear()
+        state.close()
 
         await safe_reply(update, context, "🔒 Lista cerrada.")
         logger.info("Lista cerrada")
@@ -673,39 +1168,69 @@ async def cmd_cerrar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
-async def cmd_reglas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def cmd_zonas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/zonas N: cambiar la cantidad de zonas del chat (solo admins)"""
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    await safe_reply(
-        update,
-        context,
-        """📜 Reglas del Sistema de Zonas:
+    if not context.args:
+        await safe_reply(
+            update, context, f"🔢 Este grupo tiene {len(state.queue.zones)} zonas."
+        )
+        return
+    if not await is_admin(context, state.chat_id, update.effective_user.id):
+        await safe_reply(
+            update, context, "🚫 Solo los administradores pueden cambiar las zonas."
+        )
+        return
+    try:
+        count = int(context.args[0])
+    except ValueError:
+        count = 0
+    if not 1 <= count <= MAX_ZONES:
+        await safe_reply(update, context, f"❌ Usa /zonas N (entre 1 y {MAX_ZONES})")
+        return
+
+    evicted = state.set_zones(count)
+    message = f"🔢 Ahora hay {count} zonas."
+    if evicted:
+        message += "\n🚫 Salieron de sus zonas: " + ", ".join(
+            users.handle(u) for _, u in evicted
+        )
+    message += promoted_text(fill_free_zones(state))
+    await safe_reply(update, context, message)
+    logger.info(f"Zonas del chat {state.chat_id}: {count}")
+    if state.list_open:
+        await show_list(update, context, state)
+
+
+RULES_TEXT = """📜 Reglas del Sistema de Zonas:
 1️⃣ Usa las zonas solo si estás disponible.
 2️⃣ Respeta los turnos y rotaciones.
 3️⃣ Usa /exit para salir de zona o lista.
 4️⃣ No abuses del sistema.
 5️⃣ No editar mensajes con comandos.
 
-✅ ¡Convivencia primero!""",
-    )
+✅ ¡Convivencia primero!"""
 
 
-async def cmd_comandos(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_authorized(update, context):
+async def cmd_reglas(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await reject_private_messages(update, context):
         return
-    if not await validate_message(update):
+    state = await check_authorized(update, context)
+    if not state:
         return
-    await safe_reply(
-        update,
-        context,
-        """📌 Menú de Comandos:
+    await reply_read_only(update, context, ("reglas",), lambda: (RULES_TEXT, None))
+
+
+COMMANDS_TEXT = """📌 Menú de Comandos:
 
 ▶️ Usuarios:
-/z1 /z2 /z3 - Asignarte a zona
-/z1 @usuario /z2 @usuario /z3 @usuario - Asignar a otro usuario
-/exitz1 /exitz2 /exitz3 - Salir de zona
+/z1 /z2 /z3 ... - Asignarte a zona
+/z1 @usuario /z2 @usuario ... - Asignar a otro usuario
+/exitz1 /exitz2 /exitz3 ... - Salir de zona
 /espera - Unirse a la lista de espera
 /exit o /exitlista - Salir de zona o lista
 /exit @usuario - Sacar a otro usuario
@@ -715,78 +1240,354 @@ async def cmd_comandos(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /lista - Ver estado actual
 /reglas - Reglas
 /comandos - Ver este menú
+/avisos - Recibir por privado los avisos de tus turnos
 
 ▶️ Admins:
 /abrir - Abrir lista
 /cerrar - Cerrar lista
 /abrirlista - Abrir lista (Diferente comando)
 /cerrarlista - Cerrar lista (Diferente comando)
+/zonas N - Cambiar la cantidad de zonas
+/espera @usuario1 @usuario2 ... - Añadir varios a la espera
+/exit @usuario1 @usuario2 ... - Sacar a varios
+/ordenar @usuario1 @usuario2 ... - Pasarlos al frente de la espera
 
 ▶️ Creador:
 /autorizar - Activar bot
 /desautorizar - Desactivar bot
+/perfil [segundos] - Perfilar handlers y jobs (/perfil off lo termina)
 
 ▶️ Utilidades:
-/chatid - Mostrar ID del chat actual""",
-    )
+/chatid - Mostrar ID del chat actual"""
 
 
-# JOB: Rotar zonas automáticamente
-async def job_rotacion(context: CallbackContext):
-    global zones, waiting_list, last_rotation_time
-    if not list_open or not authorized_chat_id:
+async def cmd_comandos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await validate_message(update):
+        return
+    state = await check_authorized(update, context)
+    if not state:
+        return
+    await reply_read_only(update, context, ("comandos",), lambda: (COMMANDS_TEXT, None))
+
+
+async def cmd_avisos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Por privado: /avisos activa los avisos de turno y /avisos off los
+    desactiva. En un grupo responde con el enlace al chat privado."""
+    if not await validate_message(update):
+        return
+    if update.effective_chat.type != "private":
+        await safe_reply(
+            update,
+            context,
+            "🔔 Para recibir por privado los avisos de tus turnos abre "
+            f"https://t.me/{context.bot.username}?start=avisos",
+        )
         return
+    enabled = not (context.args and context.args[0].lower() == "off")
+    set_notifications(remember_user(update.effective_user), enabled)
+    if enabled:
+        message = (
+            "🔔 Avisos activados: te escribiré cuando entres a una zona y cuando "
+            "seas de los próximos. Usa /avisos off para desactivarlos."
+        )
+    else:
+        message = "🔕 Avisos desactivados."
+    await safe_reply(update, context, message)
+
+
+async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/start por privado (el enlace de /avisos llega como /start avisos)"""
+    if context.args == ["avisos"]:
+        await cmd_avisos(update, context)
+        return
+    await safe_reply(
+        update,
+        context,
+        "👋 Este bot maneja las zonas en los grupos. Usa /avisos para recibir "
+        "aquí los avisos de tus turnos.",
+    )
 
-    # Get the chat_id from the job data (should be the authorized chat)
-    chat_id = context.job.data
 
-    # Verificar que el job esté corriendo para el chat autorizado
-    if chat_id != authorized_chat_id:
+# JOB: Rotar zonas automáticamente
+async def job_rotacion(application, chat_id):
+    state = find_chat(chat_id)
+
+    # Verificar que el job esté corriendo para un chat autorizado
+    if state is None or not state.authorized:
         logger.warning(f"🚫 Job de rotación cancelado - chat no autorizado: {chat_id}")
+        rotation_scheduler.cancel(chat_id)
+        return
+    if not state.list_open:
         return
 
     logger.info(f"🔁 Rotando zonas automáticamente en chat autorizado ID: {chat_id}...")
+    now = datetime.now()
+    if state.last_rotation_time:
+        expected = state.last_rotation_time + timedelta(
+            minutes=ROTATION_DURATION_MINUTES
+        )
+        metrics.ROTATION_LAG_SECONDS.observe(max((now - expected).total_seconds(), 0))
 
-    # Crear nuevas zonas vacías
-    new_zones = {zone: None for zone in zones}
+    # Pasar los primeros de la lista de espera a las zonas (los "Libre" dejan la zona vacía)
+    promoted = state.rotate(now)
+    for zone, user in promoted:
+        logger.info(f"🔁 Asignando {users.handle(user)} a {zone}")
+    notify_rotation(state, promoted)
 
-    # Mover usuarios en orden
-    for i, zone in enumerate(zones.keys()):
-        if i < len(waiting_list):
-            if waiting_list[i] != "Libre":
-                # Asignar el usuario de la lista de espera a la zona
-                new_zones[zone] = waiting_list[i]
-                logger.info(f"🔁 Asignando {waiting_list[i]} a {zone}")
-            else:
-                # Si la posición es "Libre", dejarla vacía
-                new_zones[zone] = None
+    # Enviar mensaje al grupo autorizado
+    if LIVE_STATUS_MESSAGE:
+        await application.bot.send_message(
+            chat_id=chat_id,
+            text="🔁 Rotación realizada automáticamente",
+            rate_limit_args=PRIORITY_ANNOUNCE,
+        )
+        status_board.request(application.bot, chat_id, application.create_task)
+        return
+    await application.bot.send_message(
+        chat_id=chat_id,
+        text="🔁 Rotación realizada automáticamente\n\n" + format_list(state),
+        reply_markup=list_keyboard(state),
+        rate_limit_args=PRIORITY_ANNOUNCE,
+    )
 
-    # Actualizar la lista de espera eliminando a los asignados
-    waiting_list = waiting_list[len(zones) :] if len(waiting_list) > len(zones) else []
 
-    # Actualizar las zonas
-    zones = new_zones
-    last_rotation_time = datetime.now()
+def notify_rotation(state, promoted):
+    """Avisar por privado (a quienes usaron /avisos) que entraron a una zona
+    o que entran en la próxima rotación; los envíos no demoran la rotación"""
+    title = chat_titles.get(state.chat_id, "el grupo")
+    for zone, user in promoted:
+        if users.wants_notifications(user):
+            notifier.notify(
+                user, f"🔔 {title}: ya estás en la zona {zone_label(zone)}."
+            )
+    if ZONE_LEASES:
+        # Con turnos por zona el próximo es solo el primero de la espera
+        now = datetime.now()
+        starts = [lease_start(state, zone) or now for zone in state.leases]
+        minutes = min(minutes_left(start, now) for start in starts) if starts else 0
+        upcoming = state.queue.waiting(0, 1)
+        when = f"cuando se libere una zona (en {minutes} minutos o antes)"
+    else:
+        upcoming = state.queue.waiting(0, len(state.queue.zones))
+        when = f"en la próxima rotación (en {ROTATION_DURATION_MINUTES} minutos)"
+    for user in upcoming:
+        if user != LIBRE and users.wants_notifications(user):
+            notifier.notify(user, f"⏭️ {title}: entras a una zona {when}.")
+
+
+async def serialized_job_rotacion(application, chat_id):
+    async with chat_lock(chat_id):
+        if cluster and not await cluster.confirm(chat_id):
+            return  # Otro worker es dueño del chat: él rota
+        await job_rotacion(application, chat_id)
+
+
+timed_job_rotacion = metrics.timed("rotacion", serialized_job_rotacion)
+
+
+# JOB: Vencimiento del turno de una zona (con ZONE_LEASES)
+async def job_turno(application, key):
+    chat_id, zone = key
+    state = find_chat(chat_id)
+    if (
+        state is None
+        or not state.authorized
+        or not state.list_open
+        or state.queue.zones.get(zone) is None
+    ):
+        zone_leases.cancel(key)  # La zona ya no está ocupada: nada que vencer
+        return
+    now = datetime.now()
+    expected = (lease_start(state, zone) or now) + timedelta(
+        minutes=ROTATION_DURATION_MINUTES
+    )
+    if expected - now > timedelta(seconds=1):
+        start_lease(state, zone)  # El turno empezó después de programarse
+        return
+    metrics.ROTATION_LAG_SECONDS.observe(max((now - expected).total_seconds(), 0))
 
-    # Enviar mensaje al grupo autorizado
-    await context.bot.send_message(
+    previous = state.vacate(zone)
+    user = state.promote(zone, now) if len(state.queue) else None
+    logger.info(
+        f"⏰ Vence el turno de {users.handle(previous)} en {zone} (chat {chat_id})"
+    )
+    if user is None:
+        zone_leases.cancel(key)
+        text = (
+            f"⏰ Terminó el turno de {users.handle(previous)} en Zona "
+            f"{zone_label(zone)}\n⚪ La zona queda libre"
+        )
+    else:
+        start_lease(state, zone)
+        notify_rotation(state, [(zone, user)])
+        text = (
+            f"⏰ Terminó el turno de {users.handle(previous)} en Zona "
+            f"{zone_label(zone)}" + promoted_text([(zone, user)])
+        )
+
+    if LIVE_STATUS_MESSAGE:
+        await application.bot.send_message(
+            chat_id=chat_id, text=text, rate_limit_args=PRIORITY_ANNOUNCE
+        )
+        status_board.request(application.bot, chat_id, application.create_task)
+        return
+    await application.bot.send_message(
         chat_id=chat_id,
-        text="🔁 Rotación realizada automáticamente\n\n" + format_list(),
+        text=text + "\n\n" + format_list(state),
+        reply_markup=list_keyboard(state),
+        rate_limit_args=PRIORITY_ANNOUNCE,
+    )
+
+
+async def serialized_job_turno(application, key):
+    async with chat_lock(key[0]):
+        if cluster and not await cluster.confirm(key[0]):
+            return
+        await job_turno(application, key)
+
+
+timed_job_turno = metrics.timed("turno", serialized_job_turno)
+
+
+def collect_queue_metrics():
+    """Gauges del estado de cada chat, calculados al leer /metrics"""
+    authorized = [state for state in chats.values() if state.authorized]
+    return [
+        ("zonas_chats_authorized", "Chats autorizados", (), [((), len(authorized))]),
+        (
+            "zonas_waiting_list_length",
+            "Largo de la lista de espera por chat",
+            ("chat",),
+            [((state.chat_id,), len(state.queue)) for state in authorized],
+        ),
+        (
+            "zonas_zones_occupied",
+            "Zonas ocupadas por chat",
+            ("chat",),
+            [
+                ((state.chat_id,), sum(1 for u in state.queue.zones.values() if u))
+                for state in authorized
+            ],
+        ),
+    ]
+
+
+metrics.add_collector(collect_queue_metrics)
+
+
+async def on_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Invalidar la cache de admins cuando cambia un miembro del chat"""
+    admin_cache.invalidate(update.chat_member.chat.id)
+
+
+async def job_snapshot(context: CallbackContext):
+    """Guardar un snapshot compacto del estado y recortar el journal"""
+    if journal:
+        journal.snapshot()
+
+
+def schedule_chat(state):
+    """Programar la rotación (o los turnos por zona) de un chat restaurado"""
+    if not state.authorized:
+        return
+    first = None
+    if state.list_open and state.last_rotation_time:
+        elapsed = (datetime.now() - state.last_rotation_time).total_seconds()
+        first = max(ROTATION_DURATION_MINUTES * 60 - elapsed, 0)
+    setup_rotation_job(state, first)
+    if state.list_open:
+        for zone, user in state.queue.zones.items():
+            if user is not None:
+                start_lease(state, zone)
+
+
+def unschedule_chat(state):
+    """Cancelar la rotación de un chat que pasó a otro worker"""
+    rotation_scheduler.cancel(state.chat_id)
+    for zone in state.queue.zones:
+        zone_leases.cancel((state.chat_id, zone))
+
+
+async def restore_rotation_jobs(app):
+    """Reprogramar la rotación de los chats restaurados desde el journal"""
+    for state in chats.values():
+        schedule_chat(state)
+    app.job_queue.run_repeating(
+        job_snapshot,
+        interval=SNAPSHOT_INTERVAL_SECONDS,
+        first=SNAPSHOT_INTERVAL_SECONDS,
     )
 
 
+async def on_startup(app):
+    global metrics_server, rotation_task, lease_task
+    await restore_rotation_jobs(app)
+    if journal and journal.pending_updates:
+        # Recibidos antes del reinicio sin terminar: van antes que los nuevos
+        for data in journal.pending_updates:
+            app.update_queue.put_nowait(Update.de_json(data, app.bot))
+        logger.info(
+            f"📥 {len(journal.pending_updates)} updates sin terminar re-encolados"
+        )
+        journal.pending_updates = []
+    rotation_task = create_task(
+        rotation_scheduler.run(lambda chat_id: timed_job_rotacion(app, chat_id))
+    )
+    lease_task = create_task(zone_leases.run(lambda key: timed_job_turno(app, key)))
+    notifier.start(app.bot)
+    if cluster:
+        cluster.start()
+    if METRICS_PORT:
+        try:
+            metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            # P. ej. otro worker de la misma máquina ya usa el puerto
+            logger.warning(f"📊 Métricas desactivadas ({METRICS_PORT}): {e}")
+    if PROFILE_ON_START:
+        profiler.start(min(PROFILE_ON_START, PROFILE_MAX_SECONDS))
+
+
+def checkpoint_update(update_id):
+    if cluster:
+        cluster.checkpoint(update_id)
+    if journal:
+        journal.checkpoint(update_id)
+
+
+async def on_stop(app):
+    """Después de terminar los handlers en curso: no iniciar más rotaciones y
+    esperar las que ya empezaron (los envíos pendientes se vacían en shutdown)"""
+    for task in (rotation_task, lease_task):
+        if task:
+            task.cancel()
+    await rotation_scheduler.drain()
+    await zone_leases.drain()
+    await notifier.stop()
+    if cluster:
+        await cluster.stop()
+    await profiler.drain()  # Guardar el perfil en curso
+
+
+async def on_shutdown(app):
+    if metrics_server:
+        metrics_server.close()
+    if journal:
+        journal.close()
+    if event_log:
+        event_log.close()
+
+
 async def cmd_chatid(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await reject_private_messages(update, context):
         return
-    if not await check_authorized(update, context):
+    state = await check_authorized(update, context)
+    if not state:
         return
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     if await is_admin(context, chat_id, user_id):
         """Comando para mostrar el ID del chat actual - útil para depuración"""
-        authorized_status = (
-            "✅ AUTORIZADO" if chat_id == authorized_chat_id else "❌ NO AUTORIZADO"
-        )
+        authorized_status = "✅ AUTORIZADO" if state.authorized else "❌ NO AUTORIZADO"
         await safe_reply(
             update,
             context,
@@ -802,45 +1603,183 @@ async def cmd_chatid(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def cmd_perfil(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/perfil [segundos] u /perfil off (solo el creador): perfilar handlers y
+    jobs por una ventana acotada y responder con el resumen por handler"""
+    if not await validate_message(update):
+        return
+    user = update.effective_user
+    if not is_creator(user):
+        await safe_reply(update, context, "🚫 Solo el creador puede perfilar el bot.")
+        logger.warning(
+            f"⛔ Usuario no autorizado intentó perfilar el bot: @{user.username}"
+        )
+        return
+
+    args = context.args
+    if args and args[0].lower() in ("off", "stop"):
+        if profiler.active:
+            profiler.stop()
+            await safe_reply(update, context, "🔬 Terminando el perfil...")
+        else:
+            await safe_reply(update, context, "⚠️ No hay un perfil en curso.")
+        return
+    try:
+        seconds = float(args[0]) if args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await safe_reply(update, context, "⚠️ Usa /perfil [segundos] o /perfil off")
+        return
+    seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+
+    chat_id = update.effective_chat.id
+    bot = context.bot
+
+    async def send_summary(summary):
+        await bot.send_message(chat_id=chat_id, text=summary)
+
+    if not profiler.start(seconds, send_summary):
+        await safe_reply(
+            update, context, "⚠️ Ya hay un perfil en curso (/perfil off lo termina)."
+        )
+        return
+    await safe_reply(
+        update,
+        context,
+        f"🔬 Perfilando por {seconds:g}s ({PROFILE_MODE}); al terminar envío el resumen.",
+    )
+
+
 # MAIN
-def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+def build_application():
+    """Crear la Application con todos los handlers (sin iniciarla)"""
+    processor = CheckpointProcessor(
+        CONCURRENT_UPDATES,
+        checkpoint_update,
+        journal.last_update_id if journal else 0,
+        journal.applied_updates if journal else (),
+        on_done=journal.finish if journal else None,
+    )
+    builder = ApplicationBuilder().token(TOKEN).base_url(BOT_API_URL)
+    if cluster:
+        # Los updates llegan del buzón del worker, no directo de Telegram
+        builder = builder.get_updates_request(cluster.inbox_request())
+        cluster.busy = processor.busy
+    elif journal:
+        # Cada update queda en el journal antes de confirmarlo a Telegram
+        builder = builder.update_queue(JournaledUpdateQueue(journal.accept))
+    app = (
+        builder.concurrent_updates(processor)
+        .rate_limiter(
+            OutboundScheduler(
+                global_per_second=SEND_GLOBAL_PER_SECOND,
+                group_per_minute=SEND_GROUP_PER_MINUTE,
+            )
+        )
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Handlers
+    if cluster:
+        # Antes del filtro: tomar el chat y cargar su estado del store
+        app.add_handler(TypeHandler(Update, cluster.ensure_chat), group=-2)
+    app.add_handler(TypeHandler(Update, guard), group=-1)  # Filtro previo
     app.add_handler(CommandHandler("autorizar", cmd_autorizar))
     app.add_handler(CommandHandler("desautorizar", cmd_desautorizar))
     app.add_handler(CommandHandler("lista", cmd_lista))
     app.add_handler(
-        CommandHandler("z1", lambda update, context: assign_zone(update, "z1", context))
-    )
-    app.add_handler(
-        CommandHandler("z2", lambda update, context: assign_zone(update, "z2", context))
-    )
+        CallbackQueryHandler(
+            metrics.timed("lista_pagina", serialized(on_lista_page)),
+            pattern=r"^lista:\d+$",
+        )
+    )  # Botones de página de /lista
     app.add_handler(
-        CommandHandler("z3", lambda update, context: assign_zone(update, "z3", context))
-    )
-    app.add_handler(CommandHandler("exitz1", lambda u, c: remove_zone(u, "z1")))
-    app.add_handler(CommandHandler("exitz2", lambda u, c: remove_zone(u, "z2")))
-    app.add_handler(CommandHandler("exitz3", lambda u, c: remove_zone(u, "z3")))
+        MessageHandler(
+            filters.Regex(ZONE_COMMAND),
+            metrics.timed("z", serialized(cmd_zona)),
+        )
+    )  # /z<N> y /exitz<N> para cualquier cantidad de zonas
     app.add_handler(CommandHandler("espera", cmd_espera))
     app.add_handler(CommandHandler("cambiar", cmd_cambiar))
     app.add_handler(CommandHandler("exit", cmd_exit))
     app.add_handler(CommandHandler("exitlista", cmd_exit))
     app.add_handler(CommandHandler("tomarlibre", cmd_tomarlibre))
+    app.add_handler(CommandHandler("ordenar", cmd_ordenar))
     app.add_handler(CommandHandler("abrir", cmd_abrir))
     app.add_handler(CommandHandler("abrirlista", cmd_abrir))
     app.add_handler(CommandHandler("cerrar", cmd_cerrar))
     app.add_handler(CommandHandler("cerrarlista", cmd_cerrar))
+    app.add_handler(CommandHandler("zonas", cmd_zonas))
     app.add_handler(CommandHandler("reglas", cmd_reglas))
     app.add_handler(CommandHandler("comandos", cmd_comandos))
+    app.add_handler(CommandHandler("avisos", cmd_avisos))
+    app.add_handler(CommandHandler("start", cmd_start, filters.ChatType.PRIVATE))
     app.add_handler(
         CommandHandler("chatid", cmd_chatid)
     )  # Comando para obtener el ID del chat
+    app.add_handler(CommandHandler("perfil", cmd_perfil))
+    app.add_handler(
+        ChatMemberHandler(on_chat_member, ChatMemberHandler.CHAT_MEMBER)
+    )  # Mantener al día la cache de admins
+
+    # Serializar cada comando por chat y medir su latencia (incluye la espera del lock)
+    for handler in app.handlers[0]:
+        if isinstance(handler, CommandHandler):
+            command = min(handler.commands)
+            handler.callback = metrics.timed(command, serialized(handler.callback))
 
-    # We don't set up the rotation job here - it will be set up when /autorizar is called
+    # Rotation jobs are set up when /autorizar is called (or restored in post_init)
+    return app
 
-    logger.info("🚀 Bot en ejecución...")
-    app.run_polling()
+
+def main():
+    global journal, event_log, cluster
+    if CLUSTER_STORE and WEBHOOK_URL:
+        # El líder pide los updates con getUpdates, que Telegram no atiende
+        # mientras haya un webhook: mejor no arrancar que ignorar WEBHOOK_URL
+        raise SystemExit("El modo cluster (CLUSTER_STORE) no admite WEBHOOK_URL")
+    if CLUSTER_STORE:
+        # El estado vive en el store compartido: cada chat se carga al tomarlo
+        cluster = Cluster(
+            open_store(CLUSTER_STORE),
+            WORKER_ID,
+            CLUSTER_LEASE_SECONDS,
+            poll_bot=Bot(TOKEN, base_url=BOT_API_URL),
+            on_acquire=schedule_chat,
+            on_release=unschedule_chat,
+        )
+        cluster.load()
+    else:
+        # Restaurar el estado guardado antes de procesar updates
+        journal = Journal(JOURNAL_PATH)
+        journal.load()
+        journal.start()
+    if EVENT_LOG_DIR:
+        event_log = EventLog(
+            EVENT_LOG_DIR, EVENT_LOG_MAX_BYTES, stream=WORKER_ID if cluster else None
+        )
+        event_log.start()
+
+    app = build_application()
+
+    if WEBHOOK_URL:
+        logger.info(f"🚀 Bot en ejecución (webhook en {WEBHOOK_URL})...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        if cluster:
+            logger.info(f"🧩 Worker {WORKER_ID} usando {CLUSTER_STORE}")
+        logger.info("🚀 Bot en ejecución...")
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
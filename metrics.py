@@ -0,0 +1,183 @@
+# metrics.py
+"""Métricas internas en formato de texto de Prometheus.
+
+Contadores e histogramas simples (sin dependencias) pensados para dejarlos
+siempre activos: cada observación es una suma en un dict. Los valores del
+estado (largo de la lista, zonas ocupadas) se calculan al momento de leerlos.
+"""
+
+from asyncio import start_server
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+_registry = []
+_collectors = []  # funciones -> [(nombre, ayuda, labels, [(valores, valor)])]
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _format_labels(names, values, extra=""):
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}  # labels -> [conteos por bucket..., +Inf, suma]
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        counts = self._values.get(label_values)
+        if counts is None:
+            counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def add_collector(collector):
+    """Registrar una función que calcula gauges al momento de leer las métricas"""
+    _collectors.append(collector)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, help, labels, samples in collector():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for label_values, value in samples:
+                lines.append(f"{name}{_format_labels(labels, label_values)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Métricas del bot
+COMMAND_SECONDS = Histogram(
+    "zonas_command_seconds", "Latencia de cada comando", ("command",)
+)
+COMMAND_ERRORS = Counter(
+    "zonas_command_errors_total", "Comandos que terminaron con excepción", ("command",)
+)
+API_CALLS = Counter(
+    "zonas_api_calls_total", "Llamadas a la Bot API por método", ("method",)
+)
+API_ERRORS = Counter(
+    "zonas_api_errors_total", "Errores de la Bot API por método", ("method", "error")
+)
+SAFE_REPLY = Counter("zonas_safe_reply_total", "Resultado de safe_reply", ("result",))
+GUARD_REJECTED = Counter(
+    "zonas_guard_rejected_total",
+    "Comandos descartados por el filtro previo",
+    ("reason",),
+)
+READ_COALESCED = Counter(
+    "zonas_read_coalesced_total",
+    "Pedidos de solo lectura respondidos junto con otro igual",
+    ("command",),
+)
+NOTIFICATIONS = Counter(
+    "zonas_notifications_total", "Avisos privados por resultado", ("result",)
+)
+ROTATION_LAG_SECONDS = Histogram(
+    "zonas_rotation_lag_seconds",
+    "Retraso de la rotación respecto a la hora prevista",
+    buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300),
+)
+
+
+# observer(comando, segundos) mientras hay un perfilado en curso (profiler.py)
+observer = None
+
+
+def timed(command, callback):
+    """Envolver un handler para medir su latencia y contar sus errores"""
+
+    @wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            COMMAND_ERRORS.inc(command)
+            raise
+        finally:
+            elapsed = perf_counter() - started
+            COMMAND_SECONDS.observe(elapsed, command)
+            if observer is not None:
+                observer(command, elapsed)
+
+    return wrapper
+
+
+async def serve(host, port):
+    """Servidor HTTP mínimo que responde GET /metrics"""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split(b" ")[1:2] == [b"/metrics"]:
+                body = render().encode()
+                status = b"200 OK"
+            else:
+                body = b"not found\n"
+                status = b"404 Not Found"
+            writer.write(
+                b"HTTP/1.1 " + status + b"\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                b"Connection: close\r\n\r\n" + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await start_server(handle, host, port)
+    logger.info(f"📊 Métricas en http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,71 @@
+# notice_limiter.py
+"""Límites en memoria para que el spam no genere un envío por mensaje."""
+
+from time import monotonic
+
+
+class NoticeLimiter:
+    """Permite como mucho un aviso por chat y uno por usuario cada ``interval``
+    segundos. Las entradas vencidas se descartan cuando hay más de
+    ``max_entries``, así la memoria no crece con el spam.
+    """
+
+    def __init__(self, interval, max_entries=10000):
+        self.interval = interval
+        self.max_entries = max_entries
+        self._chats = {}  # chat_id -> monotonic() del último aviso
+        self._users = {}  # user_id -> monotonic() del último aviso
+
+    def allow(self, chat_id, user_id):
+        """True si se puede avisar ahora (y registra el aviso)"""
+        now = monotonic()
+        since = now - self.interval
+        if self._chats.get(chat_id, since) > since:
+            return False
+        if user_id is not None and self._users.get(user_id, since) > since:
+            return False
+        self._chats[chat_id] = now
+        if user_id is not None:
+            self._users[user_id] = now
+        if len(self._chats) + len(self._users) > self.max_entries:
+            self._prune(since)
+        return True
+
+    def _prune(self, since):
+        self._chats = {k: t for k, t in self._chats.items() if t > since}
+        self._users = {k: t for k, t in self._users.items() if t > since}
+
+
+class Cooldowns:
+    """Espera mínima por usuario entre usos de un mismo comando en un chat.
+
+    ``seconds`` es un dict comando -> segundos (los comandos que no están no
+    tienen espera). Igual que NoticeLimiter, las entradas vencidas se
+    descartan al superar ``max_entries``.
+    """
+
+    def __init__(self, seconds, max_entries=10000):
+        self.seconds = seconds
+        self.max_entries = max_entries
+        self._last = {}  # (comando, chat_id, user_id) -> monotonic() del último uso
+
+    def allow(self, command, chat_id, user_id):
+        """True si el usuario puede usar el comando ahora (y registra el uso)"""
+        seconds = self.seconds.get(command)
+        if not seconds or user_id is None:
+            return True
+        now = monotonic()
+        key = (command, chat_id, user_id)
+        if self._last.get(key, now - seconds) > now - seconds:
+            return False
+        self._last[key] = now
+        if len(self._last) > self.max_entries:
+            self._prune(now)
+        return True
+
+    def _prune(self, now):
+        self._last = {
+            key: t
+            for key, t in self._last.items()
+            if t > now - self.seconds.get(key[0], 0)
+        }
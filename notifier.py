@@ -0,0 +1,76 @@
+# notifier.py
+"""Avisos privados a los usuarios que los pidieron, enviados en segundo plano."""
+
+from asyncio import Queue, QueueEmpty, create_task
+from logging import getLogger
+
+from telegram.error import BadRequest, Forbidden
+
+import metrics
+
+logger = getLogger(__name__)
+
+
+class Notifier:
+    """Cola de avisos atendida por ``concurrency`` workers.
+
+    notify() solo encola, así quien avisa (la rotación) no espera los envíos;
+    los workers limitan cuántos envíos hay en curso y el rate limiter del bot
+    los ordena detrás de las respuestas. Si el usuario bloqueó al bot (o nunca
+    le escribió) se llama a ``on_blocked(user_id)`` para dejar de avisarle.
+    """
+
+    def __init__(self, concurrency, send_options=None, on_blocked=None):
+        self.concurrency = concurrency
+        self.send_options = send_options or {}  # kwargs extra para cada envío
+        self.on_blocked = on_blocked
+        self._queue = Queue()
+        self._workers = []
+        self._bot = None
+
+    def start(self, bot):
+        self._bot = bot
+        self._workers = [create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Detener los workers; los avisos que quedaron en cola se descartan"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        dropped = 0
+        while True:
+            try:
+                self._queue.get_nowait()
+            except QueueEmpty:
+                break
+            dropped += 1
+        if dropped:
+            logger.warning(f"🔕 {dropped} avisos privados sin enviar al detener")
+
+    def notify(self, user_id, text):
+        if self._workers:
+            self._queue.put_nowait((user_id, text))
+
+    def pending(self):
+        return self._queue.qsize()
+
+    async def _work(self):
+        while True:
+            user_id, text = await self._queue.get()
+            try:
+                await self._bot.send_message(
+                    chat_id=user_id, text=text, **self.send_options
+                )
+                metrics.NOTIFICATIONS.inc("sent")
+            except (Forbidden, BadRequest) as e:
+                if isinstance(e, BadRequest) and "chat not found" not in str(e):
+                    metrics.NOTIFICATIONS.inc("error")
+                    logger.error(f"Error al avisar a {user_id}: {e}")
+                    continue
+                metrics.NOTIFICATIONS.inc("blocked")
+                logger.info(f"🔕 {user_id} no recibe mensajes privados: {e}")
+                if self.on_blocked:
+                    self.on_blocked(user_id)
+            except Exception as e:
+                metrics.NOTIFICATIONS.inc("error")
+                logger.error(f"Error al avisar a {user_id}: {e}")
@@ -0,0 +1,223 @@
+# profiler.py
+"""Perfilado a pedido de los handlers y jobs, por una ventana acotada.
+
+Mientras está apagado solo cuesta una comparación por comando (el observer de
+metrics.timed). Al encenderlo, según el modo:
+
+- "sample": un hilo toma cada ``interval`` segundos la pila del hilo del
+  event loop y la acumula en formato collapsed-stack (flamegraph.pl,
+  speedscope). Cada muestra se atribuye al comando (o job) de metrics.timed
+  que estaba ejecutando, para estimar su tiempo de CPU.
+- "trace": cProfile sobre el hilo del event loop; se guarda un .pstats.
+
+En los dos modos se anota la latencia de cada comando y al terminar se
+escribe un resumen por handler (.txt) junto al archivo del perfil.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from asyncio import Event, create_task, gather, to_thread, wait_for
+from collections import Counter, defaultdict
+from datetime import datetime
+from time import perf_counter
+from logging import getLogger
+
+import metrics
+
+logger = getLogger(__name__)
+
+
+async def _probe():
+    pass
+
+
+# Código del wrapper de metrics.timed: marca en la pila qué comando corre
+_TIMED_CODE = metrics.timed("", _probe).__code__
+_IDLE_FUNCTIONS = frozenset({"select", "poll", "epoll", "kqueue", "_run_once"})
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class _Sampler(threading.Thread):
+    """Hilo que muestrea la pila del hilo ``thread_id`` cada ``interval``"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # "a;b;c" -> muestras
+        self.by_command = Counter()  # comando -> muestras
+        self.idle = 0
+        self.total = 0
+        self._halt = threading.Event()  # (Thread ya usa _stop)
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            command = None
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                if command is None and code is _TIMED_CODE:
+                    command = frame.f_locals.get("command")
+                frame = frame.f_back
+            self.total += 1
+            if command is not None:
+                self.by_command[command] += 1
+            elif names and names[0].rpartition(":")[2] in _IDLE_FUNCTIONS:
+                self.idle += 1
+            self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+
+class Profiler:
+    """Ventanas de perfilado de a una; ``start`` devuelve False si ya hay una.
+
+    ``on_done(summary)`` (async) recibe el resumen al terminar la ventana,
+    p. ej. para enviarlo a quien la pidió.
+    """
+
+    def __init__(self, directory, mode="sample", interval=0.005):
+        if mode not in ("sample", "trace"):
+            raise ValueError(f"Modo de perfilado desconocido: {mode}")
+        self.directory = directory
+        self.mode = mode
+        self.interval = interval
+        self._task = None
+        self._stop = None
+        self._latencies = defaultdict(list)  # comando -> [segundos]
+
+    @property
+    def active(self):
+        return self._task is not None
+
+    def start(self, seconds, on_done=None):
+        if self._task is not None:
+            return False
+        self._stop = Event()
+        self._task = create_task(self._run(seconds, on_done))
+        return True
+
+    def stop(self):
+        """Terminar antes la ventana en curso (igual se escriben los archivos)"""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def drain(self):
+        """Terminar la ventana en curso y esperar a que se guarde"""
+        if self._task is not None:
+            self.stop()
+            await gather(self._task, return_exceptions=True)
+
+    def _observe(self, command, seconds):
+        self._latencies[command].append(seconds)
+
+    async def _run(self, seconds, on_done):
+        sampler = tracer = None
+        self._latencies = defaultdict(list)
+        if self.mode == "sample":
+            sampler = _Sampler(threading.get_ident(), self.interval)
+            sampler.start()
+        else:
+            tracer = cProfile.Profile()
+            tracer.enable()  # Solo el hilo actual: el del event loop
+        metrics.observer = self._observe
+        logger.info(f"🔬 Perfilando ({self.mode}) por {seconds:g}s")
+        started = perf_counter()
+        try:
+            try:
+                await wait_for(self._stop.wait(), seconds)
+            except TimeoutError:
+                pass
+        finally:
+            metrics.observer = None
+            if sampler is not None:
+                await to_thread(sampler.stop)
+            if tracer is not None:
+                tracer.disable()
+            elapsed = perf_counter() - started
+            try:
+                summary = await to_thread(self._write, elapsed, sampler, tracer)
+            finally:
+                self._task = None
+                self._stop = None
+        logger.info(summary)
+        if on_done is not None:
+            try:
+                await on_done(summary)
+            except Exception as e:
+                logger.error(f"Error al entregar el resumen del perfil: {e}")
+
+    def _write(self, elapsed, sampler, tracer):
+        """Guardar el perfil y el resumen; devuelve el texto del resumen"""
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(
+            self.directory, f"perfil-{datetime.now():%Y%m%d-%H%M%S}-{self.mode}"
+        )
+        if sampler is not None:
+            path = base + ".collapsed"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, samples in sampler.stacks.most_common():
+                    f.write(f"{stack} {samples}\n")
+            header = (
+                f"🔬 Perfil de {elapsed:.0f}s: {sampler.total} muestras cada "
+                f"{self.interval * 1000:g} ms, "
+                f"{100 * sampler.idle / max(sampler.total, 1):.0f}% en espera"
+            )
+        else:
+            path = base + ".pstats"
+            tracer.dump_stats(path)
+            header = f"🔬 Perfil de {elapsed:.0f}s con cProfile"
+
+        lines = [
+            header,
+            f"{'comando':<14}{'n':>6}{'media ms':>10}{'p99 ms':>9}{'máx ms':>9}"
+            + (f"{'CPU ms':>9}" if sampler else ""),
+        ]
+        commands = set(self._latencies) | set(sampler.by_command if sampler else ())
+        rows = []
+        for command in commands:
+            values = sorted(self._latencies.get(command, ()))
+            # Fracción de las muestras por la duración: el hilo no siempre
+            # consigue el GIL a tiempo, así que no se multiplica por interval
+            share = (
+                sampler.by_command[command] / max(sampler.total, 1) if sampler else 0
+            )
+            cpu = share * elapsed
+            rows.append((cpu, sum(values), command, values))
+        for cpu, total, command, values in sorted(rows, reverse=True):
+            mean = total / len(values) if values else 0
+            line = (
+                f"{command:<14}{len(values):>6}{mean * 1000:>10.1f}"
+                f"{_percentile(values, 0.99) * 1000:>9.1f}"
+                f"{(values[-1] if values else 0) * 1000:>9.1f}"
+            )
+            if sampler:
+                line += f"{cpu * 1000:>9.0f}"
+            lines.append(line)
+        lines.append(f"📄 {path}")
+        summary = "\n".join(lines)
+
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(summary + "\n")
+            if tracer is not None:
+                stream = io.StringIO()
+                stats = pstats.Stats(tracer, stream=stream)
+                stats.sort_stats("cumulative").print_stats(30)
+                f.write("\n" + stream.getvalue())
+        return summary
@@ -0,0 +1,234 @@
+# replay_events.py
+"""Reconstruir el estado desde el historial de eventos y medir el tiempo en zona.
+
+Recorre los archivos de event_log.py en orden, de a un evento por vez (la
+memoria depende del tamaño del estado, no de la cantidad de eventos), y
+muestra el estado de cada chat al momento pedido y las horas que cada
+usuario pasó en una zona dentro de la ventana --since/--until.
+
+    python replay_events.py eventos --until 2025-06-01T18:00 --top 20
+
+Con los streams de varios workers (modo cluster) los eventos se mezclan por
+tiempo y cada chat sigue al worker que lo cargó por última vez: los eventos
+de un worker que ya lo perdió (cambios que el store rechazó) se ignoran.
+"""
+
+import argparse
+import heapq
+import json
+from datetime import datetime
+from itertools import chain
+
+import chat_state
+from chat_state import USERS_CHAT_ID, ChatState, chats, users
+from event_log import event_streams, read_events
+
+# Eventos que pueden cambiar quién ocupa las zonas de un chat
+ZONE_OPS = frozenset(
+    {
+        "assign",
+        "vacate",
+        "promote",
+        "leave",
+        "swap",
+        "rotate",
+        "set_zones",
+        "close",
+        "authorize",
+        "deauthorize",
+        "load",
+        "unload",
+    }
+)
+
+
+class ZoneClock:
+    """Segundos en zona por (chat_id, user_id) dentro de [start, end]"""
+
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
+        self.totals = {}  # (chat_id, user_id) -> segundos
+        self._occupied = {}  # chat_id -> {zona: (user_id, desde)}
+
+    def sync(self, chat_id, t):
+        """Cerrar y abrir intervalos según las zonas actuales del chat"""
+        state = chats.get(chat_id)
+        current = state.queue.zones if state else {}
+        tracked = self._occupied.get(chat_id)
+        if tracked is None:
+            if not current:
+                return
+            tracked = self._occupied[chat_id] = {}
+        for zone, (user, since) in list(tracked.items()):
+            if current.get(zone) != user:
+                self._add(chat_id, user, since, t)
+                del tracked[zone]
+        for zone, user in current.items():
+            if user is not None and zone not in tracked:
+                tracked[zone] = (user, t)
+        if not tracked:
+            del self._occupied[chat_id]
+
+    def sync_all(self, t):
+        for chat_id in list(chain(self._occupied, chats)):
+            self.sync(chat_id, t)
+
+    def rename(self, chat_id, old, new):
+        """Un id provisorio pasó a ser el real: el intervalo sigue abierto"""
+        for zone, (user, since) in self._occupied.get(chat_id, {}).items():
+            if user == old:
+                self._occupied[chat_id][zone] = (new, since)
+
+    def finish(self, t):
+        for chat_id, tracked in self._occupied.items():
+            for user, since in tracked.values():
+                self._add(chat_id, user, since, t)
+        self._occupied.clear()
+
+    def _add(self, chat_id, user, since, until):
+        if self.start is not None:
+            since = max(since, self.start)
+        if self.end is not None:
+            until = min(until, self.end)
+        if until > since:
+            key = (chat_id, user)
+            self.totals[key] = self.totals.get(key, 0) + until - since
+
+
+def first_event(path):
+    return next(read_events(path), None)
+
+
+def start_files(files, at):
+    """Archivos desde el último arranque (evento "state") anterior a ``at``"""
+    if at is None:
+        return files
+    start = 0
+    for i, path in enumerate(files):
+        event = first_event(path)
+        if event is None:
+            continue
+        if event["t"] > at:
+            break
+        if event["op"] == "state":
+            start = i
+    return files[start:]
+
+
+def stream_events(stream, files):
+    for path in files:
+        for event in read_events(path):
+            yield event["t"], stream, event
+
+
+def load_state(data, stream, owners):
+    """Evento "state" de un stream: reemplaza los chats de ese stream y
+    actualiza la tabla de usuarios"""
+    if "chats" not in data:
+        data = {"users": [], "chats": data}  # Snapshot anterior a la tabla de usuarios
+    for user_id, username, first_name, *notify in data["users"]:
+        users.update(user_id, username, first_name)
+        users.set_notify(user_id, bool(notify and notify[0]))
+    for chat_id, owner in list(owners.items()):
+        if owner == stream:
+            del owners[chat_id]
+            chats.pop(chat_id, None)
+    for chat_id, state_data in data["chats"].items():
+        chat_id = int(chat_id)
+        chats[chat_id] = ChatState.from_dict(chat_id, state_data)
+        owners[chat_id] = stream
+
+
+def replay(streams, since=None, until=None):
+    """Aplicar los eventos de los streams (listas de archivos) hasta ``until``;
+    devuelve (ZoneClock, eventos, último t)"""
+    clock = ZoneClock(since, until)
+    owners = {}  # chat_id -> stream que tiene el chat
+    applied = 0
+    last = since or 0
+    events = heapq.merge(
+        *(stream_events(i, files) for i, files in enumerate(streams)),
+        key=lambda item: item[0],
+    )
+    for t, stream, event in events:
+        if until is not None and t > until:
+            clock.finish(until)
+            return clock, applied, until
+        op = event["op"]
+        if op == "state":
+            load_state(event["a"], stream, owners)
+            clock.sync_all(t)
+        else:
+            chat_id = event["c"]
+            if chat_id != USERS_CHAT_ID:
+                if op == "load":
+                    owners[chat_id] = stream
+                elif owners.setdefault(chat_id, stream) != stream:
+                    continue  # El chat ya es de otro worker
+                elif op in ("unload", "deauthorize"):
+                    del owners[chat_id]
+            chat_state.apply_record(chat_id, op, event["a"])
+            if op == "rename":
+                clock.rename(chat_id, *event["a"])
+            elif op in ZONE_OPS:
+                clock.sync(chat_id, t)
+        applied += 1
+        last = t
+    end = until if until is not None else last
+    clock.finish(end)
+    return clock, applied, end
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+def format_state(chat_id):
+    state = chats[chat_id]
+    zones = ", ".join(
+        f"{zone}={users.handle(u) if u else '-'}"
+        for zone, u in state.queue.zones.items()
+    )
+    status = "abierta" if state.list_open else "cerrada"
+    return f"{chat_id}: lista {status}, {zones}, {len(state.queue)} en espera"
+
+
+def main_replay():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", help="directorio de EVENT_LOG_DIR")
+    parser.add_argument("--since", type=parse_time, help="inicio (ISO 8601)")
+    parser.add_argument("--until", type=parse_time, help="momento a reconstruir")
+    parser.add_argument("--chat", type=int, help="mostrar solo este chat")
+    parser.add_argument("--top", type=int, default=20, help="usuarios a listar")
+    parser.add_argument("--dump", help="guardar el estado reconstruido en JSON")
+    args = parser.parse_args()
+
+    at = args.since or args.until
+    streams = [start_files(files, at) for files in event_streams(args.directory)]
+    clock, applied, end = replay(streams, args.since, args.until)
+
+    print(f"{applied} eventos aplicados hasta {datetime.fromtimestamp(end)}")
+    for chat_id in sorted(chats):
+        if args.chat is None or chat_id == args.chat:
+            print(format_state(chat_id))
+
+    ranking = sorted(
+        (
+            (seconds, chat_id, user)
+            for (chat_id, user), seconds in clock.totals.items()
+            if args.chat is None or chat_id == args.chat
+        ),
+        reverse=True,
+    )
+    print(f"\n{'chat':>16} {'usuario':<24} {'horas en zona':>14}")
+    for seconds, chat_id, user in ranking[: args.top]:
+        print(f"{chat_id:>16} {users.handle(user):<24} {seconds / 3600:>14.2f}")
+
+    if args.dump:
+        with open(args.dump, "w") as f:
+            json.dump(chat_state.dump_chats(), f)
+
+
+if __name__ == "__main__":
+    main_replay()
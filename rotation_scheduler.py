@@ -0,0 +1,83 @@
+# rotation_scheduler.py
+"""Un solo planificador de rotaciones para todos los chats."""
+
+from asyncio import Event, create_task, gather, wait_for
+from heapq import heappush, heappop
+from time import monotonic
+from zlib import crc32
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class RotationScheduler:
+    """Heap de vencimientos (deadline, chat_id) atendido por una sola tarea.
+
+    El siguiente vencimiento de cada chat se calcula desde el anterior (no
+    desde la hora real de ejecución), así no acumula deriva. Cada chat tiene
+    un desfase fijo dentro de ``spread`` segundos para que las rotaciones que
+    coinciden no se envíen todas en el mismo instante.
+    """
+
+    def __init__(self, interval, spread=0):
+        self.interval = interval
+        self.spread = spread
+        self._heap = []
+        self._deadlines = {}  # chat_id -> deadline vigente (las demás están canceladas)
+        self._running = set()
+        self._wakeup = Event()
+
+    def offset(self, chat_id):
+        """Desfase estable del chat dentro de la ventana de reparto"""
+        return crc32(str(chat_id).encode()) % 1000 / 1000 * self.spread
+
+    def schedule(self, chat_id, first=None):
+        """Programar (o reprogramar) la rotación del chat dentro de ``first`` segundos"""
+        delay = self.interval if first is None else first
+        deadline = monotonic() + delay + self.offset(chat_id)
+        self._deadlines[chat_id] = deadline
+        heappush(self._heap, (deadline, chat_id))
+        if self._heap[0][1] == chat_id:
+            self._wakeup.set()
+
+    def cancel(self, chat_id):
+        self._deadlines.pop(chat_id, None)
+
+    def next_deadline(self, chat_id):
+        return self._deadlines.get(chat_id)
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    async def run(self, fire):
+        """Ejecutar fire(chat_id) en cada vencimiento (cada uno en su propia tarea)"""
+        heap = self._heap
+        while True:
+            now = monotonic()
+            while heap and heap[0][0] <= now:
+                deadline, chat_id = heappop(heap)
+                if self._deadlines.get(chat_id) != deadline:
+                    continue  # Entrada cancelada o reprogramada
+                next_deadline = deadline + self.interval
+                while next_deadline <= now:  # Saltar vencimientos perdidos
+                    next_deadline += self.interval
+                self._deadlines[chat_id] = next_deadline
+                heappush(heap, (next_deadline, chat_id))
+                task = create_task(fire(chat_id))
+                self._running.add(task)
+                task.add_done_callback(self._done)
+            self._wakeup.clear()
+            try:
+                await wait_for(self._wakeup.wait(), heap[0][0] - now if heap else None)
+            except TimeoutError:
+                pass
+
+    async def drain(self):
+        """Esperar a que terminen las rotaciones en curso (al apagar)"""
+        if self._running:
+            await gather(*self._running, return_exceptions=True)
+
+    def _done(self, task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Error en la rotación: {task.exception()!r}")
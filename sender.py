@@ -0,0 +1,254 @@
+# sender.py
+"""Planificador de envíos salientes con límites de Telegram por chat y global.
+
+Se instala como rate limiter del bot (ApplicationBuilder().rate_limiter), así
+todos los envíos (reply_text, send_message, edit_message_text, ...) pasan por
+aquí sin cambiar cada llamada.
+"""
+
+from asyncio import (
+    Event,
+    create_task,
+    gather,
+    get_running_loop,
+    sleep,
+    wait_for,
+    shield,
+)
+from collections import OrderedDict, deque
+from time import monotonic
+from logging import getLogger
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = getLogger(__name__)
+
+# Prioridades (rate_limit_args): número menor sale primero
+PRIORITY_REPLY = 0  # Respuestas a comandos
+PRIORITY_ANNOUNCE = 1  # Anuncios y mensajes de estado
+PRIORITY_NOTIFY = 2  # Avisos privados (solo usan la capacidad que sobra)
+
+# Endpoints que envían o modifican mensajes en un chat
+SEND_ENDPOINTS = frozenset(
+    {"sendMessage", "editMessageText", "pinChatMessage", "forwardMessage"}
+)
+
+
+def retry_after_seconds(error):
+    """Segundos de espera de un RetryAfter (int o timedelta según la versión)"""
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate  # Tokens por segundo
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = monotonic()
+
+    def delay(self, now):
+        """Segundos hasta que haya un token (0 si ya hay)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Request:
+    __slots__ = ("callback", "args", "kwargs", "chat_id", "key", "future", "retries")
+
+    def __init__(self, callback, args, kwargs, chat_id, key, future):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.key = key
+        self.future = future
+        self.retries = 0
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Cola de envíos con token buckets por chat y global, prioridades,
+    fusión de envíos duplicados en cola y reintentos tras RetryAfter.
+
+    Cada chat tiene a lo sumo un envío en curso, así se respeta el orden de
+    los mensajes dentro del chat; chats distintos se envían en paralelo.
+    """
+
+    def __init__(
+        self,
+        global_per_second=25,
+        group_per_minute=20,
+        group_burst=5,
+        private_per_second=1,
+        max_retries=3,
+    ):
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.group_per_minute = group_per_minute
+        self.group_burst = group_burst
+        self.private_per_second = private_per_second
+        self.max_retries = max_retries
+        # Una cola por prioridad: chat -> deque
+        self._lanes = tuple(OrderedDict() for _ in range(PRIORITY_NOTIFY + 1))
+        self._queued = {}  # clave de fusión -> _Request aún en cola
+        self._buckets = {}  # chat_id -> TokenBucket
+        self._blocked_until = {}  # chat_id -> monotonic() (None = todos)
+        self._busy = set()  # chats con un envío en curso
+        self._inflight = set()
+        self._wakeup = None
+        self._worker = None
+
+    async def initialize(self):
+        # La Application y el Updater inicializan el bot: un solo worker
+        if self._worker is not None:
+            return
+        self._wakeup = Event()
+        self._worker = create_task(self._run())
+
+    async def shutdown(self):
+        """Esperar (con límite) a que se vacíe la cola y detener el worker"""
+        if self._worker is None:
+            return
+        for _ in range(100):
+            if not self.pending() and not self._inflight:
+                break
+            await sleep(0.05)
+        worker, self._worker = self._worker, None
+        worker.cancel()
+        await gather(worker, return_exceptions=True)
+
+    def pending(self):
+        return sum(len(q) for lane in self._lanes for q in lane.values())
+
+    async def process_request(
+        self, callback, args, kwargs, endpoint, data, rate_limit_args
+    ):
+        metrics.API_CALLS.inc(endpoint)
+        if endpoint not in SEND_ENDPOINTS or self._worker is None:
+            try:
+                return await callback(*args, **kwargs)
+            except Exception as e:
+                metrics.API_ERRORS.inc(endpoint, type(e).__name__)
+                raise
+
+        priority = PRIORITY_REPLY if rate_limit_args is None else rate_limit_args
+        chat_id = data.get("chat_id")
+        if endpoint == "editMessageText":
+            # Solo importa la última edición pendiente de cada mensaje
+            key = (endpoint, chat_id, data.get("message_id"))
+        else:
+            key = (endpoint, chat_id, data.get("text"), data.get("reply_parameters"))
+
+        queued = self._queued.get(key)
+        if queued is not None:
+            queued.args = args
+            queued.kwargs = kwargs
+            return await shield(queued.future)
+
+        request = _Request(
+            callback, args, kwargs, chat_id, key, get_running_loop().create_future()
+        )
+        self._queued[key] = request
+        self._lanes[min(priority, len(self._lanes) - 1)].setdefault(
+            chat_id, deque()
+        ).append(request)
+        self._wakeup.set()
+        return await shield(request.future)
+
+    async def _run(self):
+        while True:
+            request, wait = self._next_request(monotonic())
+            if request is not None:
+                task = create_task(self._dispatch(request))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+                continue
+            self._wakeup.clear()
+            try:
+                await wait_for(self._wakeup.wait(), wait)
+            except TimeoutError:
+                pass
+
+    def _next_request(self, now):
+        """Siguiente envío permitido, o (None, segundos a esperar)"""
+        wait = None
+        blocked_all = self._blocked_until.get(None, 0)
+        if blocked_all > now:
+            return None, blocked_all - now
+        global_delay = self.global_bucket.delay(now)
+        for lane in self._lanes:
+            for chat_id, requests in lane.items():
+                if chat_id in self._busy:
+                    continue
+                chat_delay = max(
+                    self._blocked_until.get(chat_id, 0) - now,
+                    self._bucket(chat_id).delay(now),
+                    global_delay,
+                )
+                if chat_delay > 0:
+                    wait = chat_delay if wait is None else min(wait, chat_delay)
+                    continue
+                request = requests.popleft()
+                if requests:
+                    lane.move_to_end(chat_id)  # Turno rotativo entre chats
+                else:
+                    del lane[chat_id]
+                self._queued.pop(request.key, None)
+                self._busy.add(chat_id)
+                self.global_bucket.take()
+                self._bucket(chat_id).take()
+                return request, None
+        return None, wait
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.private_per_second, 1)
+            else:
+                bucket = TokenBucket(self.group_per_minute / 60, self.group_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    async def _dispatch(self, request):
+        chat_id = request.chat_id
+        try:
+            if request.future.done():
+                return
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as e:
+            metrics.API_ERRORS.inc(request.args[0], "RetryAfter")
+            delay = retry_after_seconds(e) + 0.1
+            self._blocked_until[chat_id] = monotonic() + delay
+            logger.warning(
+                f"⏳ Límite de Telegram en chat {chat_id}: esperando {delay}s"
+            )
+            if request.retries < self.max_retries and not request.future.done():
+                request.retries += 1
+                # Reintentar primero, antes que lo que quedó en cola para el chat
+                self._lanes[PRIORITY_REPLY].setdefault(chat_id, deque()).appendleft(
+                    request
+                )
+                self._lanes[PRIORITY_REPLY].move_to_end(chat_id, last=False)
+            elif not request.future.done():
+                request.future.set_exception(e)
+        except Exception as e:
+            metrics.API_ERRORS.inc(request.args[0], type(e).__name__)
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._busy.discard(chat_id)
+            self._wakeup.set()
@@ -0,0 +1,482 @@
+# shared_store.py
+"""Store compartido por los workers del modo cluster (ver cluster.py).
+
+Guarda lo que los procesos necesitan ver en común:
+
+- los workers vivos (heartbeat con vencimiento),
+- leases con dueño y vencimiento: el del líder y uno por chat,
+- el estado de cada chat junto con el último update que lo cambió,
+- la tabla de usuarios con un número de secuencia para sincronizarla,
+- un buzón de updates por worker y el offset de getUpdates del líder.
+
+Cada update del buzón lleva un número de secuencia del store: es el update_id
+que ve el worker (ver cluster.InboxRequest), así los updates que se pasan del
+buzón de un worker caído a otro quedan detrás de los que ese ya recibió.
+
+Hay dos backends con la misma interfaz: SqliteStore (un archivo en modo WAL,
+para workers en una misma máquina y para pruebas locales) y RedisStore (o
+cualquier servidor compatible; requiere el paquete ``redis``). Los métodos
+son bloqueantes: desde el event loop se llaman con asyncio.to_thread.
+"""
+
+import json
+import sqlite3
+from threading import Lock
+from time import time
+from urllib.parse import urlparse
+from logging import getLogger
+
+try:
+    import redis
+except ImportError:  # Solo hace falta con un store redis://
+    redis = None
+
+logger = getLogger(__name__)
+
+
+def chat_lease(chat_id):
+    """Nombre del lease que da derecho a cambiar (y rotar) el chat"""
+    return f"chat:{chat_id}"
+
+
+def open_store(url):
+    """Store según la URL: sqlite:///ruta.db (sqlite:////ruta/absoluta.db)
+    o redis://host:puerto/db"""
+    if url.startswith("sqlite:///"):
+        return SqliteStore(url[len("sqlite:///") :])
+    if urlparse(url).scheme in ("redis", "rediss", "unix"):
+        return RedisStore(url)
+    raise ValueError(f"Store no soportado: {url}")
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    update_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_seq ON users (seq);
+CREATE TABLE IF NOT EXISTS inbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    worker TEXT NOT NULL,
+    update_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (worker, update_id)
+);
+CREATE INDEX IF NOT EXISTS inbox_worker ON inbox (worker, seq);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta VALUES ('offset', 0), ('users_seq', 0), ('placeholder', 0);
+"""
+
+
+class SqliteStore:
+    """Store en un archivo SQLite compartido por procesos de la misma máquina"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = Lock()  # Una conexión usada desde varios hilos
+
+    def _transaction(self, work):
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    # Workers
+    def heartbeat(self, worker, ttl):
+        self._query(
+            "INSERT OR REPLACE INTO workers VALUES (?, ?)", (worker, time() + ttl)
+        )
+
+    def workers(self):
+        """Workers vivos, ordenados"""
+        rows = self._query(
+            "SELECT worker FROM workers WHERE expires >= ? ORDER BY worker", (time(),)
+        )
+        return [worker for (worker,) in rows]
+
+    def remove_worker(self, worker):
+        self._query("DELETE FROM workers WHERE worker = ?", (worker,))
+
+    # Leases
+    def acquire(self, name, owner, ttl):
+        """Tomar (o renovar) el lease si está libre, vencido o ya es nuestro"""
+        now = time()
+
+        def work(conn):
+            conn.execute(
+                "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE"
+                " SET owner = excluded.owner, expires = excluded.expires"
+                " WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                (name, owner, now + ttl, now),
+            )
+            return conn.execute("SELECT changes()").fetchone()[0] == 1
+
+        return self._transaction(work)
+
+    def renew(self, names, owner, ttl):
+        """Renovar los leases; devuelve los que ya no son de ``owner``"""
+        expires = time() + ttl
+
+        def work(conn):
+            lost = []
+            for name in names:
+                cursor = conn.execute(
+                    "UPDATE leases SET expires = ? WHERE name = ? AND owner = ?",
+                    (expires, name, owner),
+                )
+                if cursor.rowcount == 0:
+                    lost.append(name)
+            return lost
+
+        return self._transaction(work)
+
+    def release(self, names, owner):
+        self._transaction(
+            lambda conn: conn.executemany(
+                "DELETE FROM leases WHERE name = ? AND owner = ?",
+                [(name, owner) for name in names],
+            )
+        )
+
+    # Chats
+    def load_chat(self, chat_id):
+        """(estado, último update_id aplicado) del chat, o None"""
+        rows = self._query(
+            "SELECT data, update_id FROM chats WHERE chat_id = ?", (chat_id,)
+        )
+        return (json.loads(rows[0][0]), rows[0][1]) if rows else None
+
+    def chat_ids(self):
+        return [chat_id for (chat_id,) in self._query("SELECT chat_id FROM chats")]
+
+    def save_chats(self, owner, items):
+        """Guardar [(chat_id, estado o None para borrarlo, update_id)] de los
+        chats cuyo lease tiene ``owner``; devuelve los ids rechazados"""
+
+        def work(conn):
+            rejected = []
+            for chat_id, data, update_id in items:
+                row = conn.execute(
+                    "SELECT owner FROM leases WHERE name = ?", (chat_lease(chat_id),)
+                ).fetchone()
+                if row is None or row[0] != owner:
+                    rejected.append(chat_id)
+                elif data is None:
+                    conn.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO chats VALUES (?, ?, ?)",
+                        (chat_id, json.dumps(data), update_id),
+                    )
+            return rejected
+
+        return self._transaction(work)
+
+    # Usuarios
+    def save_users(self, rows):
+        """Guardar registros [user_id, username, first_name, notify]"""
+
+        def work(conn):
+            seq = conn.execute(
+                "SELECT value FROM meta WHERE key = 'users_seq'"
+            ).fetchone()[0]
+            for row in rows:
+                seq += 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO users VALUES (?, ?, ?)",
+                    (row[0], json.dumps(row), seq),
+                )
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'users_seq'", (seq,))
+
+        self._transaction(work)
+
+    def users_since(self, seq):
+        """Registros cambiados después de ``seq``: (filas, nueva secuencia)"""
+        rows = self._query(
+            "SELECT data, seq FROM users WHERE seq > ? ORDER BY seq", (seq,)
+        )
+        if rows:
+            seq = rows[-1][1]
+        return [json.loads(data) for data, _ in rows], seq
+
+    def reserve_placeholders(self, count):
+        """Reservar ``count`` ids provisorios únicos entre todos los workers;
+        devuelve el menor (el bloque es [menor, menor + count))"""
+
+        def work(conn):
+            conn.execute(
+                "UPDATE meta SET value = value - ? WHERE key = 'placeholder'", (count,)
+            )
+            return conn.execute(
+                "SELECT value FROM meta WHERE key = 'placeholder'"
+            ).fetchone()[0]
+
+        return self._transaction(work)
+
+    # Buzones de updates
+    def push_updates(self, items):
+        """Encolar [(worker, update_id, update en JSON)]; un update repetido en
+        el mismo buzón se ignora"""
+        self._transaction(
+            lambda conn: conn.executemany(
+                "INSERT OR IGNORE INTO inbox (worker, update_id, data)"
+                " VALUES (?, ?, ?)",
+                items,
+            )
+        )
+
+    def fetch_updates(self, worker, seq, limit):
+        """[(seq, JSON)] del buzón desde la secuencia ``seq``, sin sacarlos"""
+        return self._query(
+            "SELECT seq, data FROM inbox WHERE worker = ? AND seq >= ?"
+            " ORDER BY seq LIMIT ?",
+            (worker, seq, limit),
+        )
+
+    def ack_updates(self, worker, seq):
+        """Sacar del buzón los updates ya procesados (hasta la secuencia ``seq``)"""
+        self._query("DELETE FROM inbox WHERE worker = ? AND seq <= ?", (worker, seq))
+
+    def inbox_workers(self):
+        return {
+            worker for (worker,) in self._query("SELECT DISTINCT worker FROM inbox")
+        }
+
+    def take_inbox(self, worker):
+        """Vaciar el buzón de un worker caído; devuelve [(update_id, JSON)]"""
+
+        def work(conn):
+            rows = conn.execute(
+                "SELECT update_id, data FROM inbox WHERE worker = ? ORDER BY seq",
+                (worker,),
+            ).fetchall()
+            conn.execute("DELETE FROM inbox WHERE worker = ?", (worker,))
+            return rows
+
+        return self._transaction(work)
+
+    # Offset de getUpdates (lo usa el líder)
+    def get_offset(self):
+        return self._query("SELECT value FROM meta WHERE key = 'offset'")[0][0]
+
+    def set_offset(self, offset):
+        self._query("UPDATE meta SET value = ? WHERE key = 'offset'", (offset,))
+
+
+# Scripts de Redis: cada uno se ejecuta de forma atómica en el servidor
+_ACQUIRE = """
+local owner = redis.call('GET', KEYS[1])
+if owner == false or owner == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_SAVE_CHAT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[3] == '' then
+    redis.call('HDEL', KEYS[2], ARGV[2])
+else
+    redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+end
+return 1
+"""
+_SAVE_USER = """
+local seq = redis.call('INCR', KEYS[3])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[2], seq, ARGV[1])
+return seq
+"""
+
+
+class RedisStore:
+    """Store en Redis (o un servidor compatible) para workers en varias máquinas"""
+
+    def __init__(self, url, prefix="zonas:"):
+        if redis is None:
+            raise RuntimeError("El store redis:// requiere el paquete redis")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._acquire = self._redis.register_script(_ACQUIRE)
+        self._renew = self._redis.register_script(_RENEW)
+        self._release = self._redis.register_script(_RELEASE)
+        self._save_chat = self._redis.register_script(_SAVE_CHAT)
+        self._save_user = self._redis.register_script(_SAVE_USER)
+
+    def _key(self, *parts):
+        return self.prefix + ":".join(str(part) for part in parts)
+
+    # Workers
+    def heartbeat(self, worker, ttl):
+        self._redis.zadd(self._key("workers"), {worker: time() + ttl})
+
+    def workers(self):
+        return sorted(self._redis.zrangebyscore(self._key("workers"), time(), "+inf"))
+
+    def remove_worker(self, worker):
+        self._redis.zrem(self._key("workers"), worker)
+
+    # Leases
+    def acquire(self, name, owner, ttl):
+        return (
+            self._acquire(
+                keys=[self._key("lease", name)], args=[owner, int(ttl * 1000)]
+            )
+            == 1
+        )
+
+    def renew(self, names, owner, ttl):
+        return [
+            name
+            for name in names
+            if not self._renew(
+                keys=[self._key("lease", name)], args=[owner, int(ttl * 1000)]
+            )
+        ]
+
+    def release(self, names, owner):
+        for name in names:
+            self._release(keys=[self._key("lease", name)], args=[owner])
+
+    # Chats
+    def load_chat(self, chat_id):
+        value = self._redis.hget(self._key("chats"), chat_id)
+        if value is None:
+            return None
+        update_id, data = json.loads(value)
+        return data, update_id
+
+    def chat_ids(self):
+        return [int(chat_id) for chat_id in self._redis.hkeys(self._key("chats"))]
+
+    def save_chats(self, owner, items):
+        rejected = []
+        for chat_id, data, update_id in items:
+            value = "" if data is None else json.dumps([update_id, data])
+            saved = self._save_chat(
+                keys=[self._key("lease", chat_lease(chat_id)), self._key("chats")],
+                args=[owner, chat_id, value],
+            )
+            if not saved:
+                rejected.append(chat_id)
+        return rejected
+
+    # Usuarios
+    def save_users(self, rows):
+        keys = [
+            self._key("users"),
+            self._key("users", "changes"),
+            self._key("users", "seq"),
+        ]
+        for row in rows:
+            self._save_user(keys=keys, args=[row[0], json.dumps(row)])
+
+    def users_since(self, seq):
+        changes = self._redis.zrangebyscore(
+            self._key("users", "changes"), f"({seq}", "+inf", withscores=True
+        )
+        if not changes:
+            return [], seq
+        values = self._redis.hmget(self._key("users"), [user for user, _ in changes])
+        return [json.loads(v) for v in values if v is not None], int(changes[-1][1])
+
+    def reserve_placeholders(self, count):
+        return self._redis.decrby(self._key("placeholder"), count)
+
+    # Buzones de updates
+    def push_updates(self, items):
+        if not items:
+            return
+        # Secuencias reservadas de una vez; el JSON del update es el miembro
+        # del sorted set, así un update repetido no se vuelve a encolar (NX)
+        last = self._redis.incrby(self._key("inbox_seq"), len(items))
+        pipe = self._redis.pipeline()
+        for seq, (worker, _, data) in enumerate(items, last - len(items) + 1):
+            pipe.zadd(self._key("inbox", worker), {data: seq}, nx=True)
+            pipe.sadd(self._key("inboxes"), worker)
+        pipe.execute()
+
+    def fetch_updates(self, worker, seq, limit):
+        rows = self._redis.zrangebyscore(
+            self._key("inbox", worker),
+            seq,
+            "+inf",
+            start=0,
+            num=limit,
+            withscores=True,
+        )
+        return [(int(seq), data) for data, seq in rows]
+
+    def ack_updates(self, worker, seq):
+        self._redis.zremrangebyscore(self._key("inbox", worker), "-inf", seq)
+
+    def inbox_workers(self):
+        return {
+            worker
+            for worker in self._redis.smembers(self._key("inboxes"))
+            if self._redis.zcard(self._key("inbox", worker))
+        }
+
+    def take_inbox(self, worker):
+        key = self._key("inbox", worker)
+        pipe = self._redis.pipeline()
+        pipe.zrange(key, 0, -1)
+        pipe.delete(key)
+        pipe.srem(self._key("inboxes"), worker)
+        rows = pipe.execute()[0]
+        return [(json.loads(data)["update_id"], data) for data in rows]
+
+    # Offset de getUpdates
+    def get_offset(self):
+        return int(self._redis.get(self._key("offset")) or 0)
+
+    def set_offset(self, offset):
+        self._redis.set(self._key("offset"), offset)
@@ -0,0 +1,81 @@
+# status_message.py
+"""Mensaje de estado fijado por chat que se edita en lugar de re-enviarse."""
+
+from asyncio import sleep
+from logging import getLogger
+
+from telegram.error import BadRequest, TelegramError
+
+logger = getLogger(__name__)
+
+
+class StatusBoard:
+    """Un mensaje de estado por chat, actualizado con edit_message_text.
+
+    Las actualizaciones pedidas dentro de ``debounce`` segundos se juntan en
+    una sola edición, y si el texto no cambió no se edita nada. Hay a lo sumo
+    una tarea por chat: las pedidas mientras se publica (p. ej. un envío
+    demorado en la cola de salida) las toma la misma tarea al terminar, así
+    no se publica ni se fija un segundo mensaje.
+    """
+
+    def __init__(self, render, debounce, send_options=None):
+        self.render = render  # función(chat_id) -> texto o None si ya no aplica
+        self.debounce = debounce
+        self.send_options = send_options or {}  # kwargs extra para cada envío
+        self._message_ids = {}  # chat_id -> message_id del mensaje fijado
+        self._texts = {}  # chat_id -> último texto publicado
+        self._pending = {}  # chat_id -> tarea de actualización programada o en curso
+
+    def request(self, bot, chat_id, create_task):
+        """Programar una actualización (create_task: p. ej. application.create_task)"""
+        if chat_id not in self._pending:
+            self._pending[chat_id] = create_task(self._update_later(bot, chat_id))
+
+    def forget(self, chat_id):
+        self._message_ids.pop(chat_id, None)
+        self._texts.pop(chat_id, None)
+
+    async def _update_later(self, bot, chat_id):
+        try:
+            while True:
+                await sleep(self.debounce)
+                text = self.render(chat_id)
+                if text is None or text == self._texts.get(chat_id):
+                    return
+                await self._publish(bot, chat_id, text)
+        finally:
+            self._pending.pop(chat_id, None)
+
+    async def _publish(self, bot, chat_id, text):
+        message_id = self._message_ids.get(chat_id)
+        if message_id is not None:
+            try:
+                await bot.edit_message_text(
+                    text=text,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    **self.send_options,
+                )
+                self._texts[chat_id] = text
+                return
+            except BadRequest as e:
+                if "message is not modified" in str(e):
+                    self._texts[chat_id] = text
+                    return
+                # El mensaje fue borrado o ya no se puede editar: publicar otro
+                logger.warning(f"No se pudo editar el mensaje de estado: {e}")
+        message = await bot.send_message(
+            chat_id=chat_id, text=text, **self.send_options
+        )
+        self._message_ids[chat_id] = message.message_id
+        self._texts[chat_id] = text
+        try:
+            await bot.pin_chat_message(
+                chat_id=chat_id,
+                message_id=message.message_id,
+                disable_notification=True,
+                **self.send_options,
+            )
+        except TelegramError as e:
+            logger.warning(f"No se pudo fijar el mensaje de estado: {e}")
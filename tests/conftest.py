@@ -0,0 +1,42 @@
+# conftest.py
+"""Fixtures de las pruebas: puertos libres y el bot real en otro proceso."""
+
+import multiprocessing
+import socket
+
+import pytest
+
+import load_test
+
+
+@pytest.fixture
+def free_port():
+    """Un puerto TCP libre en 127.0.0.1"""
+
+    def pick():
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    return pick
+
+
+@pytest.fixture
+def spawn_bot():
+    """spawn_bot(api_url, journal_path, **constantes) corre main.py en otro
+    proceso, como load_test.py; los que siguen vivos se matan al terminar"""
+    processes = []
+
+    def spawn(api_url, journal_path, **overrides):
+        process = multiprocessing.get_context("spawn").Process(
+            target=load_test.run_bot, args=(api_url, journal_path, overrides, False)
+        )
+        process.start()
+        processes.append(process)
+        return process
+
+    yield spawn
+    for process in processes:
+        if process.is_alive():
+            process.kill()
+        process.join()
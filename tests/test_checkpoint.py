@@ -0,0 +1,127 @@
+# test_checkpoint.py
+"""Reinicio sin pérdidas: cada update recibido queda en el journal antes de
+confirmarlo a Telegram, así que sobrevive a que maten el proceso a mitad del
+lote; y un chat lento no frena la recepción de los demás."""
+
+import asyncio
+import sqlite3
+from contextlib import closing
+from time import monotonic
+
+import chat_state
+import fake_bot_api
+from fake_bot_api import Faults, FakeBotApi
+from journal import Journal
+
+CHATS = (-100, -200, -300)
+WAITING = 10  # /espera por chat, todos en el mismo lote
+
+
+def script():
+    admin = (fake_bot_api.ADMIN_ID, fake_bot_api.ADMIN_USERNAME)
+    items = []
+    for chat_id in CHATS:
+        items.append((0.0, chat_id, *admin, "/autorizar"))
+        items.append((0.0, chat_id, *admin, "/abrir"))
+        for i in range(WAITING):
+            user_id = 10_000 + i
+            items.append((0.1, chat_id, user_id, f"u{user_id}", "/espera"))
+    return items
+
+
+def unfinished(journal_path):
+    """Updates recibidos que el bot todavía no terminó"""
+    with closing(sqlite3.connect(journal_path)) as conn:
+        return conn.execute("SELECT COUNT(*) FROM inbox").fetchone()[0]
+
+
+async def wait_until(condition, timeout):
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+def test_kill_mid_batch_drops_nothing(tmp_path, free_port, spawn_bot):
+    port = free_port()
+    journal_path = str(tmp_path / "zonas.db")
+    bot_settings = {
+        "SEND_GROUP_PER_MINUTE": 100_000,
+        "SEND_GLOBAL_PER_SECOND": 100_000,
+    }
+
+    async def run():
+        # Cada llamada a la API tarda: los handlers quedan a mitad del lote
+        api = FakeBotApi(script(), Faults(latency=0.2))
+        total = len(api.updates)
+        await api.start("127.0.0.1", port)
+        url = f"http://127.0.0.1:{port}/bot"
+        try:
+            bot = spawn_bot(url, journal_path, **bot_settings)
+            assert await wait_until(
+                lambda: api.delivered == total and len(api.first_reply) >= 3, 30
+            )
+            bot.kill()  # SIGKILL: sin apagado ordenado
+            await asyncio.to_thread(bot.join)
+            assert len(api.first_reply) < total
+
+            # Los que quedaron a mitad están en el journal, no en Telegram
+            journal = Journal(journal_path)
+            journal.load()
+            assert journal.pending_updates
+            chat_state.chats.clear()
+
+            bot = spawn_bot(url, journal_path, **bot_settings)
+            assert await wait_until(
+                lambda: api.finished() and not unfinished(journal_path), 60
+            )
+            bot.terminate()
+            await asyncio.to_thread(bot.join, 30)
+        finally:
+            await api.stop()
+
+    asyncio.run(run())
+
+    chat_state.chats.clear()
+    Journal(journal_path).load()
+    try:
+        for chat_id in CHATS:
+            state = chat_state.find_chat(chat_id)
+            assert state is not None and state.authorized and state.list_open
+            for i in range(WAITING):
+                assert state.queue.locate(10_000 + i) is not None, (chat_id, i)
+    finally:
+        chat_state.chats.clear()
+
+
+def test_slow_chat_does_not_stall_other_chats(free_port, spawn_bot, tmp_path):
+    port = free_port()
+    admin = (fake_bot_api.ADMIN_ID, fake_bot_api.ADMIN_USERNAME)
+    busy, other = -100, -200
+    items = [
+        (0.0, busy, *admin, "/autorizar"),
+        (0.0, busy, *admin, "/abrir"),
+        (0.0, other, *admin, "/autorizar"),
+    ]
+    # Muchas más respuestas que las que el límite por grupo deja enviar
+    items += [(0.1, busy, 10_000 + i, f"u{i}", "/espera") for i in range(150)]
+    items.append((1.0, other, 20_000, "otro", "/lista"))
+
+    async def run():
+        api = FakeBotApi(items)
+        lista = len(api.updates)  # El último update del guion
+        await api.start("127.0.0.1", port)
+        try:
+            spawn_bot(
+                f"http://127.0.0.1:{port}/bot",
+                str(tmp_path / "zonas.db"),
+                SEND_GROUP_PER_MINUTE=20,
+            )
+            assert await wait_until(lambda: lista in api.first_reply, 15)
+            assert api.first_reply[lista] < 5
+        finally:
+            await api.stop()
+
+    asyncio.run(run())
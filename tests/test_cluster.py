@@ -0,0 +1,193 @@
+# test_cluster.py
+"""Modo cluster con dos workers en el mismo proceso y un SqliteStore: reparto
+de chats, leases que vencen, guardados rechazados y el buzón de updates."""
+
+import asyncio
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import chat_state
+from chat_state import chats, users
+from cluster import Cluster, HashRing
+from event_log import EventLog, event_streams
+from replay_events import replay
+from shared_store import SqliteStore
+
+LEASE_SECONDS = 0.3
+CHAT = -100
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Estado global de chat_state limpio: cada Cluster se registra como listener
+    monkeypatch.setattr(chat_state, "_listeners", [])
+    monkeypatch.setattr(users, "placeholder_source", None)
+    chats.clear()
+    users.clear()
+    yield SqliteStore(str(tmp_path / "cluster.db"))
+    chats.clear()
+    users.clear()
+
+
+def new_cluster(store, worker):
+    cluster = Cluster(store, worker, LEASE_SECONDS)
+    cluster.load()
+    return cluster
+
+
+def telegram_update(update_id, chat_id, text="/lista"):
+    return json.dumps(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": chat_id, "type": "group"},
+                "from": {"id": 1, "is_bot": False, "first_name": "Ana"},
+                "text": text,
+            },
+        }
+    )
+
+
+async def get_updates(cluster, offset):
+    params = {"offset": offset, "limit": 100, "timeout": 0}
+    status, body = await cluster.inbox_request().do_request(
+        "http://bot/getUpdates", "POST", SimpleNamespace(parameters=params)
+    )
+    assert status == 200
+    return json.loads(body)["result"]
+
+
+def test_ring_is_stable_and_moves_only_chats_of_the_new_worker():
+    chat_ids = range(-1000, 0)
+    ring = HashRing(["a", "b"])
+    owners = {chat_id: ring.owner(chat_id) for chat_id in chat_ids}
+    assert set(owners.values()) == {"a", "b"}
+    # El orden en que llegan los workers no cambia el reparto
+    assert owners == {c: HashRing(["b", "a"]).owner(c) for c in chat_ids}
+
+    bigger = HashRing(["a", "b", "c"])
+    moved = [c for c in chat_ids if bigger.owner(c) != owners[c]]
+    assert moved
+    assert all(bigger.owner(c) == "c" for c in moved)
+    assert HashRing([]).owner(CHAT) is None
+
+
+def test_expired_lease_passes_to_other_worker_and_fences_old_owner(store):
+    a = new_cluster(store, "a")
+    b = new_cluster(store, "b")
+
+    async def run():
+        assert await a._acquire(CHAT)
+        chat_state.authorize_chat(CHAT)
+        await a.flush()
+        assert store.load_chat(CHAT)[0]["authorized"]
+
+        # Mientras a tenga el lease, b no puede tomar el chat
+        assert not await b._acquire(CHAT, wait=False)
+        await asyncio.sleep(LEASE_SECONDS * 1.5)  # a no renovó: vence
+        assert await b._acquire(CHAT, wait=False)
+        assert CHAT in b._held
+        assert chats[CHAT].authorized  # Estado cargado del store
+
+        # a todavía cree tener el chat: su guardado se rechaza y lo suelta
+        chats[CHAT].open(datetime.now())
+        await a.flush()
+        assert CHAT not in a._held
+        assert not store.load_chat(CHAT)[0]["list_open"]
+        assert not await a.confirm(CHAT)
+        assert await b.confirm(CHAT)
+
+    asyncio.run(run())
+
+
+def test_inbox_offsets_redelivery_and_acks(store):
+    a = new_cluster(store, "a")
+    b = new_cluster(store, "b")
+    store.push_updates(
+        [
+            ("a", 501, telegram_update(501, -1)),
+            ("b", 502, telegram_update(502, -2)),
+            ("a", 503, telegram_update(503, -1)),
+            ("a", 501, telegram_update(501, -1)),  # Repetido: se ignora
+        ]
+    )
+
+    async def run():
+        updates = await get_updates(a, 0)
+        seqs = [u["update_id"] for u in updates]
+        assert len(seqs) == 2 and seqs == sorted(seqs)
+        assert [a.telegram_id(seq) for seq in seqs] == [501, 503]
+        assert [u["update_id"] for u in await get_updates(b, 0)] != seqs
+
+        # Sin confirmar, el mismo offset los vuelve a entregar
+        assert [u["update_id"] for u in await get_updates(a, seqs[0])] == seqs
+        assert await get_updates(a, seqs[-1] + 1) == []
+
+        a.checkpoint(seqs[0])
+        await a.flush()
+        assert [seq for seq, _ in store.fetch_updates("a", 0, 100)] == seqs[1:]
+        assert a.telegram_id(seqs[0]) == seqs[0]  # Ya olvidado
+        assert a.telegram_id(seqs[1]) == 503
+
+        # Los updates de un worker caído pasan detrás de los que ya había
+        store.push_updates([("c", 504, telegram_update(504, -1))])
+        b.ring = HashRing(["a", "b"])
+        await b._reroute_orphans()
+        assert store.fetch_updates("c", 0, 100) == []
+        owner = b.ring.owner(-1)
+        rerouted = await get_updates(a if owner == "a" else b, 0)
+        assert rerouted[-1]["update_id"] > seqs[-1]
+        assert (a if owner == "a" else b).telegram_id(rerouted[-1]["update_id"]) == 504
+
+    asyncio.run(run())
+
+
+def test_placeholder_ids_are_unique_across_workers(store):
+    new_cluster(store, "a")
+    a_placeholders = users.placeholder_source
+    new_cluster(store, "b")
+    b_placeholders = users.placeholder_source
+
+    async def run():
+        return [f() for _ in range(200) for f in (a_placeholders, b_placeholders)]
+
+    ids = asyncio.run(run())
+    assert len(set(ids)) == len(ids)
+    assert all(user_id < 0 for user_id in ids)
+
+
+def test_replay_follows_chat_across_worker_streams(store, tmp_path):
+    directory = str(tmp_path / "eventos")
+    a_log = EventLog(directory, stream="a")
+    a_log.start()
+    a = new_cluster(store, "a")
+    b = new_cluster(store, "b")
+
+    async def run():
+        await a._acquire(CHAT)
+        chat_state.authorize_chat(CHAT)
+        chats[CHAT].open(datetime.now())
+        await a.flush()
+        a._drop(CHAT)
+        store.release([f"chat:{CHAT}"], "a")
+        # b arranca después: su evento "state" no tiene chats
+        chat_state._listeners.remove(a_log.record)
+        b_log = EventLog(directory, stream="b")
+        b_log.start()
+        await b._acquire(CHAT)
+        return b_log
+
+    b_log = asyncio.run(run())
+    a_log.close()
+    b_log.close()
+
+    chats.clear()
+    streams = event_streams(directory)
+    assert len(streams) == 2
+    replay(streams)
+    assert chats[CHAT].authorized and chats[CHAT].list_open
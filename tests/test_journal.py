@@ -0,0 +1,41 @@
+# test_journal.py
+"""Journal: un lote que no se pudo escribir se reintenta en lugar de perderse."""
+
+import sqlite3
+
+import chat_state
+import journal
+from journal import Journal
+
+
+def test_failed_batch_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "RETRY_SECONDS", 0.01)
+    monkeypatch.setattr(chat_state, "_listeners", [])
+    write = Journal._write
+    failures = []
+
+    def flaky_write(self, conn, batch):
+        if not failures:
+            failures.append(batch)
+            raise sqlite3.OperationalError("disk I/O error")
+        write(self, conn, batch)
+
+    monkeypatch.setattr(Journal, "_write", flaky_write)
+    path = str(tmp_path / "zonas.db")
+    chat_state.chats.clear()
+    try:
+        writer = Journal(path)
+        writer.start()
+        chat_state.authorize_chat(-100)
+        writer.checkpoint(7)
+        writer._queue.put(None)  # Cerrar sin snapshot: solo el journal
+        writer._writer.join()
+        assert failures
+
+        chat_state.chats.clear()
+        reader = Journal(path)
+        reader.load()
+        assert chat_state.find_chat(-100).authorized
+        assert reader.last_update_id == 7
+    finally:
+        chat_state.chats.clear()
@@ -0,0 +1,47 @@
+# test_status_message.py
+"""Mensaje de estado: un envío lento no lleva a publicar un segundo mensaje."""
+
+import asyncio
+from types import SimpleNamespace
+
+from status_message import StatusBoard
+
+
+class SlowBot:
+    """Bot cuyo send_message tarda (p. ej. detrás de la cola de salida)"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+        self.edited = []
+        self.pinned = []
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+        return SimpleNamespace(message_id=len(self.sent))
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        self.edited.append((message_id, text))
+
+    async def pin_chat_message(self, chat_id, message_id, disable_notification):
+        self.pinned.append(message_id)
+
+
+def test_requests_during_slow_send_reuse_the_message():
+    texts = {1: "v1"}
+    board = StatusBoard(lambda chat_id: texts[chat_id], debounce=0.01)
+    bot = SlowBot(delay=0.2)
+
+    async def run():
+        board.request(bot, 1, asyncio.create_task)
+        await asyncio.sleep(0.05)  # El envío está en curso
+        texts[1] = "v2"
+        board.request(bot, 1, asyncio.create_task)
+        while board._pending:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert bot.sent == ["v1"]
+    assert bot.pinned == [1]
+    assert bot.edited == [(1, "v2")]
@@ -0,0 +1,65 @@
+# test_webhook.py
+"""Modo webhook: el bot atiende los updates que llegan con el secreto correcto."""
+
+import asyncio
+from time import monotonic
+
+import httpx
+
+import fake_bot_api
+from fake_bot_api import FakeBotApi, make_update, post_webhook
+
+SECRET = "secreto-de-prueba"
+
+
+async def post_until_up(url, update, secret, timeout=30):
+    """Reintentar hasta que el bot levante el servidor del webhook"""
+    deadline = monotonic() + timeout
+    while True:
+        try:
+            return await post_webhook(url, update, secret)
+        except httpx.TransportError:
+            if monotonic() >= deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def test_webhook_checks_secret_token(tmp_path, free_port, spawn_bot):
+    api_port, webhook_port = free_port(), free_port()
+    url = f"http://127.0.0.1:{webhook_port}/telegram"
+    chat_id = -100
+    admin = (fake_bot_api.ADMIN_ID, fake_bot_api.ADMIN_USERNAME)
+
+    async def run():
+        api = FakeBotApi([])
+        await api.start("127.0.0.1", api_port)
+        bot = spawn_bot(
+            f"http://127.0.0.1:{api_port}/bot",
+            str(tmp_path / "zonas.db"),
+            WEBHOOK_URL=url,
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=webhook_port,
+            WEBHOOK_PATH="telegram",
+            WEBHOOK_SECRET=SECRET,
+        )
+        try:
+            update = make_update(1, chat_id, *admin, "/autorizar")
+            assert await post_until_up(url, update, "otro-secreto") == 403
+            assert await post_webhook(url, update) == 403
+            await asyncio.sleep(1)
+            assert api.calls["sendMessage"] == 0
+
+            assert await post_webhook(url, update, SECRET) == 200
+            lista = make_update(2, chat_id, *admin, "/lista")
+            assert await post_webhook(url, lista, SECRET) == 200
+            deadline = monotonic() + 10
+            while api.calls["sendMessage"] < 2 and monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            assert api.calls["sendMessage"] >= 2
+            assert api.calls["setWebhook"] == 1
+        finally:
+            bot.terminate()
+            await asyncio.to_thread(bot.join, 30)
+            await api.stop()
+
+    asyncio.run(run())
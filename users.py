@@ -0,0 +1,134 @@
+# users.py
+"""Tabla de usuarios: un registro compacto por user.id de Telegram."""
+
+from sys import intern
+
+
+class UserRecord:
+    __slots__ = ("user_id", "username", "first_name", "handle", "notify")
+
+    def __init__(self, user_id, username, first_name):
+        self.user_id = user_id
+        self.notify = False  # Pidió avisos privados de sus turnos (/avisos)
+        self.set_names(username, first_name)
+
+    def set_names(self, username, first_name):
+        self.username = username
+        self.first_name = first_name
+        # Nombre para mostrar: @usuario, o el nombre si no tiene usuario
+        if username:
+            self.handle = f"@{username}"
+        else:
+            self.handle = first_name or str(self.user_id)
+
+
+class UserTable:
+    """Registros por id con un índice @usuario -> id (sin distinguir mayúsculas).
+
+    Las @menciones de alguien que el bot aún no vio reciben un id provisorio
+    negativo; cuando esa persona escribe, su registro real reemplaza al
+    provisorio (update() devuelve el id reemplazado para migrar las listas).
+
+    ``version`` aumenta cuando cambia el nombre de un usuario ya registrado
+    (sirve como clave de cache al renderizar).
+    """
+
+    __slots__ = (
+        "_records",
+        "_by_username",
+        "_next_placeholder",
+        "version",
+        "placeholder_source",
+    )
+
+    def __init__(self):
+        self._records = {}  # user_id -> UserRecord
+        self._by_username = {}  # username en minúsculas -> user_id
+        self._next_placeholder = -1
+        self.version = 0
+        # Función que reparte los ids provisorios cuando varios procesos
+        # comparten la tabla (modo cluster); None: se cuentan aquí
+        self.placeholder_source = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, user_id):
+        return self._records.get(user_id)
+
+    def handle(self, user_id):
+        record = self._records.get(user_id)
+        return record.handle if record else str(user_id)
+
+    def find(self, mention):
+        """Id del @usuario mencionado, o None si no se conoce"""
+        return self._by_username.get(mention.lstrip("@").lower())
+
+    def new_placeholder(self):
+        """Siguiente id provisorio para una @mención desconocida"""
+        if self.placeholder_source is not None:
+            return self.placeholder_source()
+        return self._next_placeholder
+
+    def update(self, user_id, username, first_name):
+        """Guardar los datos del usuario. Devuelve (cambió, id provisorio reemplazado)"""
+        record = self._records.get(user_id)
+        if (
+            record is not None
+            and record.username == username
+            and record.first_name == first_name
+        ):
+            return False, None
+
+        replaced = None
+        if username:
+            username = intern(username)
+            key = username.lower()
+            other = self._by_username.get(key)
+            if other is not None and other != user_id:
+                if other < 0:
+                    replaced = other
+                    del self._records[other]
+                else:
+                    # Los usuarios son únicos: el otro ya no lo usa
+                    record_other = self._records[other]
+                    record_other.set_names(None, record_other.first_name)
+                    self.version += 1
+        if record is None:
+            record = self._records[user_id] = UserRecord(user_id, username, first_name)
+        else:
+            old = record.username
+            if old and self._by_username.get(old.lower()) == user_id:
+                del self._by_username[old.lower()]
+            record.set_names(username, first_name)
+            self.version += 1  # Cambió un nombre que ya se pudo haber mostrado
+        if username:
+            self._by_username[username.lower()] = user_id
+        if user_id <= self._next_placeholder:
+            self._next_placeholder = user_id - 1
+        return True, replaced
+
+    def set_notify(self, user_id, enabled):
+        """Activar o desactivar los avisos privados. Devuelve si cambió"""
+        record = self._records.get(user_id)
+        if record is None or record.notify == enabled:
+            return False
+        record.notify = enabled
+        return True
+
+    def wants_notifications(self, user_id):
+        record = self._records.get(user_id)
+        return record is not None and record.notify
+
+    def clear(self):
+        self._records.clear()
+        self._by_username.clear()
+        self._next_placeholder = -1
+        self.version += 1
+
+    # Snapshots
+    def to_dict(self):
+        return [
+            [r.user_id, r.username, r.first_name, r.notify]
+            for r in self._records.values()
+        ]
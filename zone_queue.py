@@ -0,0 +1,304 @@
+# zone_queue.py
+"""Zonas y lista de espera con índices para búsquedas O(1)."""
+
+from heapq import heappush, heappop
+
+LIBRE = "Libre"  # Hueco en la lista de espera que otro usuario puede tomar
+
+# Compactar la lista cuando la cabeza supere este tamaño y la mitad de la lista
+_COMPACT_MIN = 64
+
+
+def zone_names(count):
+    """Nombres de las zonas de un chat con ``count`` zonas: z1, z2, ..."""
+    return tuple(f"z{i}" for i in range(1, count + 1))
+
+
+class ZoneQueue:
+    """Zonas y lista de espera de un chat.
+
+    La lista de espera se guarda en posiciones absolutas a partir de ``_head``
+    (rotar solo avanza la cabeza), con un índice usuario -> posición y un heap
+    con las posiciones "Libre" para que cada operación cueste lo mismo sin
+    importar el largo de la lista.
+
+    ``zones_version`` y ``waiting_version`` aumentan con cada cambio en las
+    zonas o en la lista de espera (sirven como clave de cache al renderizar).
+    """
+
+    __slots__ = (
+        "zones",
+        "zones_version",
+        "waiting_version",
+        "_zone_of",
+        "_slots",
+        "_head",
+        "_index",
+        "_free",
+    )
+
+    def __init__(self, zone_names):
+        self.zones = {zone: None for zone in zone_names}
+        self.zones_version = 0
+        self.waiting_version = 0
+        self._zone_of = {}  # usuario -> zona
+        self._slots = []  # usuarios o LIBRE; las posiciones < _head ya salieron
+        self._head = 0
+        self._index = {}  # usuario -> posición absoluta en _slots
+        self._free = []  # heap de posiciones absolutas con LIBRE
+
+    # Lectura
+    def __len__(self):
+        return len(self._slots) - self._head
+
+    def waiting(self, start=0, stop=None):
+        """Iterar la lista de espera en orden (incluye los "Libre"), o solo
+        las posiciones [start, stop) sin recorrer las anteriores"""
+        slots = self._slots
+        end = len(slots) if stop is None else min(len(slots), self._head + stop)
+        return (slots[i] for i in range(self._head + start, end))
+
+    def zone_of(self, user):
+        return self._zone_of.get(user)
+
+    def is_waiting(self, user):
+        return user in self._index
+
+    def position(self, user):
+        """Posición (desde 0) del usuario en la lista de espera, o None"""
+        index = self._index.get(user)
+        return None if index is None else index - self._head
+
+    def locate(self, user):
+        """("zone", zona), ("wait", posición) o None"""
+        zone = self._zone_of.get(user)
+        if zone is not None:
+            return ("zone", zone)
+        index = self._index.get(user)
+        if index is not None:
+            return ("wait", index - self._head)
+        return None
+
+    def has_free(self):
+        return self._peek_free() is not None
+
+    # Mutaciones
+    def assign(self, zone, user):
+        """Asignar el usuario a una zona vacía"""
+        self.zones[zone] = user
+        self._zone_of[user] = zone
+        self.zones_version += 1
+
+    def vacate(self, zone):
+        """Vaciar la zona y devolver a quien la ocupaba"""
+        user = self.zones[zone]
+        if user is not None:
+            self.zones[zone] = None
+            del self._zone_of[user]
+            self.zones_version += 1
+        return user
+
+    def enqueue(self, user):
+        self._index[user] = len(self._slots)
+        self._slots.append(user)
+        self.waiting_version += 1
+
+    def leave(self, user):
+        """Sacar al usuario de su zona y dejar "Libre" su lugar en la espera"""
+        removed = []
+        zone = self._zone_of.pop(user, None)
+        if zone is not None:
+            self.zones[zone] = None
+            self.zones_version += 1
+            removed.append(zone)
+        index = self._index.pop(user, None)
+        if index is not None:
+            self._slots[index] = LIBRE
+            heappush(self._free, index)
+            self.waiting_version += 1
+            removed.append("wait")
+        return removed
+
+    def take_free(self, user):
+        """Ocupar el primer lugar "Libre" de la lista; False si no hay"""
+        index = self._peek_free()
+        if index is None:
+            return False
+        heappop(self._free)
+        self._slots[index] = user
+        self._index[user] = index
+        self.waiting_version += 1
+        return True
+
+    def swap(self, user1, user2):
+        """Intercambiar lugares; si solo uno está, el otro ocupa su lugar"""
+        pos1 = self._unindex(user1)
+        pos2 = self._unindex(user2)
+        if pos1 is None and pos2 is None:
+            return False
+        if pos1 is not None:
+            self._put(pos1, user2)
+        if pos2 is not None:
+            self._put(pos2, user1)
+        self.zones_version += 1
+        self.waiting_version += 1
+        return True
+
+    def rename(self, old, new):
+        """Reemplazar al usuario ``old`` por ``new`` donde esté; si ``new`` ya
+        tiene un lugar, el de ``old`` queda libre como con leave(). False si
+        ``old`` no estaba"""
+        if self.locate(new) is not None:
+            return bool(self.leave(old))
+        pos = self._unindex(old)
+        if pos is None:
+            return False
+        self._put(pos, new)
+        self.zones_version += 1
+        self.waiting_version += 1
+        return True
+
+    def rotate(self):
+        """Pasar los primeros de la espera a las zonas; devuelve [(zona, usuario)]"""
+        self._zone_of.clear()
+        promoted = []
+        slots = self._slots
+        for zone in self.zones:
+            user = None
+            if self._head < len(slots):
+                user = slots[self._head]
+                slots[self._head] = None
+                self._head += 1
+                if user == LIBRE:
+                    user = None
+                else:
+                    del self._index[user]
+                    self._zone_of[user] = zone
+                    promoted.append((zone, user))
+            self.zones[zone] = user
+        self._compact()
+        self.zones_version += 1
+        self.waiting_version += 1
+        return promoted
+
+    def promote(self, zone):
+        """Pasar el primero de la espera a la zona vacía (los "Libre" del
+        frente se descartan); devuelve el usuario o None si no hay nadie"""
+        slots = self._slots
+        user = None
+        while user is None and self._head < len(slots):
+            user = slots[self._head]
+            slots[self._head] = None
+            self._head += 1
+            if user == LIBRE:
+                user = None
+            else:
+                del self._index[user]
+                self.assign(zone, user)
+            self.waiting_version += 1
+        self._compact()
+        return user
+
+    def reorder(self, users):
+        """Pasar a los ``users`` que están en la espera al frente, en ese
+        orden; los demás (y los "Libre") siguen detrás sin cambiar su orden.
+        Devuelve los que se movieron"""
+        moved = [user for user in dict.fromkeys(users) if user in self._index]
+        if moved:
+            front = set(moved)
+            rest = [slot for slot in self.waiting() if slot not in front]
+            self._slots = []
+            self._head = 0
+            self._index.clear()
+            self._free = []
+            self._fill(moved + rest)
+            self.waiting_version += 1
+        return moved
+
+    def resize(self, zone_names):
+        """Cambiar las zonas del chat; quien ocupaba una zona eliminada la
+        deja. Devuelve [(zona, usuario)] de los desalojados"""
+        zones = {zone: self.zones.get(zone) for zone in zone_names}
+        evicted = []
+        for zone, user in self.zones.items():
+            if zone not in zones and user is not None:
+                del self._zone_of[user]
+                evicted.append((zone, user))
+        self.zones = zones
+        self.zones_version += 1
+        return evicted
+
+    def clear(self):
+        for zone in self.zones:
+            self.zones[zone] = None
+        self._zone_of.clear()
+        self._slots = []
+        self._head = 0
+        self._index.clear()
+        self._free = []
+        self.zones_version += 1
+        self.waiting_version += 1
+
+    # Snapshots
+    def to_dict(self):
+        return {"zones": dict(self.zones), "waiting": list(self.waiting())}
+
+    @classmethod
+    def from_dict(cls, data):
+        queue = cls(data["zones"])
+        for zone, user in data["zones"].items():
+            if user is not None:
+                queue.assign(zone, user)
+        queue._fill(data["waiting"])
+        return queue
+
+    # Internos
+    def _fill(self, waiting):
+        """Agregar usuarios y "Libre" al final de la espera"""
+        for user in waiting:
+            if user == LIBRE:
+                heappush(self._free, len(self._slots))
+                self._slots.append(LIBRE)
+            else:
+                self.enqueue(user)
+
+    def _peek_free(self):
+        free = self._free
+        while free:
+            index = free[0]
+            if index >= self._head and self._slots[index] == LIBRE:
+                return index
+            heappop(free)  # Entrada vieja: el lugar ya se tomó o ya rotó
+        return None
+
+    def _unindex(self, user):
+        zone = self._zone_of.pop(user, None)
+        if zone is not None:
+            return ("zone", zone)
+        index = self._index.pop(user, None)
+        if index is not None:
+            return ("wait", index)
+        return None
+
+    def _put(self, pos, user):
+        kind, where = pos
+        if kind == "zone":
+            self.zones[where] = user
+            self._zone_of[user] = where
+        else:
+            self._slots[where] = user
+            self._index[user] = where
+
+    def _compact(self):
+        head = self._head
+        if head == len(self._slots):
+            self._slots = []
+            self._head = 0
+            self._free = []
+        elif head > _COMPACT_MIN and head * 2 > len(self._slots):
+            self._slots = self._slots[head:]
+            self._head = 0
+            for user in self._index:
+                self._index[user] -= head
+            self._free = [i - head for i in self._free if i >= head]
+            self._free.sort()